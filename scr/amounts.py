@@ -0,0 +1,142 @@
+# amounts.py
+import re
+import numpy as np
+import pandas as pd
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Iterable, Optional, Tuple
+
+# 结算报表中常见的货币符号与代码
+CURRENCY_PATTERN = r"(?:US\$|CA\$|C\$|MX\$|A\$|USD|CAD|MXN|EUR|GBP|JPY|AUD|[$€£¥])"
+NUMBER_PATTERN = re.compile(r"^(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$")
+# int64 以“分”为单位可安全容纳的最大整数位数
+MAX_INTEGER_DIGITS = 15
+
+
+def _normalize_text(text: str) -> Tuple[Optional[str], bool]:
+    """
+    去掉货币符号、千分位与括号，返回 ("1234.56", 是否为负)
+    无法识别的格式返回 (None, False)
+    """
+    text = text.strip()
+    negative = False
+    if text.startswith("(") and text.endswith(")"):
+        negative, text = True, text[1:-1].strip()
+    text = re.sub(r"\s", "", re.sub(CURRENCY_PATTERN, "", text))
+    if text.endswith("-"):
+        negative, text = not negative, text[:-1]
+    elif text.startswith("-"):
+        negative, text = not negative, text[1:]
+    elif text.startswith("+"):
+        text = text[1:]
+
+    last_dot, last_comma = text.rfind("."), text.rfind(",")
+    if last_comma > last_dot and (last_dot >= 0 or re.fullmatch(r"\d+,\d{1,2}", text)):
+        # 欧式写法 1.234,56 / 12,5
+        text = text.replace(".", "").replace(",", ".")
+    else:
+        text = text.replace(",", "")
+    if not NUMBER_PATTERN.match(text):
+        return None, False
+    return text, negative
+
+
+def parse_cents(value, scale: int = 2) -> Optional[int]:
+    """
+    把单个金额解析为定点整数（默认单位为分），空值返回 None
+    支持千分位、括号负数、货币符号；超出精度的位按四舍五入（与 NUMERIC 一致）
+
+    :raises ValueError: 无法识别的金额
+    """
+    if value is None:
+        return None
+    if isinstance(value, float):
+        if np.isnan(value):
+            return None
+        value = repr(value)
+    text = str(value)
+    if not text.strip():
+        return None
+    normalized, negative = _normalize_text(text)
+    if normalized is None:
+        raise ValueError(f"无法识别的金额: {value!r}")
+    try:
+        quantized = Decimal(normalized).quantize(Decimal(1).scaleb(-scale), rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f"无法识别的金额: {value!r}")
+    units = int(quantized.scaleb(scale))
+    return -units if negative else units
+
+
+def parse_cents_array(values: Iterable, scale: int = 2) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    向量化解析一整列金额
+
+    :return: (int64 定点数组, 无法解析的掩码)；空值记为 0 且不视为错误
+    """
+    series = pd.Series(list(values), dtype="object")
+    text = series.astype("string").str.strip()
+    blank = (text.isna() | (text == "")).fillna(True).to_numpy()
+    # 空单元格按空文本处理；整列为空（如 Excel 中未填写的列）时 str.partition 不会产生三列
+    text = text.fillna("")
+
+    # 只有包住整个金额的一对括号表示负数，其余位置的括号视为无法识别
+    negative = (text.str.startswith("(") & text.str.endswith(")")).fillna(False)
+    cleaned = text.where(~negative, text.str[1:-1])
+    cleaned = (cleaned.str.replace(CURRENCY_PATTERN, "", regex=True)
+                      .str.replace(r"\s", "", regex=True))
+    # 与 _normalize_text 一致：只去掉一个符号，末尾负号优先
+    trailing_minus = cleaned.str.endswith("-").fillna(False)
+    leading_minus = ~trailing_minus & cleaned.str.startswith("-").fillna(False)
+    leading_plus = ~trailing_minus & ~leading_minus & cleaned.str.startswith("+").fillna(False)
+    cleaned = cleaned.where(~trailing_minus, cleaned.str[:-1])
+    cleaned = cleaned.where(~(leading_minus | leading_plus), cleaned.str[1:])
+    negative = negative ^ (leading_minus | trailing_minus)
+
+    last_dot, last_comma = cleaned.str.rfind("."), cleaned.str.rfind(",")
+    comma_decimal = ((last_comma > last_dot)
+                     & ((last_dot >= 0) | cleaned.str.fullmatch(r"\d+,\d{1,2}"))).fillna(False)
+    cleaned = cleaned.where(
+        ~comma_decimal,
+        cleaned.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    ).where(comma_decimal, cleaned.str.replace(",", "", regex=False))
+
+    parts = cleaned.str.partition(".")
+    integer, fraction = parts[0], parts[2]
+    well_formed = cleaned.str.fullmatch(r"\d+\.?\d*|\.\d+").fillna(False).to_numpy()
+    fits = (integer.str.len() <= MAX_INTEGER_DIGITS).fillna(False).to_numpy()
+    simple = well_formed & fits & (fraction.str.len() <= scale).fillna(False).to_numpy() & ~blank
+
+    cents = np.zeros(len(series), dtype=np.int64)
+    if simple.any():
+        int_part = integer[simple].replace("", "0").astype("int64").to_numpy()
+        frac_part = fraction[simple].str.pad(scale, side="right", fillchar="0")
+        frac_part = frac_part.replace("", "0").astype("int64").to_numpy() if scale else 0
+        cents[simple] = int_part * (10 ** scale) + frac_part
+    cents[simple & negative.to_numpy()] *= -1
+
+    invalid = np.zeros(len(series), dtype=bool)
+    # 位数超出精度、超长等少数情况逐个用 Decimal 精确处理
+    for i in np.flatnonzero(~simple & ~blank):
+        try:
+            parsed = parse_cents(series.iat[i], scale)
+            if parsed is None or abs(parsed) >= 10 ** (MAX_INTEGER_DIGITS + scale):
+                raise ValueError(series.iat[i])
+            cents[i] = parsed
+        except ValueError:
+            invalid[i] = True
+    return cents, invalid
+
+
+def format_cents(units: int, scale: int = 2) -> str:
+    """定点整数 → 精确的十进制文本（用于 COPY），如 -1234 → "-12.34" """
+    units = int(units)
+    sign = "-" if units < 0 else ""
+    whole, frac = divmod(abs(units), 10 ** scale)
+    if not scale:
+        return f"{sign}{whole}"
+    return f"{sign}{whole}.{frac:0{scale}d}"
+
+
+def check_total(cents: np.ndarray, expected: int) -> int:
+    """向量化合计校验，返回差额（0 表示一致）"""
+    return int(cents.sum(dtype=np.int64)) - int(expected)
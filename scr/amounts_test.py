@@ -0,0 +1,86 @@
+# amounts_test.py
+import random
+import numpy as np
+import pytest
+from amounts import parse_cents, parse_cents_array, format_cents, check_total
+
+CASES = [
+    ("12.34", 1234),
+    ("-12.34", -1234),
+    ("(12.34)", -1234),
+    ("12.34-", -1234),
+    ("+5", 500),
+    ("1,234,567.89", 123456789),
+    ("(1,234.50)", -123450),
+    ("1.234,56", 123456),
+    ("12,5", 1250),
+    ("$1,000", 100000),
+    ("USD 7.10", 710),
+    (" .5 ", 50),
+    ("0.005", 1),
+    ("-0.005", -1),
+    ("1e3", 100000),
+    (10.5, 1050),
+    (3, 300),
+]
+
+
+@pytest.mark.parametrize("text,expected", CASES)
+def test_parse_cents(text, expected):
+    assert parse_cents(text) == expected
+
+
+def test_scalar_and_vectorized_agree():
+    values = [text for text, _ in CASES] + [None, "", "  ", float("nan")]
+    cents, invalid = parse_cents_array(values)
+    assert not invalid.any()
+    expected = [parse_cents(v) or 0 for v in values]
+    assert cents.tolist() == expected
+    assert cents.dtype == np.int64
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_scalar_and_vectorized_agree_on_random_text(seed):
+    """随机组合数字、符号、括号、千分位与货币符号：两条路径对合法性与数值的判断一致"""
+    rng = random.Random(seed)
+    alphabet = "0123456789.,-+() $€"
+    values = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 10))) for _ in range(20000)]
+    cents, invalid = parse_cents_array(values)
+    for value, units, bad in zip(values, cents.tolist(), invalid.tolist()):
+        try:
+            expected = parse_cents(value) or 0
+        except ValueError:
+            assert bad, value
+        else:
+            assert not bad and units == expected, value
+
+
+def test_vectorized_marks_invalid():
+    bad = ["abc", "1.2.3", "--1", "+5-", "5--", "(-)"]
+    cents, invalid = parse_cents_array(["1.00"] + bad + ["2.00"])
+    assert invalid.tolist() == [False] + [True] * len(bad) + [False]
+    assert cents[[0, -1]].tolist() == [100, 200]
+    for text in bad:
+        with pytest.raises(ValueError):
+            parse_cents(text)
+
+
+def test_all_blank_column():
+    """Excel 中整列未填写时取值全为 None"""
+    cents, invalid = parse_cents_array([None, None])
+    assert cents.tolist() == [0, 0]
+    assert not invalid.any()
+
+
+def test_scale():
+    assert parse_cents("1.23456", scale=4) == 12346
+    cents, invalid = parse_cents_array(["1.23456", "7"], scale=4)
+    assert cents.tolist() == [12346, 70000] and not invalid.any()
+
+
+def test_format_and_total():
+    assert [format_cents(v) for v in (-1234, 5, 100, 0)] == ["-12.34", "0.05", "1.00", "0.00"]
+    assert format_cents(7, scale=0) == "7"
+    cents, _ = parse_cents_array(["1.10", "2.20", "-0.30"])
+    assert check_total(cents, 300) == 0
+    assert check_total(cents, 301) == -1
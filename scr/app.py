@@ -1,16 +1,16 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import os
-import csv
-import pandas as pd
-import json
 from datetime import datetime
 import traceback
-import hashlib
-import psycopg2
-from psycopg2 import Error, OperationalError, sql
-from config import USER_ACTION_LOGGER, DatabaseConfig
-from database_manager import DatabaseManager
+import threading
+from config import USER_ACTION_LOGGER
+from ingest import DuplicateUploadError, EmptyFileError, UploadInProgressError
+from async_ingest import AsyncIngestEngine, TkAsyncBridge
+from profiling import SETTINGS as PROFILE_SETTINGS
+from exporter import export_transactions
+from local_replica import LocalReplica
+from data_browser import DataBrowser
 
 
 class FileUploadApp:
@@ -19,6 +19,10 @@ class FileUploadApp:
         self.root.title("File Upload System")
         self.root.geometry("600x450")
         self.current_user = "guest"
+        # 最近一次成功上传的批次，数据浏览默认只显示该批次
+        self.last_upload_id = None
+        # 上传在后台事件循环中进行，界面保持响应，可同时处理多个文件
+        self.ingest_bridge = TkAsyncBridge(root, AsyncIngestEngine())
         
         # 初始化 StringVar 变量
         self.country_var = tk.StringVar()  # 先初始化
@@ -48,6 +52,7 @@ class FileUploadApp:
         # Set up event bindings
         self.country_var.trace_add('write', self.update_ui)
         self.platform_var.trace_add('write', self.update_ui)
+        self.refresh_replica_status()
         
     def create_static_widgets(self):
         """创建固定位置的组件"""
@@ -94,9 +99,19 @@ class FileUploadApp:
         self.browse_btn = ttk.Button(self.main_frame, text="Browse...", command=self.browse_file)
         
         self.upload_btn = ttk.Button(self.main_frame, text="Upload", command=self.upload_file)
+        self.export_btn = ttk.Button(self.main_frame, text="Export...", command=self.open_export_dialog)
+        self.profile_var = tk.BooleanVar(value=PROFILE_SETTINGS.rate >= 1)
+        self.profile_check = ttk.Checkbutton(self.main_frame, text="Profile uploads",
+                                             variable=self.profile_var, command=self.toggle_profiling)
         
         self.log_label = ttk.Label(self.main_frame, text="Operation Log:")
+        self.browse_data_btn = ttk.Button(self.main_frame, text="Browse Data...", command=self.open_data_browser)
         self.log_text = tk.Text(self.main_frame, height=8, state='disabled')
+
+        # 本地副本（离线报表）新鲜度
+        self.replica_var = tk.StringVar()
+        self.replica_label = ttk.Label(self.main_frame, textvariable=self.replica_var)
+        self.sync_btn = ttk.Button(self.main_frame, text="Sync Replica", command=self.sync_replica)
         
         self.update_ui()
 
@@ -107,7 +122,8 @@ class FileUploadApp:
 
         for widget in [self.data_type_label, self.data_type_combo,
                       self.file_label, self.file_entry, self.browse_btn,
-                      self.upload_btn, self.log_label, self.log_text]:
+                      self.upload_btn, self.export_btn, self.profile_check,
+                      self.log_label, self.browse_data_btn, self.log_text, self.replica_label, self.sync_btn]:
             widget.grid_forget()
 
         base_row = 3
@@ -121,11 +137,16 @@ class FileUploadApp:
         self.browse_btn.grid(row=base_row, column=2, pady=5, padx=5)
         base_row += 1
 
+        self.profile_check.grid(row=base_row, column=0, sticky=tk.W, pady=20)
         self.upload_btn.grid(row=base_row, column=1, pady=20)
+        self.export_btn.grid(row=base_row, column=2, pady=20, padx=5)
         base_row += 1
 
         self.log_label.grid(row=base_row, column=0, sticky=tk.W, pady=5)
+        self.browse_data_btn.grid(row=base_row, column=2, pady=5, padx=5)
         self.log_text.grid(row=base_row+1, column=0, columnspan=3, sticky=tk.NSEW, pady=5)
+        self.replica_label.grid(row=base_row+2, column=0, columnspan=2, sticky=tk.W, pady=5)
+        self.sync_btn.grid(row=base_row+2, column=2, pady=5, padx=5)
 
         if country and platform:
             channels = self.channel_data.get((country, platform), [])
@@ -133,10 +154,55 @@ class FileUploadApp:
             self.channel_combo['state'] = 'readonly' if channels else 'disabled'
             self.channel_combo.set(channels[0] if channels else '')
 
+    def toggle_profiling(self):
+        enabled = self.profile_var.get()
+        PROFILE_SETTINGS.force(enabled)
+        USER_ACTION_LOGGER.info("切换上传剖析", extra={
+            "user": self.current_user, "user_action": "PROFILING_TOGGLED", "enabled": enabled
+        })
+        self.add_log("上传剖析已开启，报告写入 logs/profiles" if enabled else "上传剖析已关闭")
+
+    def refresh_replica_status(self):
+        """每分钟刷新本地副本新鲜度（只读本地状态，不访问数据库）"""
+        self.replica_var.set(LocalReplica().describe_freshness())
+        self.root.after(60 * 1000, self.refresh_replica_status)
+
+    def sync_replica(self):
+        """后台线程同步本地副本，日志与结果回到 Tk 主线程显示"""
+        self.sync_btn.config(state='disabled')
+        user = self.current_user
+        USER_ACTION_LOGGER.info("同步本地副本", extra={"user": user, "user_action": "REPLICA_SYNC_STARTED"})
+
+        def run():
+            try:
+                result = LocalReplica().sync(
+                    user=user, on_log=lambda message: self.ingest_bridge.call_in_tk(self.add_log, message)
+                )
+                self.ingest_bridge.call_in_tk(self._on_replica_synced, result, None)
+            except Exception as e:
+                self.ingest_bridge.call_in_tk(self._on_replica_synced, None, e)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _on_replica_synced(self, result, error):
+        self.sync_btn.config(state='normal')
+        self.replica_var.set(LocalReplica().describe_freshness())
+        if error is not None:
+            USER_ACTION_LOGGER.error("本地副本同步异常", extra={
+                "user": self.current_user,
+                "user_action": "REPLICA_SYNC_FAILED",
+                "error_type": type(error).__name__,
+                "error_msg": str(error)
+            })
+            self.add_log(f"❌ 本地副本同步失败: {str(error)}")
+            return
+        self.add_log(f"✅ 本地副本已同步 {result['uploads']} 次上传（{result['rows']:,} 行）")
+
     def browse_file(self):
         file_path = filedialog.askopenfilename(
             filetypes=[("TXT Files", "*.txt"), ("CSV Files", "*.csv"), 
-                      ("Excel Files", "*.xlsx"), ("All Files", "*.*")]
+                      ("Excel Files", "*.xlsx"), ("Archives", "*.gz *.zip *.bz2"),
+                      ("All Files", "*.*")]
         )
         log_data = {
             "user": self.current_user,
@@ -194,145 +260,174 @@ class FileUploadApp:
             messagebox.showerror("错误", "文件不存在")
             return
             
-        try:
-            file_hash = self.calculate_file_hash(file_path)
-            if self.check_duplicate_upload(file_hash):
-                USER_ACTION_LOGGER.warning("重复文件检测", extra=audit_data)
-                messagebox.showwarning("警告", "该文件已上传过")
-                return
+        self.add_log(f"▶ 开始处理文件: {os.path.basename(file_path)}")
+        self.ingest_bridge.ingest(
+            file_path, audit_data, self.current_user,
+            on_log=self.add_log,
+            on_done=lambda future: self._on_upload_done(audit_data, future)
+        )
 
-            # 核心上传流程
-            self.add_log("▶ 开始处理文件...")
-            file_data = self.parse_file(file_path)
-            table_name = self._generate_table_name(country, platform, channel, data_type)
-            
-            success_count = 0
-            with DatabaseManager() as db:
-                for idx, record in enumerate(file_data, 1):
-                    full_record = {
-                        "country_code": country,
-                        "platform": platform.replace(" ", "_"),
-                        "channel": channel.replace(" ", "_"),
-                        "data_type": data_type,
-                        "transaction_date": datetime.now().date(),
-                        "amount": float(record.get("amount", 0)),
-                        "raw_data": json.dumps(record)
-                    }
-                    if "transaction_date" in record:
-                        try:
-                            full_record["transaction_date"] = datetime.strptime(
-                                str(record["transaction_date"]), "%Y-%m-%d"
-                            ).date()
-                        except Exception as e:
-                            self.add_log(f"⚠️ 记录{idx}日期错误: {str(e)}")
-                    
-                    if db.insert_data(table_name, full_record):
-                        success_count += 1
-                    
-                    if idx % 10 == 0:
-                        self.add_log(f"📊 进度: {idx}/{len(file_data)}")
-                        self.root.update()
-
-                db.record_upload(os.path.basename(file_path), file_hash, audit_data)
-
-            # 在计算成功率前添加空值检查
-            if len(file_data) == 0:
-                messagebox.showerror("错误", "文件内容为空")
-                return
+    def _on_upload_done(self, audit_data, future):
+        """上传完成回调（在 Tk 主线程中执行）"""
+        try:
+            result = future.result()
+            total = result["total"]
+            success_count = result["inserted"]
+            success_rate = (success_count / total) * 100 if total > 0 else 0
+            self.last_upload_id = result["upload_id"]
 
-            # 修改计算逻辑
-            success_rate = (success_count / len(file_data)) * 100 if len(file_data) > 0 else 0
-                            
             msg = f"""
             🎉 上传成功！
-            成功记录: {success_count}/{len(file_data)} ({success_rate:.1f}%)
-            目标表名: {table_name}
+            文件: {audit_data["file_name"]}
+            成功记录: {success_count}/{total} ({success_rate:.1f}%)
+            跳过重复: {result["skipped"]}
+            校验剔除: {result["rejected"]}
+            目标表名: {result["table_name"]}
             """
+            if result["reject_file"]:
+                msg += f"剔除明细: {result['reject_file']}"
             messagebox.showinfo("上传结果", msg.strip())
             self.add_log(msg.replace("\n", " "))
 
+        except UploadInProgressError as e:
+            USER_ACTION_LOGGER.warning("文件正由其他用户上传", extra={
+                **audit_data, "claimed_by": e.claimed_by, "claimed_at": str(e.claimed_at)
+            })
+            holder = f"（{e.claimed_by}，开始于 {e.claimed_at:%H:%M}）" if e.claimed_by and e.claimed_at else ""
+            messagebox.showwarning("警告", f"该文件正在由其他用户上传{holder}: {audit_data['file_name']}")
+
+        except DuplicateUploadError:
+            USER_ACTION_LOGGER.warning("重复文件检测", extra=audit_data)
+            messagebox.showwarning("警告", f"该文件已上传过: {audit_data['file_name']}")
+
+        except EmptyFileError:
+            messagebox.showerror("错误", f"文件内容为空: {audit_data['file_name']}")
+
         except Exception as e:
             error_msg = f"❌ 上传失败: {str(e)}"
             error_audit = audit_data.copy()
             error_audit.update({
                 "error_type": type(e).__name__,
                 "error_msg": str(e),
-                "traceback": traceback.format_exc()
+                "traceback": "".join(traceback.format_exception(type(e), e, e.__traceback__))
             })
             USER_ACTION_LOGGER.error("上传异常", extra=error_audit)
             messagebox.showerror("错误", error_msg)
             self.add_log(error_msg)
 
-    def parse_file(self, file_path: str) -> list:
-        ext = os.path.splitext(file_path)[1].lower()
-        try:
-            if ext == '.txt':
-                return self._parse_txt(file_path)
-            elif ext == '.csv':
-                return self._parse_csv(file_path)
-            elif ext in ('.xls', '.xlsx'):
-                return self._parse_excel(file_path)
-            else:
-                raise ValueError("不支持的文件格式")
-        except Exception as e:
-            USER_ACTION_LOGGER.error("文件解析失败", extra={
-                "file": file_path,
-                "error": str(e)
-            })
-            raise
-
-    def _parse_txt(self, file_path: str) -> list:
-        data = []
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                parts = line.strip().split('|')
-                if len(parts) == 3:
-                    try:
-                        data.append({
-                            "transaction_date": parts[0],
-                            "amount": parts[1],
-                            "description": parts[2]
-                        })
-                    except:
-                        continue
-        return data
-
-    def _parse_csv(self, file_path: str) -> list:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            if 'amount' not in reader.fieldnames:
-                raise ValueError("CSV文件必须包含amount列")
-            return list(reader)
-
-    def _parse_excel(self, file_path: str) -> list:
-        df = pd.read_excel(file_path)
-        if 'amount' not in df.columns:
-            raise ValueError("Excel文件必须包含amount列")
-        return df.replace({pd.NaT: None}).to_dict('records')
-
-    def calculate_file_hash(self, file_path: str) -> str:
-        hasher = hashlib.sha256()
-        with open(file_path, 'rb') as f:
-            while chunk := f.read(8192):
-                hasher.update(chunk)
-        return hasher.hexdigest()
-
-    def check_duplicate_upload(self, file_hash: str) -> bool:
-        with DatabaseManager() as db:
-            return db.check_duplicate(file_hash)
-
-    def _generate_table_name(self, country: str, platform: str, channel: str, data_type: str) -> str:
-        elements = [
-            "country",
-            country.lower(),
-            platform.lower().replace(" ", "_"),
-            channel.lower().replace(" ", "_")
-        ]
-        if data_type:
-            elements.append(data_type.lower())
-        return "_".join(elements)
+    def open_export_dialog(self):
+        """按当前选择的国家/平台/渠道（可留空表示全部）与日期范围导出交易"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Export Transactions")
+        dialog.transient(self.root)
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+
+        filters = self._current_filters()
+        scope = " / ".join(v for v in filters.values() if v) or "全部"
+        ttk.Label(frame, text=f"范围: {scope}").grid(row=0, column=0, columnspan=2, sticky=tk.W, pady=5)
+
+        date_from_var, date_to_var = tk.StringVar(), tk.StringVar()
+        ttk.Label(frame, text="From (YYYY-MM-DD):").grid(row=1, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(frame, textvariable=date_from_var).grid(row=1, column=1, sticky=tk.EW, pady=5)
+        ttk.Label(frame, text="To (YYYY-MM-DD):").grid(row=2, column=0, sticky=tk.W, pady=5)
+        ttk.Entry(frame, textvariable=date_to_var).grid(row=2, column=1, sticky=tk.EW, pady=5)
+        progress_var = tk.StringVar()
+        ttk.Label(frame, textvariable=progress_var).grid(row=4, column=0, columnspan=2, sticky=tk.W)
+
+        export_btn = ttk.Button(frame, text="Export")
+        export_btn.grid(row=3, column=1, pady=10)
+        running = []
+
+        def show_progress(rows, written):
+            progress_var.set(f"已导出 {rows:,} 行 ({written / 1024 / 1024:.1f} MB)")
+
+        def on_close():
+            # 导出进行中不关闭窗口，结果与进度仍要回到该窗口
+            if not running:
+                dialog.destroy()
+
+        def on_done(audit_data, result, error):
+            running.clear()
+            export_btn.config(state='normal')
+            if error is not None:
+                USER_ACTION_LOGGER.error("导出异常", extra={
+                    **audit_data,
+                    "user_action": "EXPORT_FAILED",
+                    "error_type": type(error).__name__,
+                    "error_msg": str(error)
+                })
+                messagebox.showerror("错误", f"❌ 导出失败: {str(error)}", parent=dialog)
+                return
+            self.add_log(f"📤 已导出 {result['rows']} 行到 {result['path']}")
+            messagebox.showinfo("导出完成", f"已导出 {result['rows']:,} 行\n{result['path']}", parent=dialog)
+            dialog.destroy()
+
+        def run_export():
+            output_path = filedialog.asksaveasfilename(
+                parent=dialog,
+                defaultextension=".csv",
+                filetypes=[("CSV", "*.csv"), ("Gzip CSV", "*.csv.gz"), ("Parquet", "*.parquet")]
+            )
+            if not output_path:
+                return
+            user = self.current_user
+            audit_data = {
+                "user": user,
+                "user_action": "EXPORT_STARTED",
+                "file_name": os.path.basename(output_path),
+                **filters
+            }
+            USER_ACTION_LOGGER.info("导出启动", extra=audit_data)
+            export_filters = {**filters, "date_from": date_from_var.get(), "date_to": date_to_var.get()}
+            call_in_tk = self.ingest_bridge.call_in_tk
+            running.append(output_path)
+            export_btn.config(state='disabled')
+
+            # 导出在后台线程进行，进度与结果回到 Tk 主线程显示
+            def run():
+                try:
+                    result = export_transactions(
+                        output_path,
+                        export_filters,
+                        on_progress=lambda rows, written: call_in_tk(show_progress, rows, written),
+                        user=user
+                    )
+                    call_in_tk(on_done, audit_data, result, None)
+                except Exception as e:
+                    call_in_tk(on_done, audit_data, None, e)
+
+            threading.Thread(target=run, daemon=True).start()
+
+        export_btn.config(command=run_export)
+        dialog.protocol("WM_DELETE_WINDOW", on_close)
+        frame.columnconfigure(1, weight=1)
+
+    def open_data_browser(self):
+        """浏览当前选择范围内的数据（默认为最近一次上传的批次）"""
+        USER_ACTION_LOGGER.info("打开数据浏览", extra={
+            "user": self.current_user, "user_action": "BROWSE_OPENED", "upload_id": self.last_upload_id
+        })
+        DataBrowser(self.root, {**self._current_filters(), "upload_id": self.last_upload_id},
+                    self.current_user, self.ingest_bridge.call_in_tk)
+
+    def _current_filters(self):
+        """当前选择的国家/平台/渠道/数据类型（留空表示全部）"""
+        country = self.country_var.get()
+        platform = self.platform_var.get()
+        return {
+            "country": country,
+            "platform": platform,
+            "channel": self.channel_var.get(),
+            "data_type": self.data_type_combo.get() if (country == "US" and platform == "Amazon") else ""
+        }
+
+    def on_close(self):
+        self.ingest_bridge.shutdown()
+        self.root.destroy()
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = FileUploadApp(root)
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,162 @@
+# archive_store.py
+"""
+已归档交易（见 partition_archive）的只读访问
+归档文件为 Parquet，每个叶子分区、每个日期区间一个文件，由 manifest.json 登记
+"""
+import os
+import json
+import itertools
+import yaml
+import logging
+from pathlib import Path
+from datetime import date
+from typing import Dict, Iterator, List, Optional
+from ingest import BASE_DIR, CONFIG_DIR
+
+logger = logging.getLogger("ArchiveStore")
+
+ARCHIVE_CONFIG_PATH = CONFIG_DIR / "archive.yaml"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# 与 exporter.EXPORT_COLUMNS 一致，归档文件可直接并入导出结果
+ARCHIVE_COLUMNS = ("country_code", "platform", "channel", "data_type",
+                   "transaction_date", "amount", "raw_data", "upload_id")
+PARTITION_COLUMNS = ("country_code", "platform", "channel", "data_type")
+
+
+def load_archive_config(path: Path = ARCHIVE_CONFIG_PATH) -> dict:
+    """读取归档配置（文件缺失时返回空配置）"""
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def _require_pyarrow() -> None:
+    try:
+        import pyarrow.dataset
+    except ImportError:
+        raise RuntimeError("读取归档数据需要安装 pyarrow")
+
+
+def filter_expression(filters: Optional[Dict[str, List[str]]] = None,
+                      date_from: Optional[date] = None, date_to: Optional[date] = None):
+    """分区列与日期（含两端）筛选 → pyarrow.dataset 过滤表达式；没有条件时为 None"""
+    import pyarrow.dataset as ds
+    conditions = [ds.field(column).isin(values) for column, values in (filters or {}).items()]
+    if date_from:
+        conditions.append(ds.field("transaction_date") >= date_from)
+    if date_to:
+        conditions.append(ds.field("transaction_date") <= date_to)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+class ArchiveStore:
+    """
+    manifest.json 中的每一项：
+        {"partition", "bounds": {分区列: 取值或 null}, "date_from", "date_to"（不含）,
+         "rows", "amount_total", "file"（相对归档目录）, "sha256", "archived_at"}
+    同一分区的多个条目之间不重叠的是数据行而非日期区间：归档后又上传的旧日期数据会在下次归档时形成新文件
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        if directory is None:
+            directory = load_archive_config().get("directory", "archive")
+        self.directory = Path(directory) if os.path.isabs(directory) else BASE_DIR / directory
+        self.manifest_path = self.directory / MANIFEST_NAME
+        self._entries = None
+
+    @property
+    def entries(self) -> List[dict]:
+        if self._entries is None:
+            if self.manifest_path.exists():
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                self._entries = manifest.get("entries", [])
+            else:
+                self._entries = []
+        return self._entries
+
+    def add_entry(self, entry: dict) -> None:
+        """登记一个归档文件"""
+        self._write_manifest(self.entries + [entry])
+
+    def remove_entry(self, file: str) -> None:
+        """撤销登记（归档事务提交失败时调用）"""
+        self._write_manifest([e for e in self.entries if e["file"] != file])
+
+    def _write_manifest(self, entries: List[dict]) -> None:
+        # 先写临时文件再替换，manifest 不会处于半写状态
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".json.part")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "entries": entries}, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        self._entries = entries
+
+    def archived_before(self) -> Optional[date]:
+        """最近一次归档的截止日期（不含）；没有归档时为 None"""
+        if not self.entries:
+            return None
+        return max(date.fromisoformat(e["date_to"]) for e in self.entries)
+
+    def matching(self, filters: Optional[Dict[str, List[str]]] = None,
+                 date_from: Optional[date] = None, date_to: Optional[date] = None) -> List[dict]:
+        """
+        与筛选条件可能相关的归档条目（按日期排序）
+
+        :param filters: {分区列: [已规范化的取值]}
+        :param date_to: 含当天
+        """
+        filters = filters or {}
+        result = []
+        for entry in self.entries:
+            if date_to and date.fromisoformat(entry["date_from"]) > date_to:
+                continue
+            if date_from and date.fromisoformat(entry["date_to"]) <= date_from:
+                continue
+            bounds = entry.get("bounds", {})
+            # DEFAULT 分区（取值为 null）可能包含任何取值，只能在读取时过滤
+            if any(bounds.get(column) is not None and bounds[column] not in values
+                   for column, values in filters.items()):
+                continue
+            result.append(entry)
+        return sorted(result, key=lambda e: (e["date_from"], e["partition"]))
+
+    def iter_tables(self, filters: Optional[Dict[str, List[str]]] = None,
+                    date_from: Optional[date] = None, date_to: Optional[date] = None,
+                    columns=ARCHIVE_COLUMNS) -> Iterator:
+        """
+        逐个归档文件读取筛选后的 pyarrow.Table（每次只有一个文件的筛选结果在内存中）
+        """
+        entries = self.matching(filters, date_from, date_to)
+        if not entries:
+            return
+        _require_pyarrow()
+        import pyarrow.dataset as ds
+        expression = filter_expression(filters, date_from, date_to)
+        for entry in entries:
+            dataset = ds.dataset(str(self.directory / entry["file"]), format="parquet")
+            yield dataset.to_table(columns=list(columns), filter=expression)
+
+    def iter_sorted_tables(self, filters: Optional[Dict[str, List[str]]] = None,
+                           date_from: Optional[date] = None, date_to: Optional[date] = None) -> Iterator:
+        """
+        按交易日期顺序输出归档数据：起始日期相同的文件（同一批归档的各分区）合并后排序
+        """
+        entries = self.matching(filters, date_from, date_to)
+        if not entries:
+            return
+        _require_pyarrow()
+        import pyarrow.dataset as ds
+        expression = filter_expression(filters, date_from, date_to)
+        for _, group in itertools.groupby(entries, key=lambda e: e["date_from"]):
+            table = ds.dataset([str(self.directory / e["file"]) for e in group],
+                               format="parquet").to_table(columns=list(ARCHIVE_COLUMNS), filter=expression)
+            if table.num_rows:
+                yield table.sort_by("transaction_date")
@@ -0,0 +1,39 @@
+# archives.py
+import os
+import bz2
+import gzip
+import zipfile
+from typing import BinaryIO, Iterator, Tuple
+
+# 支持直接导入的压缩格式；哈希仍按原始压缩文件计算
+ARCHIVE_EXTENSIONS = ('.gz', '.zip', '.bz2')
+
+
+def is_archive(file_path: str) -> bool:
+    return os.path.splitext(file_path)[1].lower() in ARCHIVE_EXTENSIONS
+
+
+def _inner_name(file_path: str) -> str:
+    """report.csv.gz → report.csv"""
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def iter_members(file_path: str) -> Iterator[Tuple[str, BinaryIO]]:
+    """
+    逐个产出压缩包中的 (成员文件名, 解压后的二进制流)
+    流按需解压，不落临时文件；调用方负责关闭流
+    zip 中的目录与 macOS 资源文件（__MACOSX/）被跳过
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == '.gz':
+        yield _inner_name(file_path), gzip.open(file_path, 'rb')
+    elif ext == '.bz2':
+        yield _inner_name(file_path), bz2.open(file_path, 'rb')
+    elif ext == '.zip':
+        with zipfile.ZipFile(file_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                    continue
+                yield os.path.basename(info.filename), archive.open(info)
+    else:
+        raise ValueError(f"不支持的压缩格式: {ext}")
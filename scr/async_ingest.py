@@ -0,0 +1,269 @@
+# async_ingest.py
+import os
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+from database_manager import DatabaseManager
+from ingest import plan_ingest, transform_file, load_file, release_claim
+from profiling import SETTINGS, profile, sample
+
+logger = logging.getLogger("AsyncIngest")
+
+
+def _plan(file_path: str, metadata: dict, user: str, on_log, profile_dir=None) -> dict:
+    with profile("plan", profile_dir), DatabaseManager() as db:
+        return plan_ingest(file_path, metadata, db, on_log, user=user)
+
+
+def _transform(plan: dict, user: str, profile_dir=None, profile_memory=False):
+    """子进程中运行：回调无法跨进程，日志收集后随结果返回"""
+    messages = []
+    # 剖析设置显式传入：子进程看不到界面上的开关
+    with profile("transform", profile_dir, memory=profile_memory):
+        # 多个文件已在进程间并行，单个文件内不再启动进程池
+        transformed = transform_file(plan, user, messages.append, workers=1)
+    return transformed, messages
+
+
+def _load(plan: dict, transformed: dict, on_log, profile_dir=None) -> dict:
+    with profile("load", profile_dir), DatabaseManager() as db:
+        return load_file(plan, transformed, db, on_log)
+
+
+def _release(plan: dict) -> None:
+    with DatabaseManager() as db:
+        release_claim(plan, db)
+
+
+class _Job:
+    __slots__ = ("file_path", "metadata", "user", "on_log", "future", "plan", "transformed",
+                 "profile_dir")
+
+    def __init__(self, file_path, metadata, user, on_log, future):
+        self.file_path = file_path
+        self.metadata = metadata
+        self.user = user
+        self.on_log = on_log
+        self.future = future
+        self.plan = None
+        self.transformed = None
+        # 本次上传被抽中剖析时各阶段报告写入的目录
+        self.profile_dir = sample(file_path)
+
+
+class AsyncIngestEngine:
+    """
+    asyncio 上传核心：查重 → 解析/转换 → 加载 三个阶段由有界队列连接
+    解析在进程池中运行；数据库阶段在线程池中使用现有的 DatabaseManager
+    下游阻塞时上游停止取新任务（背压），内存中最多保留 queue_size 个已转换的批次
+    """
+
+    def __init__(self, parse_workers: Optional[int] = None, db_workers: int = 2,
+                 queue_size: int = 2):
+        self.parse_workers = parse_workers or max((os.cpu_count() or 2) - 1, 1)
+        self.db_workers = db_workers
+        self.queue_size = queue_size
+        self._tasks = []
+        self._loop = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._process_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+        self._thread_pool = ThreadPoolExecutor(max_workers=self.db_workers * 2)
+        self._incoming: asyncio.Queue = asyncio.Queue()
+        self._planned: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._transformed: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        stages = (
+            (self._incoming, self._planned, self._plan_stage, self.db_workers),
+            (self._planned, self._transformed, self._transform_stage, self.parse_workers),
+            (self._transformed, None, self._load_stage, self.db_workers),
+        )
+        for source, target, stage, count in stages:
+            for _ in range(count):
+                self._tasks.append(asyncio.create_task(self._worker(source, target, stage)))
+
+    async def close(self) -> None:
+        """
+        取消所有未完成的上传并释放它们的文件占用：
+        正在处理的任务由 _worker 释放，仍在队列中等待的任务在此释放
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for source in (self._incoming, self._planned, self._transformed):
+            while not source.empty():
+                job = source.get_nowait()
+                await self._abandon(job)
+                if not job.future.done():
+                    job.future.cancel()
+        self._process_pool.shutdown(wait=True)
+        self._thread_pool.shutdown(wait=True)
+
+    async def __aenter__(self) -> "AsyncIngestEngine":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    def submit(self, file_path: str, metadata: dict, user: str = "SYSTEM",
+               on_log: Optional[Callable[[str], None]] = None) -> asyncio.Future:
+        """
+        提交一个文件，返回在事件循环中完成的 Future（结果同 ingest_file）
+        on_log 总是在事件循环线程中调用
+        """
+        future = self._loop.create_future()
+        self._incoming.put_nowait(_Job(file_path, metadata, user, on_log, future))
+        return future
+
+    def _threadsafe_log(self, job: _Job) -> Callable[[str], None]:
+        if job.on_log is None:
+            return lambda message: None
+        return lambda message: self._loop.call_soon_threadsafe(job.on_log, message)
+
+    async def _worker(self, source: asyncio.Queue, target: Optional[asyncio.Queue], stage) -> None:
+        while True:
+            job = await source.get()
+            try:
+                if job.future.cancelled():
+                    await self._abandon(job)
+                    continue
+                await stage(job)
+                if target is not None:
+                    # 下游队列已满时在此等待
+                    await target.put(job)
+            except asyncio.CancelledError:
+                # 引擎关闭：CancelledError 不是 Exception，须单独释放占用
+                await self._abandon(job)
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                await self._abandon(job)
+                if not job.future.done():
+                    job.future.set_exception(e)
+            finally:
+                source.task_done()
+
+    async def _abandon(self, job: _Job) -> None:
+        """上传未完成：释放查重阶段取得的文件占用"""
+        if job.plan is None:
+            return
+        try:
+            await self._loop.run_in_executor(self._thread_pool, _release, job.plan)
+        except Exception:
+            logger.exception(f"Failed to release upload claim for {job.file_path}")
+        job.plan = None
+
+    @staticmethod
+    async def _uninterruptible(future: asyncio.Future):
+        """
+        等待执行器中的调用；被取消时仍等它结束再传递取消
+        （线程中的数据库操作无法中断，提前返回会丢失它取得的占用或已提交的结果）
+        """
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+    async def _plan_stage(self, job: _Job) -> None:
+        future = self._loop.run_in_executor(
+            self._thread_pool, _plan, job.file_path, job.metadata, job.user,
+            self._threadsafe_log(job), job.profile_dir
+        )
+        try:
+            job.plan = await self._uninterruptible(future)
+        except asyncio.CancelledError:
+            # 查重已成功时保留计划，以便 _abandon 释放它取得的占用
+            if future.exception() is None:
+                job.plan = future.result()
+            raise
+
+    async def _transform_stage(self, job: _Job) -> None:
+        job.transformed, messages = await self._loop.run_in_executor(
+            self._process_pool, _transform, job.plan, job.user, job.profile_dir, SETTINGS.memory
+        )
+        if job.on_log:
+            for message in messages:
+                job.on_log(message)
+
+    async def _load_stage(self, job: _Job) -> None:
+        future = self._loop.run_in_executor(
+            self._thread_pool, _load, job.plan, job.transformed, self._threadsafe_log(job),
+            job.profile_dir
+        )
+        try:
+            result = await self._uninterruptible(future)
+        except asyncio.CancelledError:
+            # 加载已提交：占用已转为上传历史，无需释放
+            if future.exception() is None:
+                job.plan = None
+                if not job.future.done():
+                    job.future.set_result(future.result())
+            raise
+        job.transformed = None  # 尽早释放批次
+        if not job.future.done():
+            job.future.set_result(result)
+
+
+class TkAsyncBridge:
+    """
+    在后台线程运行 asyncio 事件循环，并把回调送回 Tk 主线程
+    Tk 侧通过 root.after 轮询消息队列，任何 Tk 调用都只发生在主线程
+    """
+
+    def __init__(self, root, engine: AsyncIngestEngine, poll_ms: int = 50):
+        self.root = root
+        self.engine = engine
+        self.poll_ms = poll_ms
+        self._calls: "queue.Queue" = queue.Queue()
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        threading.Thread(target=self._run, args=(started,), daemon=True).start()
+        started.wait()
+        self.root.after(self.poll_ms, self._poll)
+
+    def _run(self, started: threading.Event) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.engine.start())
+        started.set()
+        self.loop.run_forever()
+
+    def _poll(self) -> None:
+        while True:
+            try:
+                func, args = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("Tk callback failed")
+        self.root.after(self.poll_ms, self._poll)
+
+    def call_in_tk(self, func: Callable, *args) -> None:
+        """可在任意线程调用：func 将在 Tk 主线程执行"""
+        self._calls.put((func, args))
+
+    def ingest(self, file_path: str, metadata: dict, user: str,
+               on_log: Callable[[str], None], on_done: Callable[[Future], None]) -> None:
+        """
+        提交上传；on_log 与 on_done(future) 都在 Tk 主线程中调用
+        """
+        async def run():
+            return await self.engine.submit(
+                file_path, metadata, user,
+                on_log=lambda message: self.call_in_tk(on_log, message)
+            )
+
+        future = asyncio.run_coroutine_threadsafe(run(), self.loop)
+        future.add_done_callback(lambda f: self.call_in_tk(on_done, f))
+
+    def shutdown(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.engine.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
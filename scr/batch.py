@@ -0,0 +1,137 @@
+# batch.py
+import numpy as np
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+from amounts import format_cents
+
+
+class RowBatch:
+    """
+    解析阶段的输出：共享一份表头，每行是一个元组
+    比逐行 dict 节省数倍内存；需要 dict 时用 row_dict() 临时生成
+    line_nos 为每行在源文件中的起始行号（解析器无法提供时为 None）
+    """
+    __slots__ = ("header", "rows", "line_nos", "_index")
+
+    def __init__(self, header: Sequence[str], rows: Optional[List[tuple]] = None,
+                 line_nos: Optional[List[int]] = None):
+        self.header = tuple(header)
+        self.rows = rows if rows is not None else []
+        self.line_nos = line_nos
+        self._index = {name: i for i, name in enumerate(self.header)}
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> "RowBatch":
+        """由 dict 列表构建（表头取所有键的并集，按首次出现顺序）"""
+        records = list(records)
+        header = list(dict.fromkeys(k for r in records for k in r))
+        return cls(header, [tuple(r.get(k) for k in header) for r in records])
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[tuple]:
+        return iter(self.rows)
+
+    def __bool__(self) -> bool:
+        return bool(self.rows)
+
+    def index(self, name: str) -> Optional[int]:
+        return self._index.get(name)
+
+    def line_no(self, i: int) -> int:
+        """第 i 行的源文件行号；没有行号时按批次内序号（从 1 开始）"""
+        return self.line_nos[i] if self.line_nos is not None else i + 1
+
+    def column(self, name: str) -> list:
+        """取一整列（不存在的列返回全 None）"""
+        i = self._index.get(name)
+        if i is None:
+            return [None] * len(self.rows)
+        return [row[i] if i < len(row) else None for row in self.rows]
+
+    def row_dict(self, i: int) -> dict:
+        """
+        第 i 行的 dict 形式
+        超出表头的多余字段放在键 None 下，与 csv.DictReader 的行为一致
+        """
+        row = self.rows[i]
+        record = dict(zip(self.header, row))
+        if len(row) > len(self.header):
+            record[None] = list(row[len(self.header):])
+        return record
+
+    def extend(self, other: "RowBatch") -> "RowBatch":
+        """追加另一批次的行（表头必须一致），返回自身"""
+        if other.header != self.header:
+            raise ValueError("批次表头不一致，无法合并")
+        if not other.rows:
+            return self
+        # 任一方缺少行号时，合并结果不再携带行号
+        if other.line_nos is None or (self.line_nos is None and self.rows):
+            self.line_nos = None
+        elif self.line_nos is None:
+            self.line_nos = list(other.line_nos)
+        else:
+            self.line_nos.extend(other.line_nos)
+        self.rows.extend(other.rows)
+        return self
+
+    def take(self, indices: Iterable[int]) -> "RowBatch":
+        """按下标选取若干行，共享表头"""
+        indices = list(indices)
+        line_nos = [self.line_nos[i] for i in indices] if self.line_nos is not None else None
+        return RowBatch(self.header, [self.rows[i] for i in indices], line_nos)
+
+    def map_columns(self, names: Iterable[str], func) -> None:
+        """原地对指定列逐值应用 func（如字符串驻留）"""
+        positions = [self._index[n] for n in names if n in self._index]
+        if not positions:
+            return
+        rows = self.rows
+        for r, row in enumerate(rows):
+            values = list(row)
+            for i in positions:
+                if i < len(values):
+                    values[i] = func(values[i])
+            rows[r] = tuple(values)
+
+
+class LoadBatch:
+    """
+    转换阶段的输出：按列存储，金额为 int64 定点数（分）
+    一个批次内的所有行属于同一个叶子分区
+    """
+    __slots__ = ("partition_key", "dates", "amount_cents", "raw_data", "fingerprints", "line_nos")
+
+    def __init__(self, partition_key: Tuple[str, str, str, str], dates: list,
+                 amount_cents: np.ndarray, raw_data: List[str], fingerprints: List[str],
+                 line_nos: Optional[List[int]] = None):
+        self.partition_key = partition_key
+        self.dates = dates
+        self.amount_cents = amount_cents
+        self.raw_data = raw_data
+        self.fingerprints = fingerprints
+        self.line_nos = line_nos
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def line_no(self, i: int) -> int:
+        """第 i 行的源文件行号；没有行号时按批次内序号（从 1 开始）"""
+        return self.line_nos[i] if self.line_nos is not None else i + 1
+
+    def copy_rows(self, start: int = 0, stop: Optional[int] = None) -> Iterator[tuple]:
+        """
+        按暂存表列顺序逐行产出：
+        (country_code, platform, channel, data_type, transaction_date, amount, raw_data, row_fingerprint)
+        金额以精确的十进制文本输出，不经过浮点
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        key = self.partition_key
+        for i in range(start, stop):
+            yield (*key, self.dates[i], format_cents(self.amount_cents[i]),
+                   self.raw_data[i], self.fingerprints[i])
+
+    def amount_total(self) -> int:
+        """金额合计（分）"""
+        return int(self.amount_cents.sum(dtype=np.int64))
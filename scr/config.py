@@ -65,6 +65,10 @@ class DatabaseConfig:
     USER = os.getenv("DB_USER")
     PASSWORD = os.getenv("DB_PASSWORD")
 
+    # 连接池大小（Database 类共享）
+    POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+    POOL_MAX = int(os.getenv("DB_POOL_MAX", 5))
+
     @classmethod
     def validate(cls) -> None:
         """增强验证：实际测试数据库连接"""
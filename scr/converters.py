@@ -0,0 +1,211 @@
+# converters.py
+import logging
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger("Converters")
+
+# 抽样判断低基数列：前 N 行中不同取值不超过 M 个
+CATEGORICAL_SAMPLE_ROWS = 1000
+CATEGORICAL_MAX_DISTINCT = 64
+# 平台配置未指定 format 时的日期格式
+DEFAULT_DATE_FORMAT = "%Y-%m-%d"
+
+
+class DateConverter:
+    """
+    带 LRU 缓存的日期解析
+    结算文件中同一日期会重复成千上万次，只有首次需要真正调用 strptime
+    """
+
+    def __init__(self, fmt: str, maxsize: int = 4096):
+        self.fmt = fmt
+        self._parse = lru_cache(maxsize=maxsize)(self._strptime)
+
+    def _strptime(self, text: str) -> date:
+        return datetime.strptime(text, self.fmt).date()
+
+    def __call__(self, value) -> date:
+        """:raises ValueError: 与 strptime 相同"""
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        return self._parse(str(value).strip())
+
+    def stats(self) -> dict:
+        info = self._parse.cache_info()
+        total = info.hits + info.misses
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "hit_rate": info.hits / total if total else 0.0
+        }
+
+
+class StringInterner:
+    """
+    有界字符串驻留池
+    低基数列（交易类型、金额类型等）的相同取值共享同一个字符串对象
+    池超过上限时整体清空（低基数列的取值很快重新填满），命中路径只有一次字典查找
+    """
+
+    def __init__(self, maxsize: int = 65536):
+        self.maxsize = maxsize
+        self._pool: Dict[str, str] = {}
+        self._lookups = 0
+        # 清空时丢弃的条目数，用于统计未命中次数
+        self._discarded = 0
+
+    def _trim(self) -> None:
+        if len(self._pool) > self.maxsize:
+            self._discarded += len(self._pool)
+            self._pool.clear()
+
+    def __call__(self, value):
+        if not isinstance(value, str):
+            return value
+        self._lookups += 1
+        value = self._pool.setdefault(value, value)
+        self._trim()
+        return value
+
+    def fields_interner(self, positions: Sequence[int]) -> Optional[Callable[[list], None]]:
+        """
+        返回原地驻留字段列表中指定位置取值的函数，在构造行元组之前逐行调用（不需要事后重建元组）
+        没有需要驻留的位置时返回 None
+        """
+        positions = tuple(positions)
+        if not positions:
+            return None
+        pool = self._pool
+        setdefault = pool.setdefault
+        last = max(positions)
+        count = len(positions)
+
+        def intern_fields(fields: list) -> None:
+            if len(fields) > last:
+                for i in positions:
+                    value = fields[i]
+                    if type(value) is str:
+                        fields[i] = setdefault(value, value)
+            else:
+                for i in positions:
+                    if i < len(fields) and type(fields[i]) is str:
+                        fields[i] = setdefault(fields[i], fields[i])
+            self._lookups += count
+            if len(pool) > self.maxsize:
+                self._trim()
+
+        return intern_fields
+
+    def stats(self) -> dict:
+        misses = min(self._discarded + len(self._pool), self._lookups)
+        hits = self._lookups - misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "size": len(self._pool),
+            "hit_rate": hits / self._lookups if self._lookups else 0.0
+        }
+
+
+class RowInterner:
+    """
+    解析时按列驻留：驻留的列来自平台配置中标记 categorical 的列；
+    未配置时由首个批次抽样决定（该批次事后驻留一次，之后的行在构造元组前驻留）
+    只保存列名，可随并行解析任务传给子进程（子进程使用各自的驻留池）
+    """
+
+    def __init__(self, spec: Optional[dict] = None):
+        self.columns = configured_categorical(spec)
+
+    def bind(self, header: Sequence[str]) -> Optional[Callable[[list], None]]:
+        """按表头返回逐行调用的驻留函数；列尚未确定或无需驻留时返回 None"""
+        if self.columns is None:
+            return None
+        names = set(self.columns)
+        return _interner.fields_interner([i for i, name in enumerate(header) if name in names])
+
+    def resolve(self, batch) -> Optional[Callable[[list], None]]:
+        """
+        每个批次构造完成后调用：列尚未确定时按该批次抽样并事后驻留该批次
+
+        :return: 之后各行使用的驻留函数
+        """
+        if self.columns is None:
+            self.columns = categorical_columns(batch)
+            intern_columns(batch, self.columns)
+        return self.bind(batch.header)
+
+
+# ==================== 进程级共享实例 ====================
+_date_converters: Dict[str, DateConverter] = {}
+_interner = StringInterner()
+
+
+def date_converter(fmt: str) -> DateConverter:
+    """按格式获取共享的日期转换器"""
+    converter = _date_converters.get(fmt)
+    if converter is None:
+        converter = _date_converters[fmt] = DateConverter(fmt)
+    return converter
+
+
+def intern_value(value):
+    return _interner(value)
+
+
+def configured_categorical(spec: Optional[dict] = None) -> Optional[List[str]]:
+    """平台配置中标记 categorical 的列；没有任何列标记时返回 None"""
+    columns = (spec or {}).get("columns", [])
+    if not any(c.get("categorical") for c in columns):
+        return None
+    return [c["name"] for c in columns if c.get("categorical") and c.get("name")]
+
+
+def categorical_columns(batch, spec: Optional[dict] = None) -> List[str]:
+    """
+    需要驻留的列：平台配置中标记 categorical 的列；
+    未配置时按抽样自动识别低基数列
+
+    :param batch: 解析得到的 RowBatch
+    """
+    configured = configured_categorical(spec)
+    if configured is not None:
+        return configured
+    sample = batch.rows[:CATEGORICAL_SAMPLE_ROWS]
+    if not sample:
+        return []
+    categorical = []
+    for i, name in enumerate(batch.header):
+        values = set()
+        for row in sample:
+            value = row[i] if i < len(row) else None
+            if isinstance(value, str):
+                values.add(value)
+                if len(values) > CATEGORICAL_MAX_DISTINCT:
+                    break
+        if 0 < len(values) <= CATEGORICAL_MAX_DISTINCT:
+            categorical.append(name)
+    return categorical
+
+
+def intern_columns(batch, columns: Iterable[str]) -> None:
+    """原地驻留 RowBatch 中指定列的取值"""
+    batch.map_columns(columns, _interner)
+
+
+def converter_stats() -> dict:
+    """各转换器的命中率统计"""
+    stats = {f"date[{fmt}]": c.stats() for fmt, c in _date_converters.items()}
+    stats["intern"] = _interner.stats()
+    return stats
+
+
+def log_converter_stats() -> None:
+    for name, s in converter_stats().items():
+        logger.info(f"{name}: hit rate {s['hit_rate']:.1%} "
+                    f"({s['hits']} hits, {s['misses']} misses, {s['size']} cached)")
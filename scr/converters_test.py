@@ -0,0 +1,39 @@
+# converters_test.py
+import csv
+from datetime import date, datetime
+from parsers import parse_file
+from converters import DateConverter, RowInterner
+from text_rows import iter_rows
+
+SPEC = {"columns": [{"name": "kind", "categorical": True}, {"name": "description"}]}
+
+
+def test_configured_columns_are_interned_when_rows_are_built():
+    lines = [f"{'A' if n % 2 else 'B'}x,row {n}\n" for n in range(50)]
+    # csv.reader 为每个字段新建字符串，共享只可能来自驻留
+    batches = list(iter_rows(csv.reader(lines), ["kind", "description"], batch_size=20,
+                             interner=RowInterner(SPEC)))
+    rows = [row for batch in batches for row in batch.rows]
+    assert [row[1] for row in rows] == [f"row {n}" for n in range(50)]
+    kinds = [row[0] for row in rows if row[0] == "Ax"]
+    assert all(kind is kinds[0] for kind in kinds)
+
+
+def test_sampled_columns_without_spec(tmp_path):
+    path = tmp_path / "plain.csv"
+    path.write_text("transaction_date,amount,kind,description\n"
+                    + "".join(f"2024-01-01,{n}.00,{'AB'[n % 2]}z,row {n}\n" for n in range(30000)))
+    rows = parse_file(str(path))
+    kind = rows.index("kind")
+    first = rows.rows[0][kind]
+    # 首个批次（事后驻留）与之后的批次（构造时驻留）共享同一对象
+    assert all(row[kind] is first for row in rows.rows[::2])
+    assert len(rows) == 30000
+
+
+def test_date_converter_accepts_cells_and_text():
+    convert = DateConverter("%Y-%m-%d")
+    assert convert(" 2024-01-05 ") == date(2024, 1, 5)
+    assert convert(datetime(2024, 1, 5, 10)) == date(2024, 1, 5)
+    assert convert(date(2024, 1, 5)) == date(2024, 1, 5)
+    assert convert.stats()["misses"] == 1
@@ -0,0 +1,311 @@
+# data_browser.py
+"""
+已上传交易的浏览窗口（按上传批次、渠道、日期筛选）
+
+按 (transaction_date, transaction_id) 键集分页：每页从上一页最后一行的键继续查询，
+翻到第几页都走同一个索引（idx_<分区>_date_id），不使用 OFFSET。
+界面只保留最多 MAX_PAGES 页：向下滚动时追加下一页并丢弃最上面一页，向上滚动时反之，
+因此无论浏览多少行，内存与 Treeview 的项目数都保持不变
+只显示在线数据，已归档的数据（见 partition_archive）不在此列出
+"""
+import json
+import logging
+import threading
+import tkinter as tk
+from collections import deque
+from datetime import date
+from tkinter import ttk, messagebox
+from typing import Callable, List, Optional
+from psycopg2 import sql
+from database import Database
+from exporter import filter_conditions
+
+logger = logging.getLogger("DataBrowser")
+
+PAGE_SIZE = 200
+MAX_PAGES = 3
+# 可见区域距窗口边缘不足此比例时加载相邻页
+EDGE_FRACTION = 0.15
+RAW_DATA_WIDTH = 200
+BROWSER_COLUMNS = ("transaction_id", "transaction_date", "amount", "country_code", "platform",
+                   "channel", "data_type", "upload_id", "raw_data")
+COLUMN_WIDTHS = {"transaction_id": 90, "transaction_date": 90, "amount": 90, "country_code": 40,
+                 "platform": 70, "channel": 120, "data_type": 70, "upload_id": 60, "raw_data": 400}
+
+
+def page_query(filters: dict, after: Optional[tuple] = None, before: Optional[tuple] = None,
+               limit: int = PAGE_SIZE) -> sql.Composed:
+    """
+    一页数据的查询语句
+
+    :param filters: 同 exporter.filter_conditions，另可含 upload_id
+    :param after: 从该键 (transaction_date, transaction_id) 之后向后取
+    :param before: 从该键之前向前取（结果为倒序）
+    """
+    conditions = filter_conditions(filters)
+    if filters.get("upload_id"):
+        conditions.append(sql.SQL("upload_id = {}").format(sql.Literal(int(filters["upload_id"]))))
+    if after is not None:
+        conditions.append(sql.SQL("(transaction_date, transaction_id) > ({}, {})").format(
+            sql.Literal(after[0]), sql.Literal(after[1])))
+    if before is not None:
+        conditions.append(sql.SQL("(transaction_date, transaction_id) < ({}, {})").format(
+            sql.Literal(before[0]), sql.Literal(before[1])))
+    direction = sql.SQL("DESC" if before is not None else "ASC")
+    return sql.SQL(
+        "SELECT {columns} FROM transactions{where} "
+        "ORDER BY transaction_date {direction}, transaction_id {direction} LIMIT {limit}"
+    ).format(
+        columns=sql.SQL(", ").join(map(sql.Identifier, BROWSER_COLUMNS)),
+        where=sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""),
+        direction=direction,
+        limit=sql.Literal(limit)
+    )
+
+
+def fetch_page(db: Database, filters: dict, after: Optional[tuple] = None, before: Optional[tuple] = None,
+               limit: int = PAGE_SIZE, user: str = "SYSTEM") -> List[tuple]:
+    """取一页（服务器端游标，按日期、ID 升序返回）"""
+    rows = list(db.stream(page_query(filters, after, before, limit), user=user, itersize=limit,
+                          action="BROWSE_PAGE"))
+    return rows[::-1] if before is not None else rows
+
+
+def _row_key(row: tuple) -> tuple:
+    return row[1], row[0]
+
+
+def _display(row: tuple) -> tuple:
+    values = list(row)
+    raw = values[-1]
+    if raw is not None and not isinstance(raw, str):
+        raw = json.dumps(raw, ensure_ascii=False)
+    values[-1] = (raw or "")[:RAW_DATA_WIDTH]
+    return tuple("" if v is None else str(v) for v in values)
+
+
+class _Page:
+    __slots__ = ("first", "last", "iids")
+
+    def __init__(self, rows: List[tuple], iids: List[str]):
+        self.first = _row_key(rows[0])
+        self.last = _row_key(rows[-1])
+        self.iids = iids
+
+
+class DataBrowser:
+    """
+    数据浏览窗口；查询在后台线程执行，结果经 call_in_tk 回到 Tk 主线程
+    （与上传相同，见 async_ingest.TkAsyncBridge）
+    """
+
+    def __init__(self, parent, filters: dict, user: str, call_in_tk: Callable,
+                 db: Optional[Database] = None):
+        self.filters = dict(filters)
+        self.user = user
+        self.call_in_tk = call_in_tk
+        self.db = db or Database()
+        self.pages = deque()
+        self.offset = 0
+        self.at_start = self.at_end = True
+        self.seek_key = None
+        self._loading = False
+        # 每次重新查询加一，丢弃旧查询迟到的结果
+        self._generation = 0
+
+        self.window = tk.Toplevel(parent)
+        self.window.title("Browse Transactions")
+        self.window.geometry("1000x600")
+        self._create_widgets()
+        self.apply()
+
+    def _create_widgets(self):
+        bar = ttk.Frame(self.window, padding="5")
+        bar.pack(fill=tk.X)
+        scope = " / ".join(self.filters.get(k) for k in ("country", "platform", "channel", "data_type")
+                           if self.filters.get(k)) or "全部"
+        ttk.Label(bar, text=f"范围: {scope}").pack(side=tk.LEFT, padx=5)
+        self.upload_var = tk.StringVar(value=str(self.filters.get("upload_id") or ""))
+        self.date_from_var, self.date_to_var = tk.StringVar(), tk.StringVar()
+        self.seek_var = tk.StringVar()
+        for label, var, width in (("Upload ID:", self.upload_var, 8), ("From:", self.date_from_var, 11),
+                                  ("To:", self.date_to_var, 11)):
+            ttk.Label(bar, text=label).pack(side=tk.LEFT, padx=(10, 2))
+            ttk.Entry(bar, textvariable=var, width=width).pack(side=tk.LEFT)
+        ttk.Button(bar, text="Apply", command=self.apply).pack(side=tk.LEFT, padx=10)
+        ttk.Label(bar, text="Jump to:").pack(side=tk.LEFT, padx=(10, 2))
+        ttk.Entry(bar, textvariable=self.seek_var, width=11).pack(side=tk.LEFT)
+        ttk.Button(bar, text="Go", command=self.jump).pack(side=tk.LEFT, padx=5)
+
+        body = ttk.Frame(self.window)
+        body.pack(fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(body, columns=BROWSER_COLUMNS, show="headings", height=25)
+        for column in BROWSER_COLUMNS:
+            self.tree.heading(column, text=column)
+            self.tree.column(column, width=COLUMN_WIDTHS[column],
+                             stretch=column == "raw_data", anchor=tk.E if column == "amount" else tk.W)
+        self.vbar = ttk.Scrollbar(body, orient=tk.VERTICAL, command=self.tree.yview)
+        hbar = ttk.Scrollbar(body, orient=tk.HORIZONTAL, command=self.tree.xview)
+        self.tree.configure(yscrollcommand=self._on_yscroll, xscrollcommand=hbar.set)
+        self.tree.grid(row=0, column=0, sticky=tk.NSEW)
+        self.vbar.grid(row=0, column=1, sticky=tk.NS)
+        hbar.grid(row=1, column=0, sticky=tk.EW)
+        body.rowconfigure(0, weight=1)
+        body.columnconfigure(0, weight=1)
+
+        self.status_var = tk.StringVar()
+        ttk.Label(self.window, textvariable=self.status_var, padding="5").pack(fill=tk.X)
+
+    # ==================== 筛选 ====================
+    def apply(self):
+        """按筛选条件从头开始浏览"""
+        filters = self._read_filters()
+        if filters is not None:
+            self.filters = filters
+            self._reset(None)
+
+    def jump(self):
+        """跳到某个日期（键集定位，不需要扫描之前的行）"""
+        filters = self._read_filters()
+        if filters is None:
+            return
+        try:
+            seek = date.fromisoformat(self.seek_var.get().strip())
+        except ValueError:
+            messagebox.showerror("错误", "日期格式应为 YYYY-MM-DD", parent=self.window)
+            return
+        self.filters = filters
+        # transaction_id 从 1 开始，(日期, 0) 之后即该日期的第一行
+        self._reset((seek, 0))
+
+    def _read_filters(self) -> Optional[dict]:
+        filters = {k: v for k, v in self.filters.items() if k not in ("upload_id", "date_from", "date_to")}
+        try:
+            upload_id = self.upload_var.get().strip()
+            if upload_id:
+                filters["upload_id"] = int(upload_id)
+            for name, var in (("date_from", self.date_from_var), ("date_to", self.date_to_var)):
+                if var.get().strip():
+                    filters[name] = date.fromisoformat(var.get().strip())
+        except ValueError:
+            messagebox.showerror("错误", "Upload ID 应为整数，日期格式应为 YYYY-MM-DD", parent=self.window)
+            return None
+        return filters
+
+    def _reset(self, seek_key: Optional[tuple]):
+        self._generation += 1
+        self._loading = False
+        self.tree.delete(*self.tree.get_children())
+        self.pages.clear()
+        self.seek_key = seek_key
+        # 从某日期开始浏览时不知道前面有多少行
+        self.offset = 0 if seek_key is None else None
+        self.at_start = seek_key is None
+        self.at_end = False
+        self._request("next")
+
+    # ==================== 分页 ====================
+    def _on_yscroll(self, first, last):
+        self.vbar.set(first, last)
+        if self._loading:
+            return
+        if float(last) >= 1 - EDGE_FRACTION and not self.at_end:
+            self._request("next")
+        elif float(first) <= EDGE_FRACTION and not self.at_start and self.pages:
+            self._request("prev")
+
+    def _request(self, direction: str):
+        if direction == "prev" and not self.pages:
+            return  # 没有已加载的页，无法向前定位
+        self._loading = True
+        started = False
+        generation = self._generation
+        try:
+            if direction == "next":
+                after, before = (self.pages[-1].last if self.pages else self.seek_key), None
+            else:
+                after, before = None, self.pages[0].first
+            self.status_var.set("加载中…")
+
+            def run():
+                try:
+                    rows = fetch_page(self.db, self.filters, after, before, user=self.user)
+                    self.call_in_tk(self._on_page, generation, direction, rows, None)
+                except Exception as e:
+                    logger.exception("Failed to fetch browser page")
+                    self.call_in_tk(self._on_page, generation, direction, None, e)
+
+            threading.Thread(target=run, daemon=True).start()
+            started = True
+        finally:
+            # 未能发出请求时不能一直停在加载中，否则之后的滚动都不会再加载
+            if not started:
+                self._loading = False
+
+    def _on_page(self, generation: int, direction: str, rows, error):
+        if generation != self._generation or not self.window.winfo_exists():
+            return
+        self._loading = False
+        if error is not None:
+            self.status_var.set(f"❌ 查询失败: {str(error)}")
+            return
+        if direction == "next":
+            self.at_end = len(rows) < PAGE_SIZE
+            if rows:
+                self._append(rows)
+            elif not self.pages:
+                # 定位之后没有数据（如日期晚于最新数据）：没有可向前翻页的起点
+                self.at_start = True
+        else:
+            self.at_start = len(rows) < PAGE_SIZE
+            if rows:
+                self._prepend(rows)
+            if self.at_start:
+                self.offset = 0
+        self._update_status()
+
+    def _append(self, rows: List[tuple]):
+        top = self._top_index()
+        iids = [self.tree.insert("", tk.END, values=_display(row)) for row in rows]
+        self.pages.append(_Page(rows, iids))
+        if len(self.pages) > MAX_PAGES:
+            dropped = self.pages.popleft()
+            self.tree.delete(*dropped.iids)
+            if self.offset is not None:
+                self.offset += len(dropped.iids)
+            self.at_start = False
+            # 保持原来在顶部的行仍在顶部
+            self._scroll_to(top - len(dropped.iids))
+
+    def _prepend(self, rows: List[tuple]):
+        top = self._top_index()
+        iids = [self.tree.insert("", index, values=_display(row)) for index, row in enumerate(rows)]
+        self.pages.appendleft(_Page(rows, iids))
+        if self.offset is not None:
+            self.offset = max(self.offset - len(rows), 0)
+        if len(self.pages) > MAX_PAGES:
+            dropped = self.pages.pop()
+            self.tree.delete(*dropped.iids)
+            self.at_end = False
+        self._scroll_to(top + len(rows))
+
+    def _top_index(self) -> int:
+        count = len(self.tree.get_children())
+        return int(round(float(self.tree.yview()[0]) * count)) if count else 0
+
+    def _scroll_to(self, index: int):
+        count = len(self.tree.get_children())
+        if count:
+            self.tree.yview_moveto(max(index, 0) / count)
+
+    def _update_status(self):
+        loaded = sum(len(page.iids) for page in self.pages)
+        if not loaded:
+            self.status_var.set("没有符合条件的数据")
+            return
+        first, last = self.pages[0].first, self.pages[-1].last
+        if self.offset is not None:
+            position = f"第 {self.offset + 1:,}–{self.offset + loaded:,} 行"
+        else:
+            position = f"{loaded:,} 行"
+        self.status_var.set(f"{position}（{first[0]} → {last[0]}）" + ("，已到末尾" if self.at_end else ""))
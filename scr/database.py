@@ -1,11 +1,27 @@
 # src/database.py
+import uuid
+import logging
+import threading
 import psycopg2
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from datetime import datetime
 from contextlib import contextmanager
-from typing import Optional, Union, Dict, List, Tuple
+from typing import Iterator, Optional, Union, Dict, List, Tuple
 from config import DatabaseConfig, DATABASE_AUDIT_LOGGER
+from profiling import profiled
 
 class Database:
+    # 同一配置的所有实例共享一个连接池
+    _pools: Dict[tuple, ThreadedConnectionPool] = {}
+    # 每个连接池的可借出名额；池满时借用方等待，而不是直接抛出 PoolError
+    _slots: Dict[tuple, threading.BoundedSemaphore] = {}
+    _pools_lock = threading.Lock()
+    # 等待空闲连接的最长秒数（同一线程嵌套借用占满连接池时不会永远阻塞）
+    POOL_WAIT_SECONDS = 60
+    # 服务器端游标每次往返取回的行数
+    DEFAULT_ITERSIZE = 10000
+
     def __init__(self):
         """
         数据库连接初始化
@@ -21,24 +37,45 @@ class Database:
             }
         )
 
+    def _pool(self) -> Tuple[ThreadedConnectionPool, threading.BoundedSemaphore]:
+        key = tuple(sorted(self.config.items()))
+        with self._pools_lock:
+            pool = self._pools.get(key)
+            if pool is None or pool.closed:
+                pool = self._pools[key] = ThreadedConnectionPool(
+                    DatabaseConfig.POOL_MIN, DatabaseConfig.POOL_MAX, **self.config
+                )
+                self._slots[key] = threading.BoundedSemaphore(DatabaseConfig.POOL_MAX)
+            return pool, self._slots[key]
+
     @contextmanager
     def _managed_connection(self):
         """
         连接管理上下文管理器
-        自动处理连接、事务和错误
+        从连接池借出连接，自动处理事务和错误，结束后归还
+        （未提交的事务在归还时由连接池回滚）
+        连接池已满时等待其他线程归还连接，最多 POOL_WAIT_SECONDS 秒
         """
-        conn = None
+        pool, slots = self._pool()
+        if not slots.acquire(timeout=self.POOL_WAIT_SECONDS):
+            raise PoolError(f"no free connection after {self.POOL_WAIT_SECONDS}s "
+                            f"(pool size {DatabaseConfig.POOL_MAX})")
+        try:
+            conn = pool.getconn()
+        except Exception:
+            slots.release()
+            raise
         try:
-            conn = psycopg2.connect(**self.config)
             yield conn
             conn.commit()
-        except psycopg2.DatabaseError as e:
-            if conn:
+        except psycopg2.DatabaseError:
+            if not conn.closed:
                 conn.rollback()
             raise
         finally:
-            if conn:
-                conn.close()
+            # 已断开的连接直接丢弃，不放回池中
+            pool.putconn(conn, close=bool(conn.closed))
+            slots.release()
 
     def _log_operation(self, user: str, action: str, details: Dict):
         """
@@ -59,11 +96,19 @@ class Database:
             level=logging.INFO,
             msg=details.get('message', 'Database operation'),
             extra={
+                'user': user,
                 'user_action': action,
                 'log_data': log_data
             }
         )
 
+    @staticmethod
+    def _query_text(query, conn=None):
+        """审计日志中的 SQL 文本；sql.Composable 需借助连接渲染（否则只能得到其 repr）"""
+        if isinstance(query, sql.Composable):
+            return query.as_string(conn) if conn is not None else str(query)
+        return query
+
     def _sanitize_params(self, params: Union[Dict, List, Tuple, None]) -> Union[Dict, List]:
         """
         增强型参数脱敏
@@ -86,6 +131,7 @@ class Database:
             ]
         return params
 
+    @profiled("db.execute")
     def execute(
         self,
         query: str,
@@ -107,13 +153,14 @@ class Database:
         """
         start_time = datetime.now()
         audit_context = {
-            'query': query,
+            'query': self._query_text(query),
             'params': self._sanitize_params(params),
             **context
         }
 
         try:
             with self._managed_connection() as conn:
+                audit_context['query'] = self._query_text(query, conn)
                 with conn.cursor() as cursor:
                     cursor.execute(query, params)
                     
@@ -148,6 +195,139 @@ class Database:
             )
             raise  # 重新抛出异常供上层处理
 
+    def stream(
+        self,
+        query: str,
+        params: Optional[Union[Dict, List, Tuple]] = None,
+        user: str = "SYSTEM",
+        itersize: Optional[int] = None,
+        **context
+    ) -> Iterator[Tuple]:
+        """
+        以服务器端（命名）游标流式执行查询，逐行产出结果
+        客户端内存只保留 itersize 行；迭代结束、中途 break 或出错时归还连接
+
+        :param itersize: 每次往返取回的行数
+        """
+        for _, rows in self._stream_chunks(query, params, user, itersize, **context):
+            yield from rows
+
+    def stream_frames(
+        self,
+        query: str,
+        params: Optional[Union[Dict, List, Tuple]] = None,
+        user: str = "SYSTEM",
+        chunk_size: Optional[int] = None,
+        **context
+    ) -> Iterator["pd.DataFrame"]:
+        """
+        与 stream 相同，但按 chunk_size 行产出 DataFrame 块
+        """
+        import pandas as pd
+
+        for columns, rows in self._stream_chunks(query, params, user, chunk_size, **context):
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+    def _stream_chunks(self, query, params, user, itersize, **context):
+        """产出 (列名, 行列表)，每块最多 itersize 行"""
+        itersize = itersize or self.DEFAULT_ITERSIZE
+        start_time = datetime.now()
+        audit_context = {
+            'query': self._query_text(query),
+            'params': self._sanitize_params(params),
+            **context
+        }
+        total = 0
+        try:
+            with self._managed_connection() as conn:
+                audit_context['query'] = self._query_text(query, conn)
+                # 命名游标只能在事务内使用，随事务结束关闭
+                with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+                    cursor.itersize = itersize
+                    cursor.execute(query, params)
+                    columns = None
+                    while True:
+                        rows = cursor.fetchmany(itersize)
+                        if columns is None:
+                            columns = [d[0] for d in cursor.description or ()]
+                        if not rows:
+                            break
+                        total += len(rows)
+                        yield columns, rows
+            self._log_operation(
+                user=user,
+                action="QUERY_STREAM",
+                details={
+                    'status': 'SUCCESS',
+                    'rows_streamed': total,
+                    'duration_sec': (datetime.now() - start_time).total_seconds(),
+                    **audit_context
+                }
+            )
+        except psycopg2.Error as e:
+            self._log_operation(
+                user=user,
+                action="QUERY_ERROR",
+                details={
+                    'status': 'ERROR',
+                    'error_type': e.__class__.__name__,
+                    'error_message': str(e),
+                    'rows_streamed': total,
+                    'duration_sec': (datetime.now() - start_time).total_seconds(),
+                    **audit_context
+                }
+            )
+            raise
+
+    @profiled("db.copy_out")
+    def copy_out(
+        self,
+        query,
+        file,
+        user: str = "SYSTEM",
+        **context
+    ) -> int:
+        """
+        执行 COPY ... TO STDOUT，把结果直接写入类文件对象（不经过 Python 行对象）
+
+        :param query: COPY 语句（str 或 psycopg2.sql.Composable）
+        :param file: 可写的文件对象，二进制或文本均可
+        :return: 导出的行数
+        """
+        start_time = datetime.now()
+        audit_context = {'query': self._query_text(query), **context}
+        try:
+            with self._managed_connection() as conn:
+                audit_context['query'] = self._query_text(query, conn)
+                with conn.cursor() as cursor:
+                    cursor.copy_expert(query, file)
+                    rows = cursor.rowcount
+            self._log_operation(
+                user=user,
+                action="COPY_OUT",
+                details={
+                    'status': 'SUCCESS',
+                    'rows_affected': rows,
+                    'duration_sec': (datetime.now() - start_time).total_seconds(),
+                    **audit_context
+                }
+            )
+            return rows
+        except psycopg2.Error as e:
+            self._log_operation(
+                user=user,
+                action="QUERY_ERROR",
+                details={
+                    'status': 'ERROR',
+                    'error_type': e.__class__.__name__,
+                    'error_message': str(e),
+                    'duration_sec': (datetime.now() - start_time).total_seconds(),
+                    **audit_context
+                }
+            )
+            raise
+
+    @profiled("db.batch_execute")
     def batch_execute(
         self,
         query: str,
@@ -177,7 +357,7 @@ class Database:
                             'status': 'SUCCESS',
                             'total_rows': total_rows,
                             'duration_sec': (datetime.now() - start_time).total_seconds(),
-                            'query': query,
+                            'query': self._query_text(query, conn),
                             'params_samples': self._sanitize_params(params_list[:3]),  # 记录前3个参数样本
                             **context
                         }
@@ -1,5 +1,8 @@
 # database_manager.py
+import io
 import os
+import re
+import uuid
 import yaml
 import logging
 import psycopg2
@@ -7,8 +10,10 @@ from pathlib import Path
 from dotenv import load_dotenv
 from psycopg2 import sql, errors
 from datetime import datetime
+from contextlib import contextmanager
 import hashlib
 from config import DatabaseConfig
+from profiling import profiled
 
 # -------------------------
 # 路径配置
@@ -35,10 +40,140 @@ logging.basicConfig(
 )
 logger = logging.getLogger("DBManager")
 
+# 汇总表：按分区键 + 日/月 + 金额类型累计行数与金额
+SUMMARY_TABLES = {
+    "transaction_daily_summary": ("summary_date", "s.transaction_date"),
+    "transaction_monthly_summary": ("summary_month", "date_trunc('month', s.transaction_date)::date"),
+}
+# raw_data 中表示金额类型的键（按顺序取第一个非空值），如 Amazon 结算报表的 amount-type
+AMOUNT_TYPE_EXPRESSION = "COALESCE(s.raw_data->>'amount-type', s.raw_data->>'amount_type', '')"
+# 从 transactions 向下遍历分区树，得到每个叶子分区、其各层的分区取值（DEFAULT 为 NULL）
+# 以及从 transactions 到该分区的表名路径；还没有子分区的分区表不能存放数据，不算叶子
+LEAF_PARTITIONS_SQL = """
+    WITH RECURSIVE tree AS (
+        -- 递归项中 substring 的结果继承 relname 的 "C" 排序规则，两项必须一致
+        SELECT c.oid, c.relkind, c.relname::text AS name, ARRAY[]::text[] COLLATE "C" AS bounds,
+               ARRAY[c.relname::text] AS path
+        FROM pg_class c
+        WHERE c.relname = 'transactions' AND c.relnamespace = 'public'::regnamespace
+        UNION ALL
+        SELECT child.oid, child.relkind, child.relname::text,
+               tree.bounds || substring(pg_get_expr(child.relpartbound, child.oid)
+                                        FROM $$IN \\('([^']*)'\\)$$),
+               tree.path || child.relname::text
+        FROM tree
+        JOIN pg_inherits i ON i.inhparent = tree.oid
+        JOIN pg_class child ON child.oid = i.inhrelid
+    )
+    SELECT name, bounds, path
+    FROM tree
+    WHERE relkind = 'r' AND cardinality(bounds) > 0
+    ORDER BY name
+"""
+
+def _route_leaf(leaves: list, partition_key: tuple):
+    """
+    按 PostgreSQL 的 LIST 分区路由规则，找出分区键落入的叶子分区
+    每层先找取值相同的子分区，没有时才进入 DEFAULT 子分区
+
+    :param leaves: LEAF_PARTITIONS_SQL 的结果 [(name, bounds, path)]
+    :return: 叶子分区从 transactions 起的表名路径；无处可落时返回 None
+    """
+    level = 0
+    while leaves and len(leaves[0][2]) > level + 1:
+        value = partition_key[level] if level < len(partition_key) else None
+        children = {path[level + 1]: bounds[level] for _, bounds, path in leaves}
+        chosen = next((name for name, bound in children.items() if bound == value), None)
+        if chosen is None:
+            chosen = next((name for name, bound in children.items() if bound is None), None)
+        if chosen is None:
+            return None
+        leaves = [leaf for leaf in leaves if leaf[2][level + 1] == chosen]
+        level += 1
+    return leaves[0][2] if leaves else None
+
+
+def _copy_value(value) -> str:
+    """转换为 COPY 文本格式的字段值"""
+    if value is None:
+        return "\\N"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+
+def _copy_error_line(error: errors.Error):
+    """从 COPY 错误上下文（如 "COPY t, line 37, column amount"）中提取行号"""
+    context = getattr(getattr(error, "diag", None), "context", None) or ""
+    match = re.search(r"COPY [^,]+, line (\d+)", context)
+    return int(match.group(1)) if match else None
+
+
+class StatementPipeline:
+    """
+    把互不依赖的语句合并为一次往返发送
+    参数在客户端绑定（mogrify），多条语句拼成一个查询；只有最后一条语句的结果可读取
+    须在事务中使用（每批语句前设保存点，出错时据此定位失败的语句）
+    """
+
+    def __init__(self, cursor, max_statements: int = 1000):
+        self.cursor = cursor
+        self.max_statements = max_statements
+        self.statements = []
+
+    def add(self, query, params=None) -> None:
+        self.statements.append(self.cursor.mogrify(query, params))
+        if len(self.statements) >= self.max_statements:
+            self.flush()
+
+    def flush(self, query=None, params=None) -> None:
+        """
+        发送已排队的语句，可附带一条需要读取结果的语句（放在最后）
+        """
+        if query is not None:
+            self.statements.append(self.cursor.mogrify(query, params))
+        if not self.statements:
+            return
+        batch, self.statements = self.statements, []
+        if len(batch) == 1:
+            self.cursor.execute(batch[0])
+            return
+        try:
+            self.cursor.execute(b";\n".join([b"SAVEPOINT statement_pipeline", *batch]))
+        except errors.Error as e:
+            self._report_failure(batch, e)
+            raise
+
+    def _report_failure(self, batch: list, error: errors.Error) -> None:
+        """
+        合并发送的一批语句失败时无法得知是哪一条：回到保存点后逐条重放，
+        记录第一条失败的语句（重放出错后事务仍处于失败状态，由调用方回滚）
+        """
+        try:
+            self.cursor.execute(b"ROLLBACK TO SAVEPOINT statement_pipeline")
+            for i, statement in enumerate(batch, 1):
+                try:
+                    self.cursor.execute(statement)
+                except errors.Error as e:
+                    logger.error(f"Pipelined statement {i}/{len(batch)} failed: {str(e).strip()}\n"
+                                 f"{statement.decode('utf-8', 'replace').strip()}")
+                    return
+        except errors.Error:
+            pass
+        logger.error(f"Pipelined batch of {len(batch)} statements failed: {str(error).strip()}")
+
+
 class DatabaseManager:
     def __init__(self):
         self.conn = None
         self.cur = None
+        self._pipeline = None
+        # 已确认存在对应叶子分区的 (目标表, 分区键)
+        self._routable = set()
         self._connect()
     
     def __enter__(self):
@@ -71,6 +206,30 @@ class DatabaseManager:
             logger.error(f"Connection failed: {self._parse_error(e)}")
             raise
 
+    @contextmanager
+    def pipeline(self, flush: bool = True):
+        """
+        在此范围内经 _execute_sql 执行的语句只排队，退出时一次往返发送并提交
+        嵌套时并入外层管道
+
+        :param flush: False 时只收集语句不发送（用于对比测试）
+        """
+        if self._pipeline is not None:
+            yield self._pipeline
+            return
+        self._pipeline = StatementPipeline(self.cur)
+        try:
+            yield self._pipeline
+            if flush:
+                self._pipeline.flush()
+                self.conn.commit()
+        except errors.Error as e:
+            self.conn.rollback()
+            logger.error(f"Pipelined execution failed: {str(e)}")
+            raise
+        finally:
+            self._pipeline = None
+
     # ==================== 核心操作方法 ====================
     def insert_data(self, table_name: str, data: dict) -> bool:
         """通用数据插入方法"""
@@ -101,72 +260,582 @@ class DatabaseManager:
             logger.error(f"Duplicate check failed: {str(e)}")
             return False
 
-    def record_upload(self, file_name: str, file_hash: str, metadata: dict) -> None:
-        """记录上传历史"""
+    def claim_upload(self, file_hash: str, file_name: str, user: str,
+                     stale_seconds: float = 7200) -> dict:
+        """
+        加载前原子地占用文件哈希，同一文件只有一个上传者能继续
+        查重、占用与读取占用者在一条语句中完成；占用立即提交，对其他连接与进程可见
+        占用在加载事务中与上传历史一起转为“已上传”（见 record_upload），
+        失败时由 release_upload_claim 释放；进程崩溃留下的占用超过 stale_seconds 后可被接管
+
+        :return: {"status": "claimed" | "uploaded" | "in_progress",
+                  "token", "claimed_by", "claimed_at"}
+        """
+        token = str(uuid.uuid4())
+        try:
+            self.cur.execute("""
+                WITH uploaded AS (
+                    SELECT 1 FROM upload_history WHERE file_hash = %(file_hash)s
+                ), claimed AS (
+                    INSERT INTO upload_claims AS c (file_hash, file_name, claimed_by, claim_token)
+                    SELECT %(file_hash)s, %(file_name)s, %(user)s, %(token)s
+                    WHERE NOT EXISTS (SELECT 1 FROM uploaded)
+                    ON CONFLICT (file_hash) DO UPDATE
+                        SET file_name = EXCLUDED.file_name,
+                            claimed_by = EXCLUDED.claimed_by,
+                            claim_token = EXCLUDED.claim_token,
+                            claimed_at = NOW()
+                        WHERE c.upload_id IS NULL
+                          AND c.claimed_at < NOW() - make_interval(secs => %(stale)s)
+                    RETURNING 1
+                )
+                SELECT EXISTS (SELECT 1 FROM claimed),
+                       EXISTS (SELECT 1 FROM uploaded),
+                       h.claimed_by, h.claimed_at, h.upload_id
+                FROM (SELECT 1) AS one
+                LEFT JOIN upload_claims h ON h.file_hash = %(file_hash)s
+            """, {"file_hash": file_hash, "file_name": file_name, "user": user,
+                  "token": token, "stale": float(stale_seconds)})
+            claimed, uploaded, claimed_by, claimed_at, upload_id = self.cur.fetchone()
+            self.conn.commit()
+        except errors.Error as e:
+            self.conn.rollback()
+            logger.error(f"Upload claim failed: {str(e)}")
+            raise
+
+        if claimed:
+            status = "claimed"
+        elif uploaded or upload_id is not None:
+            status = "uploaded"
+        else:
+            # 并发插入时占用者的行可能在本语句快照之后才提交，claimed_by 可能为空
+            status = "in_progress"
+        return {"status": status, "token": token if claimed else None,
+                "claimed_by": claimed_by, "claimed_at": claimed_at}
+
+    def release_upload_claim(self, file_hash: str, token: str) -> None:
+        """释放本次上传的占用（上传失败时调用；已转为上传历史的占用不受影响）"""
+        try:
+            self.cur.execute("""
+                DELETE FROM upload_claims
+                WHERE file_hash = %s AND claim_token = %s AND upload_id IS NULL
+            """, (file_hash, token))
+            self.conn.commit()
+        except errors.Error as e:
+            # 释放失败时占用会在超时后自动失效
+            self.conn.rollback()
+            logger.error(f"Upload claim release failed: {str(e)}")
+
+    # ==================== 暂存表加载 ====================
+    @profiled("db.load_upload")
+    def load_upload(self, table_name: str, batch, file_name: str,
+                    file_hash: str, metadata: dict, bloom=None,
+                    chunk_size: int = 10000, **history) -> dict:
+        """
+        单事务加载一个文件
+        COPY 到本次上传专用的临时暂存表（TEMP，ON COMMIT DROP）→ SQL 校验与去重 →
+        一条 INSERT ... SELECT 写入目标分区 → 记录上传历史
+        坏行被隔离到 rejects 中，其余行正常提交；数据库异常则整体回滚
+
+        :param batch: 转换阶段输出的 LoadBatch
+        :param bloom: 可选的布隆过滤器，未命中的指纹一定是新行，跳过服务器端查找
+        :param chunk_size: 每次 COPY 的行数
+        :param history: 透传给 record_upload 的增量导入信息
+        :return: {"upload_id", "staged", "rejected", "inserted", "skipped", "rejects"}
+                 rejects 为 [{"row_no", "reason", "raw_data"}]，row_no 为源文件行号
+        """
+        staging = f"staging_upload_{file_hash[:16]}"
+        if len(batch):
+            self._check_partition_key(table_name, batch.partition_key)
+        try:
+            # 建暂存表与写上传历史合并为一次往返
+            pipe = StatementPipeline(self.cur)
+            pipe.add(self._staging_table_sql(staging))
+            upload_id = self.record_upload(file_name, file_hash, metadata, commit=False,
+                                           pipeline=pipe, **history)
+            rejects = self._copy_to_staging(staging, batch, bloom, chunk_size)
+            rejects += self._validate_staging(staging)
+            inserted = self._merge_staging(staging, table_name, upload_id)
+            self.conn.commit()
+        except errors.Error as e:
+            self.conn.rollback()
+            logger.error(f"Load failed ({staging}): {str(e)}")
+            raise
+
+        if bloom is not None:
+            bloom.update(batch.fingerprints)
+        rejects.sort(key=lambda r: r["row_no"])
+        result = {
+            "upload_id": upload_id,
+            "staged": len(batch),
+            "rejected": len(rejects),
+            "inserted": inserted,
+            "skipped": len(batch) - len(rejects) - inserted,
+            "rejects": rejects
+        }
+        logger.info(f"Loaded {inserted}/{len(batch)} rows into {table_name} "
+                    f"(upload {upload_id}, {len(rejects)} rejected, {result['skipped']} duplicates)")
+        return result
+
+    @staticmethod
+    def _staging_table_sql(staging: str) -> sql.Composed:
+        """
+        本次上传专用的临时暂存表：不写 WAL，事务结束时自动删除（省去 DROP 的往返）
+        """
+        return sql.SQL("""
+            CREATE TEMP TABLE {} (
+                row_no INTEGER,
+                country_code CHAR(2),
+                platform VARCHAR(20),
+                channel VARCHAR(50),
+                data_type VARCHAR(20),
+                transaction_date DATE,
+                amount NUMERIC(12,2),
+                raw_data JSONB,
+                row_fingerprint CHAR(64),
+                known_new BOOLEAN NOT NULL DEFAULT FALSE
+            ) ON COMMIT DROP
+        """).format(sql.Identifier(staging))
+
+    def _copy_to_staging(self, staging: str, batch, bloom=None,
+                         chunk_size: int = 10000) -> list:
+        """
+        分块 COPY 写入暂存表，内存占用与 chunk_size 成正比
+        某块失败时在保存点下拆分定位坏行，其余行照常写入
+        :return: 坏行列表
+        """
+        copy_sql = sql.SQL("""
+            COPY {} (row_no, country_code, platform, channel, data_type, transaction_date,
+                     amount, raw_data, row_fingerprint, known_new)
+            FROM STDIN
+        """).format(sql.Identifier(staging)).as_string(self.conn)
+
+        rejects = []
+        for start in range(0, len(batch), chunk_size):
+            lines = []
+            for i, row in enumerate(batch.copy_rows(start, start + chunk_size), start):
+                known_new = bloom is not None and row[-1] not in bloom
+                lines.append("\t".join(_copy_value(v) for v in (
+                    batch.line_no(i), *row, "t" if known_new else "f"
+                )) + "\n")
+            self._copy_isolating(copy_sql, lines, batch, start, rejects)
+        return rejects
+
+    def _copy_isolating(self, copy_sql: str, lines: list, batch,
+                        offset: int, rejects: list) -> None:
+        """
+        在保存点下 COPY 一组行；失败时优先按错误上下文中的行号切分，
+        否则二分，直到定位到单个坏行
+
+        :param offset: lines[0] 在 batch 中的下标
+        """
+        while lines:
+            self.cur.execute("SAVEPOINT staging_copy")
+            try:
+                self.cur.copy_expert(copy_sql, io.StringIO("".join(lines)))
+                self.cur.execute("RELEASE SAVEPOINT staging_copy")
+                return
+            except (errors.DataError, errors.IntegrityError) as e:
+                self.cur.execute("ROLLBACK TO SAVEPOINT staging_copy; RELEASE SAVEPOINT staging_copy")
+                error = e
+
+            if len(lines) == 1:
+                rejects.append({
+                    "row_no": batch.line_no(offset),
+                    "reason": str(error).strip().splitlines()[0],
+                    "raw_data": batch.raw_data[offset]
+                })
+                return
+
+            bad_line = _copy_error_line(error)
+            if bad_line is None or not 1 <= bad_line <= len(lines):
+                mid = len(lines) // 2
+                self._copy_isolating(copy_sql, lines[:mid], batch, offset, rejects)
+                self._copy_isolating(copy_sql, lines[mid:], batch, offset + mid, rejects)
+                return
+
+            # COPY 报告了出错行：其前的行已知无误，该行单独验证，剩余部分继续循环
+            self._copy_isolating(copy_sql, lines[:bad_line - 1], batch, offset, rejects)
+            self._copy_isolating(copy_sql, lines[bad_line - 1:bad_line], batch,
+                                 offset + bad_line - 1, rejects)
+            lines = lines[bad_line:]
+            offset += bad_line
+
+    def _check_partition_key(self, table_name: str, partition_key: tuple) -> None:
+        """
+        确认该分区键按实际分区边界会落入 table_name 下的某个叶子分区
+        批次内所有行共用同一个分区键，每个连接只需按 (目标表, 分区键) 检查一次
+
+        :param partition_key: (country_code, platform, channel, data_type)
+        :raises ValueError: 没有对应的叶子分区
+        """
+        if (table_name, partition_key) in self._routable:
+            return
+        self.cur.execute(LEAF_PARTITIONS_SQL)
+        path = _route_leaf(self.cur.fetchall(), partition_key)
+        if path is not None and table_name in path:
+            self._routable.add((table_name, partition_key))
+            return
+        raise ValueError(f"分区键 {'/'.join(partition_key)} 在 {table_name} 下没有对应的叶子分区")
+
+    def _validate_staging(self, staging: str) -> list:
+        """
+        SQL 校验：删除缺少必填字段的行
+        分区键由批次统一写入，已在加载前按实际叶子分区检查（_check_partition_key）
+        :return: 被剔除的行
+        """
+        self.cur.execute(sql.SQL("""
+            DELETE FROM {} s
+            WHERE s.transaction_date IS NULL
+               OR s.row_fingerprint IS NULL
+            RETURNING s.row_no,
+                CASE
+                    WHEN s.transaction_date IS NULL THEN 'missing transaction_date'
+                    ELSE 'missing row_fingerprint'
+                END,
+                s.raw_data::text
+        """).format(sql.Identifier(staging)))
+        rejects = [
+            {"row_no": row_no, "reason": reason, "raw_data": raw_data}
+            for row_no, reason, raw_data in self.cur.fetchall()
+        ]
+        if rejects:
+            logger.warning(f"{len(rejects)} staged rows rejected by validation")
+        return rejects
+
+    def _merge_staging(self, staging: str, table_name: str, upload_id: int) -> int:
+        """
+        去重（目标分区与已归档的指纹）后一次性写入目标分区，并在同一语句中把新插入的行累加进汇总表
+        返回插入行数
+        """
+        self.cur.execute(
+            sql.SQL("""
+                WITH s AS (
+                    INSERT INTO {table}
+                    (country_code, platform, channel, data_type, transaction_date,
+                     amount, raw_data, row_fingerprint, upload_id)
+                    SELECT DISTINCT ON (s.row_fingerprint)
+                           s.country_code, s.platform, s.channel, s.data_type, s.transaction_date,
+                           s.amount, s.raw_data, s.row_fingerprint, %s
+                    FROM {staging} s
+                    WHERE (s.known_new OR NOT EXISTS (
+                        SELECT 1 FROM {table} t WHERE t.row_fingerprint = s.row_fingerprint
+                    ))
+                    -- 已归档的行不在目标分区中，按归档时保留的指纹去重（布隆过滤器不覆盖这部分）
+                    AND NOT EXISTS (
+                        SELECT 1 FROM archived_fingerprints a
+                        WHERE a.row_fingerprint = s.row_fingerprint
+                          AND a.country_code = s.country_code AND a.platform = s.platform
+                          AND a.channel = s.channel AND a.data_type = s.data_type
+                    )
+                    ORDER BY s.row_fingerprint
+                    ON CONFLICT DO NOTHING
+                    RETURNING country_code, platform, channel, data_type,
+                              transaction_date, amount, raw_data
+                ){summaries}
+                SELECT count(*) FROM s
+            """).format(
+                table=sql.Identifier(table_name),
+                staging=sql.Identifier(staging),
+                summaries=sql.SQL("").join(
+                    sql.SQL(", {} AS ({})").format(sql.Identifier(f"upsert_{summary}"),
+                                                  self._summary_upsert(summary))
+                    for summary in SUMMARY_TABLES
+                )
+            ),
+            (upload_id,)
+        )
+        return self.cur.fetchone()[0]
+
+    @staticmethod
+    def _summary_upsert(summary: str) -> sql.Composed:
+        """把 CTE s 中的行聚合后累加进汇总表"""
+        period_column, period_expression = SUMMARY_TABLES[summary]
+        return sql.SQL("""
+            INSERT INTO {summary} AS t
+            (country_code, platform, channel, data_type, {period}, amount_type, row_count, amount_total)
+            SELECT s.country_code, s.platform, s.channel, s.data_type, {period_expr},
+                   {amount_type}, count(*), COALESCE(sum(s.amount), 0)
+            FROM s
+            GROUP BY 1, 2, 3, 4, 5, 6
+            ON CONFLICT (country_code, platform, channel, data_type, {period}, amount_type)
+            DO UPDATE SET row_count = t.row_count + EXCLUDED.row_count,
+                          amount_total = t.amount_total + EXCLUDED.amount_total
+        """).format(
+            summary=sql.Identifier(summary),
+            period=sql.Identifier(period_column),
+            period_expr=sql.SQL(period_expression),
+            amount_type=sql.SQL(AMOUNT_TYPE_EXPRESSION)
+        )
+
+    def create_summary_tables(self) -> None:
+        """创建汇总表（已存在时跳过）"""
+        for summary, (period_column, _) in SUMMARY_TABLES.items():
+            self._execute_sql(sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {summary} (
+                    country_code CHAR(2) NOT NULL,
+                    platform VARCHAR(20) NOT NULL,
+                    channel VARCHAR(50) NOT NULL,
+                    data_type VARCHAR(20) NOT NULL,
+                    {period} DATE NOT NULL,
+                    amount_type VARCHAR(100) NOT NULL DEFAULT '',
+                    row_count BIGINT NOT NULL DEFAULT 0,
+                    amount_total NUMERIC(18,2) NOT NULL DEFAULT 0,
+                    PRIMARY KEY (country_code, platform, channel, data_type, {period}, amount_type)
+                )
+            """).format(summary=sql.Identifier(summary), period=sql.Identifier(period_column)))
+
+    @profiled("db.rebuild_summaries")
+    def rebuild_summaries(self, country: str = None, platform: str = None,
+                          channel: str = None, data_type: str = None, date_from=None) -> dict:
+        """
+        从 transactions 重新计算汇总表（用于首次启用或补数）
+        可按分区键限定范围；在单个事务中先删后插，读者始终看到一致的结果
+
+        :param date_from: 只重建该日期（须为月初）及之后的汇总；
+                          已归档的数据不在 transactions 中，其汇总应保留（见 partition_archive）
+        :return: {汇总表名: 重建后的行数}
+        """
+        if date_from is not None and date_from.day != 1:
+            raise ValueError(f"date_from 必须是某月 1 日: {date_from}")
+        self.create_summary_tables()
+        conditions = [
+            sql.SQL("{} = %s").format(sql.Identifier(column))
+            for column, value in (("country_code", country), ("platform", platform),
+                                  ("channel", channel), ("data_type", data_type)) if value
+        ]
+        params = [v for v in (country, platform, channel, data_type) if v]
+        counts = {}
+        try:
+            for summary, (period_column, period_expression) in SUMMARY_TABLES.items():
+                summary_conditions, source_conditions = list(conditions), list(conditions)
+                if date_from is not None:
+                    summary_conditions.append(sql.SQL("{} >= %s").format(sql.Identifier(period_column)))
+                    source_conditions.append(sql.SQL("transaction_date >= %s"))
+                summary_where, where = (
+                    sql.SQL(" WHERE ") + sql.SQL(" AND ").join(c) if c else sql.SQL("")
+                    for c in (summary_conditions, source_conditions)
+                )
+                params_with_date = params + ([date_from] if date_from is not None else [])
+                self.cur.execute(
+                    sql.SQL("DELETE FROM {summary}{where}").format(
+                        summary=sql.Identifier(summary), where=summary_where),
+                    params_with_date
+                )
+                self.cur.execute(
+                    sql.SQL("""
+                        INSERT INTO {summary}
+                        (country_code, platform, channel, data_type, {period}, amount_type,
+                         row_count, amount_total)
+                        SELECT s.country_code, s.platform, s.channel, s.data_type, {period_expr},
+                               {amount_type}, count(*), COALESCE(sum(s.amount), 0)
+                        FROM transactions s{where}
+                        GROUP BY 1, 2, 3, 4, 5, 6
+                    """).format(
+                        summary=sql.Identifier(summary),
+                        period=sql.Identifier(period_column),
+                        period_expr=sql.SQL(period_expression),
+                        amount_type=sql.SQL(AMOUNT_TYPE_EXPRESSION),
+                        where=where
+                    ),
+                    params_with_date
+                )
+                counts[summary] = self.cur.rowcount
+            self.conn.commit()
+        except errors.Error as e:
+            self.conn.rollback()
+            logger.error(f"Summary rebuild failed: {str(e)}")
+            raise
+        logger.info(f"Rebuilt summaries {counts}")
+        return counts
+
+    def fetch_fingerprints(self, table_name: str, itersize: int = 50000):
+        """以服务器端游标流式读取分区内已有的行指纹（用于重建布隆过滤器）"""
+        with self.conn.cursor(name=f"fp_{table_name}"[:63]) as cur:
+            cur.itersize = itersize
+            cur.execute(
+                sql.SQL("SELECT row_fingerprint FROM {} WHERE row_fingerprint IS NOT NULL").format(
+                    sql.Identifier(table_name)
+                )
+            )
+            for (fp,) in cur:
+                yield fp
+        self.conn.commit()
+
+    def record_upload(self, file_name: str, file_hash: str, metadata: dict,
+                      byte_offset: int = None, row_count: int = None,
+                      prefix_hash: str = None, commit: bool = True,
+                      pipeline: StatementPipeline = None) -> int:
+        """
+        记录上传历史，返回 upload_id
+        该文件的上传占用（见 claim_upload）在同一语句中标记为已完成
+
+        :param byte_offset: 已导入内容的结束偏移（最后一个完整行之后）
+        :param row_count: 该文件累计导入的行数（含此前追加导入的部分）
+        :param prefix_hash: [0, byte_offset) 字节的 SHA-256，用于识别追加文件
+        :param commit: False 时由调用方在同一事务中提交（见 load_upload）
+        :param pipeline: 与已排队的语句一起发送，节省一次往返
+        """
         try:
             query = sql.SQL("""
-                INSERT INTO upload_history 
-                (file_name, file_hash, country_code, platform, channel, data_type)
-                VALUES (%s, %s, %s, %s, %s, %s)
+                WITH history AS (
+                    INSERT INTO upload_history
+                    (file_name, file_hash, country_code, platform, channel, data_type,
+                     byte_offset, row_count, prefix_hash)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING upload_id, file_hash
+                ), claim AS (
+                    UPDATE upload_claims c SET upload_id = history.upload_id
+                    FROM history
+                    WHERE c.file_hash = history.file_hash
+                )
+                SELECT upload_id FROM history
             """)
-            self.cur.execute(query, (
+            params = (
                 file_name, file_hash,
                 metadata.get('country'),
                 metadata.get('platform'),
                 metadata.get('channel'),
-                metadata.get('data_type')
+                metadata.get('data_type'),
+                byte_offset, row_count, prefix_hash
+            )
+            if pipeline is not None:
+                pipeline.flush(query, params)
+            else:
+                self.cur.execute(query, params)
+            upload_id = self.cur.fetchone()[0]
+            if commit:
+                self.conn.commit()
+            return upload_id
+        except errors.Error as e:
+            logger.error(f"History record failed: {str(e)}")
+            if not commit:
+                raise
+            self.conn.rollback()
+
+    def find_append_candidates(self, metadata: dict, max_offset: int) -> list:
+        """查找同一渠道下可能是当前文件前缀的历史上传"""
+        try:
+            self.cur.execute("""
+                SELECT upload_id, file_name, byte_offset, row_count, prefix_hash
+                FROM upload_history
+                WHERE country_code = %s AND platform = %s
+                  AND channel = %s AND data_type = %s
+                  AND byte_offset > 0 AND byte_offset <= %s
+                  AND prefix_hash IS NOT NULL
+                ORDER BY byte_offset
+            """, (
+                metadata.get('country'),
+                metadata.get('platform'),
+                metadata.get('channel'),
+                metadata.get('data_type'),
+                max_offset
             ))
-            self.conn.commit()
+            columns = [desc[0] for desc in self.cur.description]
+            return [dict(zip(columns, row)) for row in self.cur.fetchall()]
         except errors.Error as e:
             self.conn.rollback()
-            logger.error(f"History record failed: {str(e)}")
+            logger.error(f"Append candidate lookup failed: {str(e)}")
+            return []
 
     # ==================== 表结构管理 ====================
+    @profiled("db.create_hierarchy")
     def create_hierarchy(self):
-        """创建分层表结构"""
+        """
+        创建分层表结构
+        数百条 DDL 经管道合并为一次往返，并在同一事务中提交；
+        任一语句失败则整体回滚（语句均为 IF NOT EXISTS，可直接重试），失败的语句记录在日志中
+        """
         try:
             with open(CONFIG_PATH, "r", encoding="utf-8") as f:
                 config = yaml.safe_load(f)
 
-            # 创建主表
-            self._execute_sql("""
-                CREATE TABLE IF NOT EXISTS transactions (
-                    transaction_id BIGSERIAL,
-                    country_code CHAR(2) NOT NULL,
-                    platform VARCHAR(20) NOT NULL,
-                    channel VARCHAR(50) NOT NULL,
-                    data_type VARCHAR(20) NOT NULL,
-                    transaction_date DATE NOT NULL,
-                    amount NUMERIC(12,2),
-                    raw_data JSONB,
-                    PRIMARY KEY (country_code, platform, channel, data_type, transaction_id)
-                ) PARTITION BY LIST (country_code);
-            """)
-
-            # 创建上传历史表
-            self._execute_sql("""
-                CREATE TABLE IF NOT EXISTS upload_history (
-                    upload_id SERIAL PRIMARY KEY,
-                    upload_time TIMESTAMP DEFAULT NOW(),
-                    file_name VARCHAR(255) NOT NULL,
-                    file_hash CHAR(64) UNIQUE NOT NULL,
-                    country_code CHAR(2),
-                    platform VARCHAR(20),
-                    channel VARCHAR(50),
-                    data_type VARCHAR(20)
-                );
-            """)
-
-            # 遍历配置创建分区
-            for country in config["countries"]:
-                self._create_country_partition(country, config)
-
+            with self.pipeline():
+                self._create_schema(config)
             logger.info("Database schema initialized")
-            
         except Exception as e:
             logger.error(f"Schema creation failed: {str(e)}")
             raise
 
+    def _create_schema(self, config: dict):
+        """按 database.yaml 生成全部建表、分区与索引语句"""
+
+        # 创建主表
+        self._execute_sql("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                transaction_id BIGSERIAL,
+                country_code CHAR(2) NOT NULL,
+                platform VARCHAR(20) NOT NULL,
+                channel VARCHAR(50) NOT NULL,
+                data_type VARCHAR(20) NOT NULL,
+                transaction_date DATE NOT NULL,
+                amount NUMERIC(12,2),
+                raw_data JSONB,
+                row_fingerprint CHAR(64),
+                upload_id INTEGER,
+                PRIMARY KEY (country_code, platform, channel, data_type, transaction_id)
+            ) PARTITION BY LIST (country_code);
+        """)
+        # 兼容已存在的旧表结构
+        self._execute_sql("""
+            ALTER TABLE transactions
+                ADD COLUMN IF NOT EXISTS row_fingerprint CHAR(64),
+                ADD COLUMN IF NOT EXISTS upload_id INTEGER;
+        """)
+
+        # 创建上传历史表
+        self._execute_sql("""
+            CREATE TABLE IF NOT EXISTS upload_history (
+                upload_id SERIAL PRIMARY KEY,
+                upload_time TIMESTAMP DEFAULT NOW(),
+                file_name VARCHAR(255) NOT NULL,
+                file_hash CHAR(64) UNIQUE NOT NULL,
+                country_code CHAR(2),
+                platform VARCHAR(20),
+                channel VARCHAR(50),
+                data_type VARCHAR(20),
+                byte_offset BIGINT,
+                row_count INTEGER,
+                prefix_hash CHAR(64)
+            );
+        """)
+        self._execute_sql("""
+            ALTER TABLE upload_history
+                ADD COLUMN IF NOT EXISTS byte_offset BIGINT,
+                ADD COLUMN IF NOT EXISTS row_count INTEGER,
+                ADD COLUMN IF NOT EXISTS prefix_hash CHAR(64);
+        """)
+        # 上传占用：加载前按文件哈希占位，防止同一文件被并发重复加载
+        self._execute_sql("""
+            CREATE TABLE IF NOT EXISTS upload_claims (
+                file_hash CHAR(64) PRIMARY KEY,
+                file_name VARCHAR(255) NOT NULL,
+                claimed_by VARCHAR(50),
+                claim_token UUID NOT NULL,
+                claimed_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                upload_id INTEGER REFERENCES upload_history (upload_id) ON DELETE CASCADE
+            );
+        """)
+
+        # 已归档行的指纹（行已从分区删除，重新上传时仍按此去重，见 partition_archive）
+        self._execute_sql("""
+            CREATE TABLE IF NOT EXISTS archived_fingerprints (
+                country_code CHAR(2) NOT NULL,
+                platform VARCHAR(20) NOT NULL,
+                channel VARCHAR(50) NOT NULL,
+                data_type VARCHAR(20) NOT NULL,
+                row_fingerprint CHAR(64) NOT NULL,
+                PRIMARY KEY (row_fingerprint, country_code, platform, channel, data_type)
+            );
+        """)
+
+        # 汇总表（随每次上传增量更新）
+        self.create_summary_tables()
+
+        # 遍历配置创建分区
+        for country in config["countries"]:
+            self._create_country_partition(country, config)
+
     def _create_country_partition(self, country: str, config: dict):
         """创建国家层级分区"""
 
@@ -218,6 +887,7 @@ class DatabaseManager:
             partition_name=f"{channel_part}_default",
             is_default=True
         )
+        self._create_indexes(f"{channel_part}_default")
 
     def _create_data_type_partition(self, channel_part: str, dtype: str):
         """创建数据类型分区"""
@@ -234,64 +904,87 @@ class DatabaseManager:
                          value: str = None, subpartition: str = "", 
                          is_default: bool = False):
         """通用分区创建方法"""
-        try:
-            if is_default:
-                query = sql.SQL("""
-                    CREATE TABLE IF NOT EXISTS {partition}
-                    PARTITION OF {parent} DEFAULT {subpartition}
-                """)
-            else:
-                query = sql.SQL("""
-                    CREATE TABLE IF NOT EXISTS {partition}
-                    PARTITION OF {parent} FOR VALUES IN (%s) {subpartition}
-                """)
-
-            self.cur.execute(
-                query.format(
-                    partition=sql.Identifier(partition_name),
-                    parent=sql.Identifier(parent_table),
-                    subpartition=sql.SQL(subpartition)
-                ), 
-                (value,) if not is_default else None
-            )
-            self.conn.commit()
-        except errors.DuplicateTable:
-            logger.debug(f"Partition {partition_name} already exists")
-        except errors.Error as e:
-            self.conn.rollback()
-            logger.error(f"Partition creation failed: {str(e)}")
-            raise
+        if is_default:
+            query = sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {partition}
+                PARTITION OF {parent} DEFAULT {subpartition}
+            """)
+        else:
+            query = sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {partition}
+                PARTITION OF {parent} FOR VALUES IN (%s) {subpartition}
+            """)
+        self._execute_sql(
+            query.format(
+                partition=sql.Identifier(partition_name),
+                parent=sql.Identifier(parent_table),
+                subpartition=sql.SQL(subpartition)
+            ),
+            (value,) if not is_default else None
+        )
 
     def _create_indexes(self, table_name: str):
         """创建标准索引"""
-        try:
-            # 交易日期索引
-            self._execute_sql(
-                sql.SQL("""
-                    CREATE INDEX IF NOT EXISTS {idx} 
-                    ON {table} (transaction_date)
-                """).format(
-                    idx=sql.Identifier(f"idx_{table_name}_date"),
-                    table=sql.Identifier(table_name)
-                )
+        # 交易日期索引
+        self._execute_sql(
+            sql.SQL("""
+                CREATE INDEX IF NOT EXISTS {idx} 
+                ON {table} (transaction_date)
+            """).format(
+                idx=sql.Identifier(f"idx_{table_name}_date"),
+                table=sql.Identifier(table_name)
             )
-            
-            # JSONB数据索引
-            self._execute_sql(
-                sql.SQL("""
-                    CREATE INDEX IF NOT EXISTS {idx} 
-                    ON {table} USING GIN (raw_data)
-                """).format(
-                    idx=sql.Identifier(f"idx_{table_name}_data"),
-                    table=sql.Identifier(table_name)
-                )
+        )
+        
+        # JSONB数据索引
+        self._execute_sql(
+            sql.SQL("""
+                CREATE INDEX IF NOT EXISTS {idx} 
+                ON {table} USING GIN (raw_data)
+            """).format(
+                idx=sql.Identifier(f"idx_{table_name}_data"),
+                table=sql.Identifier(table_name)
             )
-        except errors.Error as e:
-            logger.error(f"Index creation failed: {str(e)}")
-            raise
+        )
+
+        # 行指纹唯一索引（每个叶子分区独立去重）
+        self._execute_sql(
+            sql.SQL("""
+                CREATE UNIQUE INDEX IF NOT EXISTS {idx} 
+                ON {table} (row_fingerprint)
+            """).format(
+                idx=sql.Identifier(f"idx_{table_name}_fp"),
+                table=sql.Identifier(table_name)
+            )
+        )
+
+        # 键集分页索引（数据浏览按 (transaction_date, transaction_id) 翻页，见 data_browser）
+        self._execute_sql(
+            sql.SQL("""
+                CREATE INDEX IF NOT EXISTS {idx}
+                ON {table} (transaction_date, transaction_id)
+            """).format(
+                idx=sql.Identifier(f"idx_{table_name}_date_id"),
+                table=sql.Identifier(table_name)
+            )
+        )
+
+        # 上传批次索引（本地副本按 upload_id 增量同步，见 local_replica）
+        self._execute_sql(
+            sql.SQL("""
+                CREATE INDEX IF NOT EXISTS {idx}
+                ON {table} (upload_id)
+            """).format(
+                idx=sql.Identifier(f"idx_{table_name}_upload"),
+                table=sql.Identifier(table_name)
+            )
+        )
 
     def _execute_sql(self, query, params=None):
-        """执行SQL语句"""
+        """执行SQL语句（管道模式下只排队，见 pipeline）"""
+        if self._pipeline is not None:
+            self._pipeline.add(query, params)
+            return
         try:
             self.cur.execute(query, params)
             self.conn.commit()
@@ -315,11 +1008,37 @@ class DatabaseManager:
         )
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="数据库初始化与维护")
+    commands = parser.add_subparsers(dest="command")
+    rebuild = commands.add_parser("rebuild-summaries", help="从 transactions 重建汇总表")
+    for option in ("country", "platform", "channel", "data-type"):
+        rebuild.add_argument(f"--{option}", help="只重建该分区键取值（与上传时相同的写法）")
+    rebuild.add_argument("--from", dest="date_from", type=lambda v: datetime.strptime(v, "%Y-%m-%d").date(),
+                         help="只重建该月初及之后的汇总，默认为已归档数据的截止日期")
+    args = parser.parse_args()
+
     try:
-        logger.info("Initializing database...")
         db = DatabaseManager()
-        db.create_hierarchy()
-        logger.info("Database initialization completed")
+        if args.command == "rebuild-summaries":
+            # 分区键统一为小写、空格转下划线
+            keys = {
+                name: (value or "").strip().replace(" ", "_").lower() or None
+                for name, value in (("country", args.country), ("platform", args.platform),
+                                    ("channel", args.channel), ("data_type", args.data_type))
+            }
+            date_from = args.date_from
+            if date_from is None:
+                from archive_store import ArchiveStore
+                date_from = ArchiveStore().archived_before()
+                if date_from:
+                    logger.info(f"Keeping archived summaries before {date_from}")
+            db.rebuild_summaries(**keys, date_from=date_from)
+        else:
+            logger.info("Initializing database...")
+            db.create_hierarchy()
+            logger.info("Database initialization completed")
     except Exception as e:
-        logger.critical(f"Initialization failed: {str(e)}")
+        logger.critical(f"{args.command or 'Initialization'} failed: {str(e)}")
         exit(1)
\ No newline at end of file
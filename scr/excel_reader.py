@@ -0,0 +1,175 @@
+# excel_reader.py
+import os
+import logging
+from typing import BinaryIO, Iterator, List, Optional, Sequence, Union
+from batch import RowBatch
+from converters import RowInterner
+
+logger = logging.getLogger("ExcelReader")
+
+# 在前 N 行内自动查找表头
+HEADER_SCAN_ROWS = 20
+
+try:  # 可选的 Rust 引擎，速度明显快于 openpyxl
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+
+def _clean(value):
+    """空字符串与空单元格统一为 None（与 pandas 读取时 NaN → None 一致）"""
+    if value == "":
+        return None
+    return value
+
+
+def _iter_rows_calamine(source: Union[str, BinaryIO], sheet: Union[str, int, None]) -> Iterator[tuple]:
+    if isinstance(source, str):
+        workbook = CalamineWorkbook.from_path(source)
+    else:
+        workbook = CalamineWorkbook.from_filelike(source)
+    names = workbook.sheet_names
+    if isinstance(sheet, int):
+        name = names[sheet]
+    else:
+        name = sheet or names[0]
+    worksheet = workbook.get_sheet_by_name(name)
+    rows = worksheet.iter_rows() if hasattr(worksheet, "iter_rows") else worksheet.to_python()
+    for row in rows:
+        yield tuple(_clean(v) for v in row)
+
+
+def _iter_rows_openpyxl(source: Union[str, BinaryIO], sheet: Union[str, int, None]) -> Iterator[tuple]:
+    from openpyxl import load_workbook
+
+    # 只读模式按行流式读取，不在内存中构建整个工作簿
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        if isinstance(sheet, int):
+            worksheet = workbook.worksheets[sheet]
+        elif sheet:
+            worksheet = workbook[sheet]
+        else:
+            worksheet = workbook.worksheets[0]
+        for row in worksheet.iter_rows(values_only=True):
+            yield tuple(_clean(v) for v in row)
+    finally:
+        workbook.close()
+
+
+def _iter_rows_pandas(source: Union[str, BinaryIO], sheet: Union[str, int, None]) -> Iterator[tuple]:
+    """旧版 .xls 且未安装 calamine 时的兜底方案（整表读取）"""
+    import pandas as pd
+
+    df = pd.read_excel(source, sheet_name=sheet or 0, header=None, dtype=object)
+    df = df.where(df.notna(), None)
+    for row in df.itertuples(index=False, name=None):
+        yield tuple(_clean(v) for v in row)
+
+
+def iter_sheet_rows(source: Union[str, BinaryIO], sheet: Union[str, int, None] = None,
+                    file_name: Optional[str] = None) -> Iterator[tuple]:
+    """
+    按可用引擎逐行读取工作表：calamine → openpyxl 只读模式 → pandas
+
+    :param source: 文件路径，或可 seek 的二进制流（如压缩包中的成员）
+    :param file_name: source 为流时用于判断扩展名
+    """
+    ext = os.path.splitext(file_name or str(source))[1].lower()
+    if CalamineWorkbook is not None:
+        return _iter_rows_calamine(source, sheet)
+    if ext == ".xls":
+        return _iter_rows_pandas(source, sheet)
+    return _iter_rows_openpyxl(source, sheet)
+
+
+def detect_header(rows: Sequence[tuple], expected: Sequence[str] = ()) -> int:
+    """
+    在前几行中定位表头行，返回其下标
+
+    优先选择包含全部 expected 列名的行；否则选第一行全部非空单元格都是文本、
+    且非空单元格不少于最宽行一半的行
+    """
+    expected = [e for e in expected if e]
+    width = max((sum(v is not None for v in row) for row in rows), default=0)
+    fallback = None
+    for i, row in enumerate(rows):
+        names = {str(v).strip() for v in row if v is not None}
+        if expected and all(e in names for e in expected):
+            return i
+        filled = [v for v in row if v is not None]
+        if (fallback is None and filled and len(filled) * 2 >= width
+                and all(isinstance(v, str) for v in filled)):
+            fallback = i
+    return fallback if fallback is not None else 0
+
+
+def iter_excel_batches(
+    source: Union[str, BinaryIO],
+    sheet: Union[str, int, None] = None,
+    header_row: Optional[int] = None,
+    expected_columns: Sequence[str] = (),
+    batch_size: int = 10000,
+    file_name: Optional[str] = None,
+    interner: Optional[RowInterner] = None
+) -> Iterator[RowBatch]:
+    """
+    流式读取 Excel，按 batch_size 行产出 RowBatch（与文本解析器相同的批次）
+
+    :param sheet: 工作表名称或下标，默认第一个
+    :param header_row: 表头所在行（从 1 开始）；不指定时自动识别
+    :param expected_columns: 用于识别表头的列名（如平台配置中的必填列）
+    :param file_name: source 为流时的文件名
+    :param interner: 在构造行元组之前驻留低基数列
+    :raises ValueError: 表头行不存在或为空行
+    """
+    file_name = file_name or str(source)
+    rows = iter_sheet_rows(source, sheet, file_name)
+    head: List[tuple] = []
+    for row in rows:
+        head.append(row)
+        if len(head) >= (header_row or HEADER_SCAN_ROWS):
+            break
+
+    header_index = header_row - 1 if header_row else detect_header(head, expected_columns)
+    raw_header = head[header_index] if header_index < len(head) else ()
+    # 去掉表头右侧的空列
+    width = len(raw_header)
+    while width and raw_header[width - 1] is None:
+        width -= 1
+    if not width:
+        raise ValueError(f"Excel文件第{header_index + 1}行没有表头: {os.path.basename(file_name)}")
+    header = [str(v).strip() if v is not None else f"column_{i + 1}"
+              for i, v in enumerate(raw_header[:width])]
+    logger.debug(f"{os.path.basename(file_name)}: header at row {header_index + 1}: {header}")
+
+    def data_rows():
+        yield from head[header_index + 1:]
+        yield from rows
+
+    padding = (None,) * width
+    intern = interner.bind(header) if interner is not None else None
+    chunk, line_nos = [], []
+    # 行号为工作表中的行号（表头为 header_index + 1）
+    for line_no, row in enumerate(data_rows(), header_index + 2):
+        if all(v is None for v in row):
+            continue
+        fields = list(row[:width])
+        if intern is not None:
+            intern(fields)
+        row = tuple(fields)
+        if len(row) < width:
+            row += padding[len(row):]
+        chunk.append(row)
+        line_nos.append(line_no)
+        if len(chunk) >= batch_size:
+            batch = RowBatch(header, chunk, line_nos)
+            if interner is not None:
+                intern = interner.resolve(batch)
+            yield batch
+            chunk, line_nos = [], []
+    if chunk:
+        batch = RowBatch(header, chunk, line_nos)
+        if interner is not None:
+            interner.resolve(batch)
+        yield batch
@@ -0,0 +1,291 @@
+# exporter.py
+import io
+import os
+import gzip
+import time
+import logging
+import argparse
+import threading
+from datetime import date
+from typing import Callable, List, Optional
+from psycopg2 import sql
+from database import Database
+from ingest import normalize_key
+from archive_store import ArchiveStore
+
+logger = logging.getLogger("Exporter")
+
+EXPORT_COLUMNS = ("country_code", "platform", "channel", "data_type",
+                  "transaction_date", "amount", "raw_data", "upload_id")
+# 分区键：用常量等值条件过滤，规划阶段即可裁剪分区
+PARTITION_FILTERS = ("country", "platform", "channel", "data_type")
+FORMAT_EXTENSIONS = {".csv": "csv", ".gz": "gzip", ".parquet": "parquet"}
+# pyarrow 每次从管道读取并转换的 CSV 块大小（字节），即内存上限的量级
+PARQUET_BLOCK_SIZE = 8 * 1024 * 1024
+PROGRESS_INTERVAL = 0.5
+
+
+def filter_conditions(filters: dict) -> List[sql.Composable]:
+    """
+    筛选条件 → WHERE 子句的各项条件
+
+    :param filters: country/platform/channel/data_type（与上传时相同的写法）、
+                    date_from/date_to（含两端，date 或 "YYYY-MM-DD"）
+    """
+    conditions = []
+    for name in PARTITION_FILTERS:
+        value = filters.get(name)
+        if value:
+            column = "country_code" if name == "country" else name
+            conditions.append(sql.SQL("{} = {}").format(
+                sql.Identifier(column), sql.Literal(normalize_key(value))
+            ))
+    if filters.get("date_from"):
+        conditions.append(sql.SQL("transaction_date >= {}").format(
+            sql.Literal(_as_date(filters["date_from"]))))
+    if filters.get("date_to"):
+        conditions.append(sql.SQL("transaction_date <= {}").format(
+            sql.Literal(_as_date(filters["date_to"]))))
+    return conditions
+
+
+def export_query(filters: dict, header: bool = True) -> sql.Composed:
+    """
+    按筛选条件（见 filter_conditions）生成 COPY (SELECT ...) TO STDOUT 语句
+
+    :param header: False 时不输出表头（表头已随归档数据写出）
+    """
+    conditions = filter_conditions(filters)
+    where = sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+    return sql.SQL(
+        "COPY (SELECT {columns} FROM transactions{where} ORDER BY transaction_date) "
+        "TO STDOUT WITH (FORMAT csv, HEADER {header})"
+    ).format(
+        columns=sql.SQL(", ").join(map(sql.Identifier, EXPORT_COLUMNS)),
+        where=where,
+        header=sql.SQL("true" if header else "false")
+    )
+
+
+def archive_filters(filters: dict) -> dict:
+    """导出筛选条件 → ArchiveStore 的 {分区列: [取值]}"""
+    return {
+        "country_code" if name == "country" else name: [normalize_key(filters[name])]
+        for name in PARTITION_FILTERS if filters.get(name)
+    }
+
+
+def _as_date(value) -> date:
+    return value if isinstance(value, date) else date.fromisoformat(str(value).strip())
+
+
+def export_format(output_path: str) -> str:
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext not in FORMAT_EXTENSIONS:
+        raise ValueError(f"不支持的导出格式: {ext}（支持 .csv / .csv.gz / .parquet）")
+    return FORMAT_EXTENSIONS[ext]
+
+
+class _ProgressWriter:
+    """包装输出文件：统计字节数与行数，并按间隔回调进度"""
+
+    def __init__(self, file, on_progress: Optional[Callable[[int, int], None]] = None):
+        self.file = file
+        self.on_progress = on_progress
+        self.bytes = 0
+        self.lines = 0
+        self._last = 0.0
+
+    def write(self, data) -> int:
+        self.file.write(data)
+        self.bytes += len(data)
+        # raw_data 为 JSON 文本，不含原始换行，换行数即行数
+        self.lines += data.count(b"\n" if isinstance(data, (bytes, bytearray)) else "\n")
+        now = time.monotonic()
+        if self.on_progress and now - self._last >= PROGRESS_INTERVAL:
+            self._last = now
+            self.on_progress(max(self.lines - 1, 0), self.bytes)
+        return len(data)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def export_transactions(
+    output_path: str,
+    filters: dict,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    user: str = "SYSTEM",
+    db: Optional[Database] = None
+) -> dict:
+    """
+    把筛选后的交易以 COPY TO STDOUT 流式写入 CSV / gzip / Parquet 文件
+    数据不在内存中整体停留：CSV 与 gzip 直接写盘，Parquet 按行组增量写入
+    日期范围涉及已归档的数据时，先按日期顺序写出归档部分（见 archive_store）
+
+    :param on_progress: 回调 (已导出行数, 已导出字节数)
+    :return: {"path", "format", "rows", "bytes"}
+    """
+    fmt = export_format(output_path)
+    db = db or Database()
+    context = {"export_path": output_path, "export_format": fmt,
+               **{k: str(v) for k, v in filters.items() if v}}
+    store = ArchiveStore()
+    date_from = _as_date(filters["date_from"]) if filters.get("date_from") else None
+    date_to = _as_date(filters["date_to"]) if filters.get("date_to") else None
+    archived = store.iter_sorted_tables(archive_filters(filters), date_from, date_to)
+    tmp_path = f"{output_path}.part"
+    try:
+        if fmt == "parquet":
+            rows, written = copy_to_parquet(db, export_query(filters), tmp_path, on_progress,
+                                            user, context, leading=archived)
+        else:
+            raw = gzip.open(tmp_path, "wb") if fmt == "gzip" else open(tmp_path, "wb")
+            writer = _ProgressWriter(raw, on_progress)
+            try:
+                archived_rows = _write_csv_tables(archived, writer)
+                query = export_query(filters, header=archived_rows is None)
+                rows = (archived_rows or 0) + db.copy_out(query, writer, user=user, **context)
+            finally:
+                writer.close()
+            written = writer.bytes
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if on_progress:
+        on_progress(rows, written)
+    logger.info(f"Exported {rows} rows to {output_path}")
+    return {"path": output_path, "format": fmt, "rows": rows, "bytes": written}
+
+
+def _write_csv_tables(tables, writer: _ProgressWriter) -> Optional[int]:
+    """
+    把归档数据（pyarrow.Table）以 CSV 写出，含表头
+    :return: 写出的行数；没有任何归档数据时返回 None（表头由 COPY 输出）
+    """
+    rows = None
+    for table in tables:
+        if rows is None:
+            import pyarrow.csv as pacsv
+            writer.write((",".join(EXPORT_COLUMNS) + "\n").encode("utf-8"))
+            rows = 0
+        for record_batch in table.to_batches():
+            buffer = io.BytesIO()
+            pacsv.write_csv(record_batch, buffer, write_options=pacsv.WriteOptions(include_header=False))
+            writer.write(buffer.getvalue())
+            rows += record_batch.num_rows
+    return rows
+
+
+def copy_to_parquet(db: Database, query, output_path: str, on_progress, user: str, context: dict,
+                    compression: str = "snappy", leading=()):
+    """
+    COPY 输出写入管道，另一端由 pyarrow 流式读取 CSV 并逐批写 Parquet
+
+    :param query: COPY (SELECT EXPORT_COLUMNS ...) TO STDOUT 语句（CSV、含表头）
+    :param leading: 先于 COPY 数据写入的 pyarrow.Table（如归档数据）
+    :return: (行数, 文件字节数)
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("导出 Parquet 需要安装 pyarrow")
+
+    read_fd, write_fd = os.pipe()
+    # 进度只在主线程回调（GUI 回调不能跨线程）
+    sink = _ProgressWriter(os.fdopen(write_fd, "wb"))
+    result = {}
+    # 读取端出错后关闭管道，生产者随之因管道断开而失败；据此判断哪一端先出错
+    reader_failed = threading.Event()
+
+    def produce():
+        try:
+            result["rows"] = db.copy_out(query, sink, user=user, **context)
+        except BaseException as e:
+            result["error"] = e
+            result["after_reader"] = reader_failed.is_set()
+        finally:
+            try:
+                # 关闭时会写出缓冲区；读取端已关闭则同样因管道断开而失败
+                sink.close()
+            except OSError as e:
+                if "error" not in result:
+                    result["error"] = e
+                    result["after_reader"] = reader_failed.is_set()
+
+    column_types = {
+        "country_code": pa.string(),
+        "platform": pa.string(),
+        "channel": pa.string(),
+        "data_type": pa.string(),
+        "transaction_date": pa.date32(),
+        "amount": pa.decimal128(12, 2),
+        "raw_data": pa.string(),
+        "upload_id": pa.int32()
+    }
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        with os.fdopen(read_fd, "rb") as source:
+            try:
+                reader = pacsv.open_csv(
+                    source,
+                    read_options=pacsv.ReadOptions(block_size=PARQUET_BLOCK_SIZE),
+                    convert_options=pacsv.ConvertOptions(column_types=column_types)
+                )
+                leading_rows = 0
+                with pq.ParquetWriter(output_path, reader.schema, compression=compression) as writer:
+                    for table in leading:
+                        writer.write_table(table.cast(reader.schema))
+                        leading_rows += table.num_rows
+                        if on_progress:
+                            on_progress(leading_rows, 0)
+                    for record_batch in reader:
+                        writer.write_batch(record_batch)
+                        if on_progress:
+                            on_progress(leading_rows + max(sink.lines - 1, 0), sink.bytes)
+            except BaseException:
+                reader_failed.set()
+                raise
+    except Exception:
+        producer.join()
+        error = result.get("error")
+        if error is not None and not result["after_reader"]:
+            # COPY 先出错，读取端的错误（如数据被截断）只是其后果
+            raise error
+        if error is not None:
+            logger.warning(f"COPY aborted after the Parquet writer failed: {error!r}")
+        raise
+    producer.join()
+    if "error" in result:
+        raise result["error"]
+    return leading_rows + result["rows"], os.path.getsize(output_path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="导出交易数据（COPY TO STDOUT）")
+    parser.add_argument("output", help="输出文件：.csv / .csv.gz / .parquet")
+    parser.add_argument("--country")
+    parser.add_argument("--platform")
+    parser.add_argument("--channel")
+    parser.add_argument("--data-type", dest="data_type")
+    parser.add_argument("--from", dest="date_from", help="起始日期 YYYY-MM-DD（含）")
+    parser.add_argument("--to", dest="date_to", help="结束日期 YYYY-MM-DD（含）")
+    parser.add_argument("--user", default="CLI")
+    args = parser.parse_args()
+
+    filters = {k: getattr(args, k) for k in (*PARTITION_FILTERS, "date_from", "date_to")}
+
+    def show(rows: int, written: int) -> None:
+        print(f"\r{rows:,} rows, {written / 1024 / 1024:.1f} MB", end="", flush=True)
+
+    result = export_transactions(args.output, filters, on_progress=show, user=args.user)
+    print(f"\n✅ 已导出 {result['rows']:,} 行 → {result['path']}")
+
+
+if __name__ == "__main__":
+    main()
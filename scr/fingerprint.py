@@ -0,0 +1,177 @@
+# fingerprint.py
+import json
+import math
+import hashlib
+from datetime import date, datetime
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Sequence
+
+# -------------------------
+# 路径配置
+# -------------------------
+BASE_DIR = Path(__file__).parent.parent
+BLOOM_DIR = BASE_DIR / "cache" / "bloom"
+
+
+# ==================== 行指纹 ====================
+def _canonical_value(value) -> str:
+    """统一单元格取值的文本形式（CSV 字符串与 Excel 数值得到相同结果）"""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ""
+        if value.is_integer():
+            return str(int(value))
+        return repr(value)
+    if isinstance(value, datetime):
+        if (value.hour, value.minute, value.second, value.microsecond) == (0, 0, 0, 0):
+            return value.date().isoformat()
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def row_content(row: dict) -> str:
+    """生成行内容的规范化文本（与列顺序无关）"""
+    items = sorted((str(k).strip(), _canonical_value(v)) for k, v in row.items())
+    return json.dumps(items, ensure_ascii=False, separators=(",", ":"))
+
+
+def row_content_encoder(header: Sequence[str]) -> Callable[[tuple], str]:
+    """
+    为共享表头的元组行生成内容编码函数
+    结果与 row_content(dict(zip(header, row))) 完全相同，但列排序只做一次
+    """
+    keys = [str(k).strip() for k in header]
+    width = len(keys)
+    if len(set(keys)) != width:
+        # 表头有重名列时按 dict 语义（后者覆盖前者）处理
+        return lambda row: row_content(dict(zip(header, row)))
+    order = sorted(range(width), key=keys.__getitem__)
+
+    def encode(row: tuple) -> str:
+        if len(row) != width:
+            record = dict(zip(header, row))
+            if len(row) > width:
+                record[None] = list(row[width:])
+            return row_content(record)
+        items = [(keys[i], _canonical_value(row[i])) for i in order]
+        return json.dumps(items, ensure_ascii=False, separators=(",", ":"))
+
+    return encode
+
+
+def row_fingerprint(partition_key: tuple, content: str, occurrence: int = 0) -> str:
+    """
+    计算行指纹（SHA-256）
+
+    :param partition_key: (country, platform, channel, data_type)
+    :param content: row_content() 的结果
+    :param occurrence: 同一文件内相同内容出现的序号，保证合法的重复行不被合并
+    """
+    payload = json.dumps([list(partition_key), content, occurrence],
+                         ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ==================== 布隆过滤器 ====================
+class BloomFilter:
+    """
+    基于行指纹的布隆过滤器
+    指纹本身已是 SHA-256，直接切片作为哈希值，无需再次计算
+    """
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.01):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        # 64 位十六进制指纹最多切出 8 个 32 位哈希
+        self.hash_count = min(max(int(round(self.size / capacity * math.log(2))), 1), 8)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, fingerprint: str):
+        for i in range(self.hash_count):
+            yield int(fingerprint[i * 8:(i + 1) * 8], 16) % self.size
+
+    def add(self, fingerprint: str) -> None:
+        for pos in self._positions(fingerprint):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def update(self, fingerprints: Iterable[str]) -> None:
+        for fp in fingerprints:
+            self.add(fp)
+
+    def __contains__(self, fingerprint: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(fingerprint))
+
+    @property
+    def saturated(self) -> bool:
+        """超过设计容量后误判率会快速上升，需要重建"""
+        return self.count > self.capacity
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        header = json.dumps({
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "count": self.count
+        }).encode("utf-8")
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(len(header).to_bytes(4, "big"))
+            f.write(header)
+            f.write(self.bits)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "BloomFilter":
+        with open(path, "rb") as f:
+            header_len = int.from_bytes(f.read(4), "big")
+            header = json.loads(f.read(header_len).decode("utf-8"))
+            bloom = cls(header["capacity"], header["error_rate"])
+            bits = f.read()
+        if len(bits) != len(bloom.bits):
+            raise ValueError(f"Corrupted bloom filter file: {path}")
+        bloom.bits = bytearray(bits)
+        bloom.count = header["count"]
+        return bloom
+
+
+def partition_bloom_path(table_name: str) -> Path:
+    return BLOOM_DIR / f"{table_name}.bloom"
+
+
+def load_partition_bloom(
+    table_name: str,
+    seed: Callable[[], Iterable[str]],
+    capacity: int = 1_000_000,
+    error_rate: float = 0.01
+) -> BloomFilter:
+    """
+    读取本地缓存的分区布隆过滤器
+    文件不存在、损坏或已饱和时，通过 seed() 从服务器拉取现有指纹重建
+    """
+    path = partition_bloom_path(table_name)
+    bloom: Optional[BloomFilter] = None
+    if path.exists():
+        try:
+            bloom = BloomFilter.load(path)
+        except (OSError, ValueError, KeyError):
+            bloom = None
+    if bloom is not None and bloom.saturated:
+        capacity = max(capacity, bloom.count * 2)
+        bloom = None
+    if bloom is None:
+        bloom = BloomFilter(capacity, error_rate)
+        bloom.update(seed())
+        if bloom.saturated:
+            # 现有数据超出预估容量，按实际行数重建一次
+            bloom = BloomFilter(bloom.count * 2, error_rate)
+            bloom.update(seed())
+        bloom.save(path)
+    return bloom
@@ -0,0 +1,71 @@
+# fingerprint_test.py
+from datetime import date, datetime
+from batch import RowBatch
+from fingerprint import BloomFilter, row_content, row_content_encoder, row_fingerprint
+from ingest import build_batch
+
+KEY = ("US", "AMAZON", "VENTMERE", "STANDARD")
+
+
+def _batch(rows, header=("posted-date", "amount", "sku"), occurrence_seed=None):
+    return build_batch(RowBatch(list(header), rows), *KEY, occurrence_seed=occurrence_seed)
+
+
+def test_content_ignores_column_order_and_cell_types():
+    """CSV 文本与 Excel 数值、日期单元格得到相同的内容文本"""
+    text = row_content({"sku": " A1 ", "amount": "10", "posted-date": "2024-01-05"})
+    excel = row_content({"posted-date": datetime(2024, 1, 5), "amount": 10.0, "sku": "A1"})
+    assert text == excel
+    assert row_content({"d": date(2024, 1, 5), "x": None}) == row_content({"x": float("nan"), "d": "2024-01-05"})
+    assert row_content({"amount": "10.5"}) != row_content({"amount": "10.50"})
+
+
+def test_encoder_matches_row_content():
+    header = ["sku", "amount", "posted-date"]
+    encode = row_content_encoder(header)
+    for row in [("A1", "10", "2024-01-05"), ("B2", 3.5, datetime(2024, 1, 5, 8)), ("C3", None, "")]:
+        assert encode(row) == row_content(dict(zip(header, row)))
+    # 重名列与行宽不一致时按 dict 语义
+    duplicated = row_content_encoder(["a", "a"])
+    assert duplicated(("1", "2")) == row_content({"a": "2"})
+    assert encode(("A1", "10")) == row_content({"sku": "A1", "amount": "10"})
+
+
+def test_duplicate_rows_get_distinct_fingerprints():
+    rows = [("2024-01-05", "10.00", "A1"), ("2024-01-05", "10.00", "A1"), ("2024-01-05", "5.00", "B2"),
+            ("2024-01-05", "10.00", "A1")]
+    batch = _batch(rows)
+    assert len(set(batch.fingerprints)) == 4
+    content = row_content_encoder(["posted-date", "amount", "sku"])(rows[0])
+    expected = [row_fingerprint(batch.partition_key, content, n) for n in range(3)]
+    assert [batch.fingerprints[i] for i in (0, 1, 3)] == expected
+    # 重新导入同一份数据得到相同的指纹，加载时会被跳过
+    assert _batch(list(rows)).fingerprints == batch.fingerprints
+
+
+def test_occurrence_seed_continues_numbering():
+    """增量导入时，尾部行的序号接着已导入前缀中的出现次数"""
+    rows = [("2024-01-05", "10.00", "A1")] * 3
+    whole = _batch(rows)
+    content = row_content_encoder(["posted-date", "amount", "sku"])(rows[0])
+    tail = _batch(rows[2:], occurrence_seed={content: 2})
+    assert tail.fingerprints == whole.fingerprints[2:]
+
+
+def test_fingerprint_depends_on_partition():
+    content = row_content({"amount": "1"})
+    assert row_fingerprint(KEY, content) != row_fingerprint(("CA",) + KEY[1:], content)
+
+
+def test_bloom_filter_round_trip(tmp_path):
+    fingerprints = [row_fingerprint(KEY, row_content({"n": i})) for i in range(2000)]
+    bloom = BloomFilter(capacity=2000, error_rate=0.01)
+    bloom.update(fingerprints[:1000])
+    assert all(fp in bloom for fp in fingerprints[:1000])
+    false_positives = sum(fp in bloom for fp in fingerprints[1000:])
+    assert false_positives < 50
+    path = tmp_path / "t.bloom"
+    bloom.save(path)
+    loaded = BloomFilter.load(path)
+    assert loaded.count == 1000
+    assert all(fp in loaded for fp in fingerprints[:1000])
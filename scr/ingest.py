@@ -0,0 +1,555 @@
+# ingest.py
+import os
+import csv
+import json
+import yaml
+import hashlib
+from pathlib import Path
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+from config import USER_ACTION_LOGGER
+from database_manager import DatabaseManager
+from amounts import parse_cents, parse_cents_array, format_cents, check_total
+from batch import LoadBatch, RowBatch
+from converters import date_converter, log_converter_stats, DEFAULT_DATE_FORMAT
+from fingerprint import row_content_encoder, row_fingerprint, load_partition_bloom, partition_bloom_path
+from parsers import parse_file, iter_prefix_batches, APPENDABLE_EXTENSIONS
+from parse_cache import ParseCache
+from profiling import profile, sample
+from validation import validate_rows, format_summary, ValidationError
+
+# -------------------------
+# 路径配置
+# -------------------------
+BASE_DIR = Path(__file__).parent.parent
+CONFIG_DIR = BASE_DIR / "config"
+INGEST_CONFIG_PATH = CONFIG_DIR / "ingest.yaml"
+REJECT_DIR = BASE_DIR / "logs" / "rejects"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class DuplicateUploadError(Exception):
+    """文件哈希已存在于 upload_history"""
+
+
+class UploadInProgressError(DuplicateUploadError):
+    """同一文件正由其他上传者加载（见 DatabaseManager.claim_upload）"""
+
+    def __init__(self, file_hash: str, claimed_by: Optional[str] = None, claimed_at=None):
+        super().__init__(file_hash)
+        self.claimed_by = claimed_by
+        self.claimed_at = claimed_at
+
+
+class EmptyFileError(ValueError):
+    """文件中没有可导入的数据行"""
+
+
+def load_ingest_config() -> dict:
+    """读取上传流水线配置（文件缺失时返回空配置）"""
+    if not INGEST_CONFIG_PATH.exists():
+        return {}
+    with open(INGEST_CONFIG_PATH, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+def load_platform_spec(platform: str) -> Optional[dict]:
+    """读取平台字段配置 config/<platform>.yaml（未配置的平台返回 None）"""
+    spec_path = CONFIG_DIR / f"{normalize_key(platform)}.yaml"
+    if not platform or not spec_path.exists():
+        return None
+    with open(spec_path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or None
+
+
+def normalize_key(value: str) -> str:
+    """与分区取值保持一致：空格转下划线并转小写"""
+    return (value or "").strip().replace(" ", "_").lower()
+
+
+def calculate_file_hash(file_path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(8192):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def write_rejects(file_path: str, rejects: List[dict], tag: str = "") -> Optional[Path]:
+    """
+    把被剔除的行写入 logs/rejects 下的 CSV
+    :return: 报告路径（无坏行时为 None）
+    """
+    if not rejects:
+        return None
+    REJECT_DIR.mkdir(parents=True, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    report_path = REJECT_DIR / f"{stem}_{tag or 'load'}_{timestamp}_rejects.csv"
+    fieldnames = list(dict.fromkeys(k for r in rejects for k in r))
+    with open(report_path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rejects)
+    return report_path
+
+
+def parse_workers(file_path: str, parse_config: dict) -> int:
+    """大文件启用多进程解析；小文件进程启动与回传的开销大于收益"""
+    min_bytes = float(parse_config.get("parallel_min_mb", 64)) * 1024 * 1024
+    if os.path.getsize(file_path) < min_bytes:
+        return 1
+    return int(parse_config.get("parallel_workers") or os.cpu_count() or 1)
+
+
+def generate_table_name(country: str, platform: str, channel: str, data_type: str) -> str:
+    elements = [
+        "country",
+        country.lower(),
+        platform.lower().replace(" ", "_"),
+        channel.lower().replace(" ", "_")
+    ]
+    if data_type:
+        elements.append(data_type.lower())
+    return "_".join(elements)
+
+
+# ==================== 上传流水线 ====================
+def ingest_file(
+    file_path: str,
+    metadata: dict,
+    user: str = "SYSTEM",
+    on_log: Optional[Callable[[str], None]] = None
+) -> dict:
+    """
+    导入单个文件：查重 → 增量识别 → 解析 → 转换 → 单事务加载
+    不依赖 GUI，供界面与后台任务共用；各阶段也可单独调用（见 async_ingest）
+
+    :param metadata: 含 country/platform/channel/data_type 的上传信息
+    :param on_log: 进度消息回调
+    :return: {"table_name", "total", "inserted", "skipped", "rejected", "upload_id", "reject_file"}
+    :raises DuplicateUploadError: 文件已上传过
+    :raises UploadInProgressError: 同一文件正由其他上传者加载
+    :raises EmptyFileError: 文件中没有数据行
+    :raises ValidationError: 文件未通过加载前校验
+    """
+    with profile("ingest", sample(file_path)), DatabaseManager() as db:
+        plan = plan_ingest(file_path, metadata, db, on_log, user=user)
+        try:
+            transformed = transform_file(plan, user, on_log)
+            return load_file(plan, transformed, db, on_log)
+        except BaseException:
+            release_claim(plan, db)
+            raise
+
+
+def plan_ingest(
+    file_path: str,
+    metadata: dict,
+    db: DatabaseManager,
+    on_log: Optional[Callable[[str], None]] = None,
+    user: str = "SYSTEM"
+) -> dict:
+    """
+    第一阶段（需要数据库）：计算哈希、占用文件（查重）、识别追加内容
+    成功返回后文件已被本次上传占用，后续阶段失败时须调用 release_claim
+
+    :return: 供后续阶段使用的上传计划（可序列化，可传给子进程）
+    :raises DuplicateUploadError: 文件已上传过
+    :raises UploadInProgressError: 同一文件正由其他上传者加载
+    """
+    log = on_log or (lambda message: None)
+    platform = metadata.get("platform") or ""
+    table_name = generate_table_name(
+        metadata.get("country") or "", platform,
+        metadata.get("channel") or "", metadata.get("data_type") or ""
+    )
+    spec = load_platform_spec(platform)
+    config = load_ingest_config()
+
+    # 文本格式同时计算前缀信息，用于识别持续增长的报表
+    appendable = os.path.splitext(file_path)[1].lower() in APPENDABLE_EXTENSIONS
+    scan = scan_file(file_path) if appendable else {}
+    file_hash = scan["file_hash"] if appendable else calculate_file_hash(file_path)
+
+    # 在解析之前占用文件：并发上传同一文件时只有一个继续，其余立即失败
+    claim = db.claim_upload(
+        file_hash, os.path.basename(file_path), user,
+        stale_seconds=float(config.get("claim", {}).get("stale_minutes", 120)) * 60
+    )
+    if claim["status"] == "uploaded":
+        raise DuplicateUploadError(file_hash)
+    if claim["status"] == "in_progress":
+        raise UploadInProgressError(file_hash, claim["claimed_by"], claim["claimed_at"])
+
+    start_offset, base_rows, occurrence_seed = 0, 0, None
+    try:
+        if appendable:
+            candidates = db.find_append_candidates(metadata, scan["byte_offset"])
+            append_base = match_append_base(file_path, candidates)
+            if append_base:
+                start_offset = append_base["byte_offset"]
+                base_rows = append_base["row_count"] or 0
+                occurrence_seed = prefix_occurrences(file_path, start_offset, spec)
+                log(f"🔁 检测到追加内容（基于 {append_base['file_name']}），"
+                    f"跳过已导入的 {base_rows} 行")
+    except BaseException:
+        db.release_upload_claim(file_hash, claim["token"])
+        raise
+
+    return {
+        "file_path": file_path,
+        "metadata": metadata,
+        "table_name": table_name,
+        "spec": spec,
+        "config": config,
+        "appendable": appendable,
+        "scan": scan,
+        "file_hash": file_hash,
+        "claim_token": claim["token"],
+        "start_offset": start_offset,
+        "base_rows": base_rows,
+        "occurrence_seed": occurrence_seed
+    }
+
+
+def transform_file(
+    plan: dict,
+    user: str = "SYSTEM",
+    on_log: Optional[Callable[[str], None]] = None,
+    workers: Optional[int] = None
+) -> dict:
+    """
+    第二阶段（纯本地、CPU 密集）：解析 → 校验 → 生成列式批次与行指纹
+
+    :param workers: 解析进程数，默认按 parse 配置与文件大小决定
+    :return: {"batch": LoadBatch, "validation_rejects": [...]}
+    :raises EmptyFileError: 文件中没有数据行
+    :raises ValidationError: 文件未通过加载前校验
+    """
+    log = on_log or (lambda message: None)
+    file_path, spec, metadata = plan["file_path"], plan["spec"], plan["metadata"]
+    start_offset, file_hash = plan["start_offset"], plan["file_hash"]
+    cache_config = plan["config"].get("parse_cache", {})
+    validation_config = plan["config"].get("validation", {})
+
+    file_data = None
+    # 只缓存整文件解析；增量导入的偏移随已导入前缀变化
+    cache = None
+    if cache_config.get("enabled") and not start_offset:
+        cache = ParseCache(max_bytes=int(cache_config.get("max_mb", 512)) * 1024 * 1024)
+        file_data = cache.get(file_hash, spec)
+        if file_data is not None:
+            log("⚡ 使用已缓存的解析结果")
+            cache = None
+    if file_data is None:
+        try:
+            if workers is None:
+                workers = parse_workers(file_path, plan["config"].get("parse", {}))
+            file_data = parse_file(file_path, start_offset, spec, workers=workers)
+        except Exception as e:
+            USER_ACTION_LOGGER.error("文件解析失败", extra={
+                "user": user,
+                "user_action": "PARSE_FAILED",
+                "file": file_path,
+                "error": str(e)
+            })
+            raise
+    if cache is not None and file_data:
+        # 缓存只是加速手段，写入失败（磁盘满、无权限等）不影响本次上传
+        try:
+            cache.put(file_hash, file_data, spec)
+        except Exception as e:
+            USER_ACTION_LOGGER.warning("解析缓存写入失败", extra={
+                "user": user,
+                "user_action": "PARSE_CACHE_FAILED",
+                "file": file_path,
+                "error": str(e)
+            })
+            log(f"⚠️ 解析缓存写入失败，已跳过: {e}")
+    if not file_data and not start_offset:
+        raise EmptyFileError(file_path)
+
+    # 加载前校验：按平台配置列式检查，坏文件在本地直接失败
+    validation_rejects = []
+    if spec:
+        try:
+            checked = validate_rows(
+                file_data, spec,
+                max_reject_ratio=validation_config.get("max_reject_ratio", 0.0)
+            )
+        except ValidationError as e:
+            report = write_rejects(file_path, e.result.get("rejects", []), "validation")
+            if report:
+                log(f"❌ 校验明细见 {report}")
+            raise
+        validation_rejects = checked["rejects"]
+        file_data = checked["rows"]
+        if validation_rejects:
+            log(f"⚠️ 校验剔除 {len(validation_rejects)} 行: {format_summary(checked['summary'])}")
+
+    # 转换阶段：生成列式批次与行指纹
+    batch = build_batch(
+        file_data,
+        metadata.get("country") or "",
+        metadata.get("platform") or "",
+        metadata.get("channel") or "",
+        metadata.get("data_type") or "",
+        on_warning=log,
+        occurrence_seed=plan["occurrence_seed"],
+        spec=spec
+    )
+    if not start_offset and not validation_rejects:
+        file_total = verify_file_total(file_data, batch, spec)
+        if file_total is not None:
+            log(f"✅ 金额合计与文件一致: {format_cents(file_total)}")
+    log_converter_stats()
+    log(f"📊 已解析 {len(batch)} 条记录，开始加载...")
+    return {"batch": batch, "validation_rejects": validation_rejects}
+
+
+def load_file(
+    plan: dict,
+    transformed: dict,
+    db: DatabaseManager,
+    on_log: Optional[Callable[[str], None]] = None
+) -> dict:
+    """
+    第三阶段（需要数据库）：单事务加载并写出剔除明细
+    """
+    log = on_log or (lambda message: None)
+    file_path, table_name, scan = plan["file_path"], plan["table_name"], plan["scan"]
+    batch, validation_rejects = transformed["batch"], transformed["validation_rejects"]
+    dedupe_config = plan["config"].get("dedupe", {})
+    load_config = plan["config"].get("load", {})
+
+    bloom = None
+    if dedupe_config.get("bloom_filter"):
+        bloom = load_partition_bloom(
+            table_name,
+            seed=lambda: db.fetch_fingerprints(table_name),
+            capacity=dedupe_config.get("bloom_capacity", 1_000_000),
+            error_rate=dedupe_config.get("bloom_error_rate", 0.01)
+        )
+
+    result = db.load_upload(
+        table_name, batch, os.path.basename(file_path), plan["file_hash"], plan["metadata"],
+        bloom=bloom,
+        chunk_size=load_config.get("copy_chunk_size", 10000),
+        byte_offset=scan.get("byte_offset"),
+        row_count=plan["base_rows"] + prefix_row_count(batch, scan) if plan["appendable"] else None,
+        prefix_hash=scan.get("prefix_hash")
+    )
+    if bloom is not None:
+        bloom.save(partition_bloom_path(table_name))
+
+    rejects = validation_rejects + result.pop("rejects")
+    result["rejected"] = len(rejects)
+    reject_file = write_rejects(file_path, rejects, f"upload{result['upload_id']}")
+    if reject_file:
+        log(f"⚠️ {result['rejected']} 行被剔除，详情见 {reject_file}")
+    result.update({
+        "table_name": table_name,
+        "total": len(batch) + len(validation_rejects),
+        "reject_file": reject_file
+    })
+    return result
+
+
+def release_claim(plan: dict, db: DatabaseManager) -> None:
+    """上传失败时释放 plan_ingest 取得的文件占用，使该文件可以重新上传"""
+    db.release_upload_claim(plan["file_hash"], plan["claim_token"])
+
+
+# ==================== 转换阶段 ====================
+def build_batch(
+    rows: RowBatch,
+    country: str,
+    platform: str,
+    channel: str,
+    data_type: str,
+    on_warning: Optional[Callable[[str], None]] = None,
+    occurrence_seed: Optional[Dict[str, int]] = None,
+    spec: Optional[dict] = None
+) -> LoadBatch:
+    """
+    把解析得到的 RowBatch 转换为列式的 LoadBatch，并计算行指纹
+    金额统一解析为 int64 分，全程不经过浮点
+
+    同一文件内内容完全相同的行按出现顺序编号，
+    重新下载的重叠报表会得到相同的指纹，从而在加载时被跳过
+
+    :param occurrence_seed: 增量导入时，已导入前缀中各行内容的出现次数
+    :param spec: 平台配置；其中 DATE 类型列作为交易日期、amount 列作为金额
+    """
+    date_column, date_format, amount_column = "transaction_date", DEFAULT_DATE_FORMAT, "amount"
+    for column in (spec or {}).get("columns", []):
+        if not column.get("name"):
+            continue
+        if column.get("type", "").upper() == "DATE" and date_column == "transaction_date":
+            date_column = column["name"]
+            date_format = column.get("format", date_format)
+        elif column.get("db_field") == "amount":
+            amount_column = column["name"]
+
+    partition_key = (
+        normalize_key(country),
+        normalize_key(platform),
+        normalize_key(channel),
+        normalize_key(data_type)
+    )
+    amounts = rows.column(amount_column)
+    amount_cents, invalid = parse_cents_array(amounts)
+    if invalid.any():
+        idx = int(invalid.argmax())
+        raise ValueError(f"第{rows.line_no(idx)}行金额无法解析: {amounts[idx]!r}")
+
+    to_date = date_converter(date_format)
+    encode = row_content_encoder(rows.header)
+    date_values = rows.column(date_column)
+    today = datetime.now().date()
+    occurrences = dict(occurrence_seed or {})
+    dates, raw_data, fingerprints = [], [], []
+
+    for idx, row in enumerate(rows.rows):
+        content = encode(row)
+        occurrence = occurrences.get(content, 0)
+        occurrences[content] = occurrence + 1
+
+        transaction_date = today
+        if date_values[idx]:
+            try:
+                transaction_date = to_date(date_values[idx])
+            except Exception as e:
+                if on_warning:
+                    on_warning(f"⚠️ 第{rows.line_no(idx)}行日期错误: {str(e)}")
+        dates.append(transaction_date)
+        raw_data.append(json.dumps(rows.row_dict(idx), ensure_ascii=False, default=str))
+        fingerprints.append(row_fingerprint(partition_key, content, occurrence))
+
+    return LoadBatch(partition_key, dates, amount_cents, raw_data, fingerprints, rows.line_nos)
+
+
+def verify_file_total(rows: RowBatch, batch: LoadBatch, spec: Optional[dict]) -> Optional[int]:
+    """
+    与文件自带的合计行比对明细金额（如 Amazon 结算报表的 total-amount）
+
+    :return: 文件合计（分）；平台未配置 total_column 或文件中没有合计值时返回 None
+    :raises ValidationError: 明细合计与文件合计不符
+    """
+    total_column = (spec or {}).get("total_column")
+    if not total_column:
+        return None
+    expected = next(
+        (parse_cents(value) for value in rows.column(total_column) if str(value or "").strip()),
+        None
+    )
+    if expected is None:
+        return None
+    diff = check_total(batch.amount_cents, expected)
+    if diff:
+        raise ValidationError(
+            f"金额合计不符: 文件合计 {format_cents(expected)}，"
+            f"明细合计 {format_cents(expected + diff)}，差额 {format_cents(diff)}"
+        )
+    return expected
+
+
+# ==================== 增量（追加）导入 ====================
+def scan_file(file_path: str) -> dict:
+    """
+    单次读取文件，计算整体哈希以及“最后一个完整行”之前的前缀哈希
+
+    :return: {"file_hash", "byte_offset", "prefix_hash", "line_count"}
+             line_count 为前缀 [0, byte_offset) 中的物理行数
+    """
+    hasher = hashlib.sha256()
+    prefix_hasher = hashlib.sha256()
+    position = 0
+    byte_offset = 0
+    line_count = 0
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            last_newline = chunk.rfind(b"\n")
+            if last_newline >= 0:
+                prefix_hasher = hasher.copy()
+                prefix_hasher.update(chunk[:last_newline + 1])
+                byte_offset = position + last_newline + 1
+                line_count += chunk.count(b"\n")
+            hasher.update(chunk)
+            position += len(chunk)
+    return {
+        "file_hash": hasher.hexdigest(),
+        "byte_offset": byte_offset,
+        "prefix_hash": prefix_hasher.hexdigest(),
+        "line_count": line_count
+    }
+
+
+def match_append_base(file_path: str, candidates: List[dict]) -> Optional[dict]:
+    """
+    在历史上传记录中查找当前文件的前缀
+
+    单次顺序读取，在每个候选偏移处比对前缀哈希，返回匹配的最长前缀
+    :param candidates: 含 byte_offset/prefix_hash/row_count 的历史记录
+    """
+    pending = sorted(
+        (c for c in candidates if c.get("byte_offset")),
+        key=lambda c: c["byte_offset"]
+    )
+    if not pending:
+        return None
+
+    matched = None
+    hasher = hashlib.sha256()
+    position = 0
+    with open(file_path, 'rb') as f:
+        for candidate in pending:
+            offset = candidate["byte_offset"]
+            while position < offset:
+                chunk = f.read(min(HASH_CHUNK_SIZE, offset - position))
+                if not chunk:
+                    return matched
+                hasher.update(chunk)
+                position += len(chunk)
+            if hasher.hexdigest() == candidate["prefix_hash"]:
+                matched = candidate
+    return matched
+
+
+def prefix_row_count(batch: LoadBatch, scan: dict) -> int:
+    """
+    批次中位于前缀 [0, byte_offset) 内的行数
+    文件末尾没有换行的最后一行本次照常导入，但不属于前缀：下次追加时从 byte_offset
+    起重新解析并按指纹去重，若在此计入会被重复累计
+    """
+    if batch.line_nos is None or scan.get("line_count") is None:
+        return len(batch)
+    return sum(1 for line_no in batch.line_nos if line_no <= scan["line_count"])
+
+
+def _canonical_row(row: tuple) -> tuple:
+    """与 row_content 的取值规范化一致（去空白、None 视为空串），用于廉价地预筛内容相同的行"""
+    return tuple("" if value is None else str(value).strip() for value in row)
+
+
+def prefix_occurrences(file_path: str, byte_offset: int,
+                       spec: Optional[dict] = None) -> Dict[str, int]:
+    """
+    统计尾部各行内容在已导入前缀中的出现次数
+
+    前缀按完整记录解析（引号字段可以含换行），只为与尾部某行取值相同的记录生成内容编码，
+    使尾部行的指纹序号与整份文件重新解析时一致
+    """
+    tail = parse_file(file_path, byte_offset, spec)
+    if not tail:
+        return {}
+    tail_rows = {_canonical_row(row) for row in tail.rows}
+    encode = row_content_encoder(tail.header)
+    counts: Dict[str, int] = {}
+    for batch in iter_prefix_batches(file_path, byte_offset, spec):
+        for row in batch.rows:
+            if _canonical_row(row) in tail_rows:
+                content = encode(row)
+                counts[content] = counts.get(content, 0) + 1
+    return counts
@@ -0,0 +1,66 @@
+# ingest_test.py
+from ingest import (build_batch, match_append_base, prefix_occurrences, prefix_row_count,
+                    scan_file)
+from parsers import parse_file
+
+HEADER = "transaction_date,amount,description\n"
+KEY = ("US", "Amazon", "Ventmere", "Standard")
+
+
+def _history(scan: dict, row_count: int) -> dict:
+    """upload_history 中记录的增量导入信息"""
+    return {"byte_offset": scan["byte_offset"], "prefix_hash": scan["prefix_hash"], "row_count": row_count}
+
+
+def test_grown_file_matches_its_earlier_upload(tmp_path):
+    path = tmp_path / "report.csv"
+    path.write_text(HEADER + "".join(f"2024-01-{i:02d},{i}.00,row {i}\n" for i in range(1, 11)))
+    first = scan_file(str(path))
+    assert first["byte_offset"] == path.stat().st_size
+    assert first["line_count"] == 11
+
+    earlier = _history(first, 10)
+    with open(path, "a") as f:
+        f.write("".join(f"2024-02-{i:02d},{i}.00,row {i}\n" for i in range(1, 6)))
+    grown = scan_file(str(path))
+    assert grown["file_hash"] != first["file_hash"]
+    unrelated = {"byte_offset": 20, "prefix_hash": "0" * 64, "row_count": 1}
+    assert match_append_base(str(path), [unrelated, earlier]) is earlier
+
+    tail = parse_file(str(path), earlier["byte_offset"])
+    assert [row[2] for row in tail.rows] == [f"row {i}" for i in range(1, 6)]
+    assert tail.line_nos == list(range(12, 17))
+
+
+def test_modified_prefix_does_not_match(tmp_path):
+    path = tmp_path / "report.csv"
+    path.write_text(HEADER + "2024-01-01,1.00,a\n")
+    earlier = _history(scan_file(str(path)), 1)
+    path.write_text(HEADER + "2024-01-01,2.00,a\n2024-01-02,3.00,b\n")
+    assert match_append_base(str(path), [earlier]) is None
+
+
+def test_unterminated_last_line_is_not_counted_in_prefix(tmp_path):
+    """末行没有换行时照常导入，但不计入前缀行数，下次追加时从该行重新解析"""
+    path = tmp_path / "report.csv"
+    path.write_text(HEADER + "2024-01-01,1.00,a\n2024-01-02,2.00,b")
+    scan = scan_file(str(path))
+    batch = build_batch(parse_file(str(path)), *KEY)
+    assert len(batch) == 2
+    assert prefix_row_count(batch, scan) == 1
+    assert scan["byte_offset"] == len((HEADER + "2024-01-01,1.00,a\n").encode())
+
+
+def test_prefix_occurrences_match_full_parse(tmp_path):
+    """前缀中含换行的引号字段按记录计数：追加部分的指纹与整份文件重新解析时一致"""
+    record = '2024-01-01,1.00,"two\n2024-01-02,2.00,plain"\n'
+    head = HEADER + record + "2024-01-02,2.00,plain\n" + record + '2024-01-03,3.00,"a\nb"\n'
+    path = tmp_path / "report.csv"
+    path.write_text(head + record + "2024-01-02,2.00,plain\n")
+    offset = len(head.encode())
+
+    seed = prefix_occurrences(str(path), offset)
+    assert sorted(seed.values()) == [1, 2]
+    whole = build_batch(parse_file(str(path)), *KEY)
+    appended = build_batch(parse_file(str(path), offset), *KEY, occurrence_seed=seed)
+    assert appended.fingerprints == whole.fingerprints[-len(appended):]
@@ -0,0 +1,159 @@
+# latency_harness.py
+"""
+延迟注入对比：在本地 PostgreSQL 前放一个按固定延迟转发的 TCP 代理，
+模拟跨区域的托管数据库，比较逐条执行与管道合并发送的耗时
+
+用法（会在目标库中建表，请使用测试库）：
+    python latency_harness.py --dbname fa_test --rtt-ms 80
+    python latency_harness.py --pg-host /var/run/postgresql   # 只监听 unix socket 的本地库
+数据库账号取自环境变量 DB_USER / DB_PASSWORD
+"""
+import time
+import asyncio
+import argparse
+import threading
+from config import DatabaseConfig
+from database_manager import DatabaseManager, StatementPipeline
+
+
+class DelayProxy:
+    """把每个方向上的数据延迟 delay 秒后原样转发（保持顺序，只模拟时延不限带宽）"""
+
+    def __init__(self, target_host: str, target_port: int, delay: float):
+        self.target = (target_host, target_port)
+        self.delay = delay
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        self._ready = threading.Event()
+
+    def start(self) -> int:
+        threading.Thread(target=self._run, daemon=True).start()
+        self._ready.wait()
+        return self.port
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle, "127.0.0.1", 0)
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self.loop.run_forever()
+
+    async def _handle(self, client_reader, client_writer) -> None:
+        host, port = self.target
+        if host.startswith("/"):
+            # 与 libpq 相同：以 / 开头的主机名是 unix socket 所在目录
+            server_reader, server_writer = await asyncio.open_unix_connection(
+                f"{host}/.s.PGSQL.{port}")
+        else:
+            server_reader, server_writer = await asyncio.open_connection(host, port)
+        await asyncio.gather(
+            self._pipe(client_reader, server_writer),
+            self._pipe(server_reader, client_writer),
+            return_exceptions=True
+        )
+
+    async def _pipe(self, reader, writer) -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def deliver():
+            while True:
+                due, data = await queue.get()
+                wait = due - self.loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                if not data:
+                    writer.close()
+                    return
+                writer.write(data)
+                await writer.drain()
+
+        sender = asyncio.ensure_future(deliver())
+        while True:
+            data = await reader.read(65536)
+            queue.put_nowait((self.loop.time() + self.delay, data))
+            if not data:
+                break
+        await sender
+
+
+def timed(label: str, func) -> float:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed * 1000:9.1f} ms")
+    return elapsed
+
+
+def bench_independent_statements(db: DatabaseManager, count: int) -> None:
+    print(f"\n{count} 条互不依赖的 INSERT")
+    db.cur.execute("CREATE TEMP TABLE IF NOT EXISTS latency_probe (id INT, note TEXT)")
+    db.conn.commit()
+
+    def sequential():
+        for i in range(count):
+            db.cur.execute("INSERT INTO latency_probe VALUES (%s, %s)", (i, f"row {i}"))
+        db.conn.commit()
+
+    def pipelined():
+        pipe = StatementPipeline(db.cur)
+        for i in range(count):
+            pipe.add("INSERT INTO latency_probe VALUES (%s, %s)", (i, f"row {i}"))
+        pipe.flush()
+        db.conn.commit()
+
+    slow = timed("逐条执行", sequential)
+    fast = timed("管道合并", pipelined)
+    print(f"  加速 {slow / fast:.1f}x")
+
+
+def bench_schema(db: DatabaseManager) -> None:
+    # 只收集 create_hierarchy 的语句，不发送
+    with db.pipeline(flush=False) as pipe:
+        db.create_hierarchy()
+        statements = list(pipe.statements)
+    print(f"\ncreate_hierarchy：{len(statements)} 条 DDL")
+
+    def sequential():
+        # 旧实现：每条语句单独执行并提交
+        for statement in statements:
+            db.cur.execute(statement)
+            db.conn.commit()
+
+    def pipelined():
+        db.cur.execute(b";\n".join(statements))
+        db.conn.commit()
+
+    slow = timed("逐条执行并提交", sequential)
+    fast = timed("管道合并", pipelined)
+    print(f"  加速 {slow / fast:.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="延迟注入下的往返次数对比")
+    parser.add_argument("--pg-host", default="127.0.0.1", help="主机名，或 unix socket 所在目录")
+    parser.add_argument("--pg-port", type=int, default=5432)
+    parser.add_argument("--dbname", default="fa_test")
+    parser.add_argument("--rtt-ms", type=float, default=80.0, help="模拟的往返时延")
+    parser.add_argument("--statements", type=int, default=200)
+    args = parser.parse_args()
+
+    proxy = DelayProxy(args.pg_host, args.pg_port, args.rtt_ms / 2000)
+    port = proxy.start()
+    print(f"代理 127.0.0.1:{port} → {args.pg_host}:{args.pg_port}，RTT {args.rtt_ms:.0f} ms")
+
+    DatabaseConfig.HOST, DatabaseConfig.PORT, DatabaseConfig.DB_NAME = "127.0.0.1", port, args.dbname
+    with DatabaseManager() as db:
+        # 事务中的第一条语句前 psycopg2 会先单独发送 BEGIN，先开启事务再计时
+        db.cur.execute("SELECT 1")
+        start = time.perf_counter()
+        db.cur.execute("SELECT 1")
+        db.cur.fetchone()
+        print(f"实测单次往返 {(time.perf_counter() - start) * 1000:.1f} ms")
+        bench_independent_statements(db, args.statements)
+        bench_schema(db)
+
+
+if __name__ == "__main__":
+    main()
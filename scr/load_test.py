@@ -0,0 +1,256 @@
+# load_test.py
+"""
+并发上传压测：模拟月末多名分析员同时上传，逐级提高并发数，
+统计吞吐、延迟分位数、锁等待（pg_locks / pg_stat_activity）与死锁次数
+
+用法（会在目标库中建表并写入测试数据，请使用测试库）：
+    python load_test.py --dbname fa_test --concurrency 1,2,4,8 --files 3 --rows 20000
+数据库账号取自环境变量 DB_USER / DB_PASSWORD
+"""
+import os
+import time
+import shutil
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from datetime import date, timedelta
+from typing import Dict, List
+import psycopg2
+from psycopg2 import errors
+from config import DatabaseConfig
+from database_manager import DatabaseManager
+from async_ingest import AsyncIngestEngine
+
+# 所有上传写入同一组分区与汇总行，模拟最坏情况下的争用（须是 database.yaml 中已配置的叶子分区）
+METADATA = ({"country": "US", "platform": "Amazon", "channel": "Ventmere", "data_type": "Standard"},
+            {"country": "CA", "platform": "Amazon", "channel": "Ventmere", "data_type": "Standard"})
+MONTH_DAYS = 28
+# Amazon 结算报表（config/amazon.yaml，制表符分隔）的列
+AMAZON_HEADER = ("settlement-id", "settlement-start-date", "settlement-end-date", "deposit-date",
+                 "total-amount", "currency", "transaction-type", "order-id", "merchant-order-id",
+                 "adjustment-id", "shipment-id", "marketplace-name", "amount-type", "amount-description",
+                 "amount", "fulfillment-id", "posted-date", "posted-date-time", "order-item-code",
+                 "merchant-order-item-id", "merchant-adjustment-item-id", "sku", "quantity-purchased",
+                 "promotion-id")
+AMOUNT_TYPES = ("ItemPrice", "ItemFees", "Promotion")
+
+ACTIVITY_SQL = """
+    SELECT count(*),
+           count(*) FILTER (WHERE wait_event_type = 'Lock')
+    FROM pg_stat_activity
+    WHERE datname = current_database() AND pid <> pg_backend_pid()
+"""
+# 未获得的锁及其所在关系（transactionid 等非关系锁用锁类型代替）
+WAITING_LOCKS_SQL = """
+    SELECT l.locktype, l.mode, COALESCE(c.relname::text, l.locktype)
+    FROM pg_locks l
+    JOIN pg_stat_activity a ON a.pid = l.pid
+    LEFT JOIN pg_class c ON c.oid = l.relation
+    WHERE NOT l.granted AND a.datname = current_database()
+"""
+DEADLOCKS_SQL = "SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()"
+
+
+def write_files(directory: str, run_id: str, uploaders: int, files: int, rows: int) -> List[tuple]:
+    """
+    为每个上传者生成互不重复的 Amazon 结算报表（内容唯一，不会被文件查重或行去重跳过）
+    :return: [(上传者编号, 文件路径)]
+    """
+    start = date.today().replace(day=1)
+    jobs = []
+    for uploader in range(uploaders):
+        rng = random.Random(f"{run_id}-{uploader}")
+        for index in range(files):
+            path = os.path.join(directory, f"{run_id}_u{uploader}_f{index}.txt")
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                f.write("\t".join(AMAZON_HEADER) + "\n")
+                for row in range(rows):
+                    day = start + timedelta(days=rng.randrange(MONTH_DAYS))
+                    values = dict.fromkeys(AMAZON_HEADER, "")
+                    values.update({
+                        "settlement-id": run_id[-20:],
+                        "transaction-type": "Order",
+                        "order-id": f"{run_id}-{uploader}-{index}-{row}"[:50],
+                        "marketplace-name": "Amazon.com",
+                        "amount-type": rng.choice(AMOUNT_TYPES),
+                        "amount-description": "Principal",
+                        "amount": f"{rng.randrange(-50000, 500000) / 100:.2f}",
+                        "posted-date": day.isoformat(),
+                        "sku": f"LOADTEST-{rng.randrange(100)}",
+                        "quantity-purchased": "1",
+                    })
+                    f.write("\t".join(values[column] for column in AMAZON_HEADER) + "\n")
+            jobs.append((uploader, path))
+    return jobs
+
+
+class LockMonitor:
+    """独立连接按固定间隔采样连接数、锁等待者与未获得的锁"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.waiter_seconds = 0.0
+        self.max_waiters = 0
+        self.peak_connections = 0
+        self.waits: Counter = Counter()
+        self._stop = threading.Event()
+        self._conn = psycopg2.connect(**DatabaseConfig.get_config_dict())
+        self._conn.autocommit = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def deadlocks(self) -> int:
+        with self._conn.cursor() as cur:
+            cur.execute(DEADLOCKS_SQL)
+            return cur.fetchone()[0]
+
+    def max_connections(self) -> int:
+        with self._conn.cursor() as cur:
+            cur.execute("SHOW max_connections")
+            return int(cur.fetchone()[0])
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _run(self) -> None:
+        with self._conn.cursor() as cur:
+            while not self._stop.wait(self.interval):
+                cur.execute(ACTIVITY_SQL)
+                connections, waiters = cur.fetchone()
+                cur.execute(WAITING_LOCKS_SQL)
+                for locktype, mode, relation in cur.fetchall():
+                    self.waits[(relation, mode)] += 1
+                self.peak_connections = max(self.peak_connections, connections)
+                self.max_waiters = max(self.max_waiters, waiters)
+                if waiters:
+                    self.waiter_seconds += waiters * self.interval
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _is_deadlock(error: BaseException) -> bool:
+    while error is not None:
+        if isinstance(error, errors.DeadlockDetected):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+async def run_level(jobs: List[tuple], concurrency: int) -> dict:
+    """以 concurrency 个并发数据库工作者跑完所有文件"""
+    latencies, failures = [], Counter()
+    rows = deadlock_errors = 0
+    engine = AsyncIngestEngine(parse_workers=min(concurrency, os.cpu_count() or 1),
+                               db_workers=concurrency, queue_size=concurrency)
+
+    async def one(uploader: int, path: str) -> None:
+        nonlocal rows, deadlock_errors
+        started = time.perf_counter()
+        try:
+            result = await engine.submit(path, METADATA[uploader % len(METADATA)], user=f"LOADTEST{uploader}")
+            rows += result["inserted"]
+        except Exception as e:
+            failures[type(e).__name__] += 1
+            deadlock_errors += _is_deadlock(e)
+        latencies.append(time.perf_counter() - started)
+
+    async with engine:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(uploader, path) for uploader, path in jobs))
+        elapsed = time.perf_counter() - start
+    return {"elapsed": elapsed, "latencies": latencies, "rows": rows,
+            "failures": failures, "deadlock_errors": deadlock_errors}
+
+
+def report(concurrency: int, result: dict, monitor: LockMonitor, deadlocks: int) -> None:
+    latencies, elapsed = result["latencies"], result["elapsed"]
+    print(
+        f"{concurrency:>4} {len(latencies):>6} {result['rows']:>10,} {elapsed:>8.1f}"
+        f" {len(latencies) / elapsed:>7.2f} {result['rows'] / elapsed:>10,.0f}"
+        f" {percentile(latencies, 50):>7.2f} {percentile(latencies, 90):>7.2f}"
+        f" {percentile(latencies, 99):>7.2f} {max(latencies, default=0):>7.2f}"
+        f" {monitor.waiter_seconds:>8.1f} {monitor.max_waiters:>5} {monitor.peak_connections:>5}"
+        f" {deadlocks:>4} {sum(result['failures'].values()):>4}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="并发上传压测（请使用测试库）")
+    parser.add_argument("--pg-host", default="127.0.0.1")
+    parser.add_argument("--pg-port", type=int, default=5432)
+    parser.add_argument("--dbname", default="fa_test")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="逗号分隔的并发上传者数量")
+    parser.add_argument("--files", type=int, default=3, help="每个上传者上传的文件数")
+    parser.add_argument("--rows", type=int, default=20000, help="每个文件的行数")
+    parser.add_argument("--sample-ms", type=float, default=100.0, help="锁采样间隔")
+    parser.add_argument("--keep-files", action="store_true", help="保留生成的测试文件")
+    args = parser.parse_args()
+
+    DatabaseConfig.HOST, DatabaseConfig.PORT, DatabaseConfig.DB_NAME = args.pg_host, args.pg_port, args.dbname
+    levels = [int(n) for n in args.concurrency.split(",") if n.strip()]
+    with DatabaseManager() as db:
+        db.create_hierarchy()
+        db.create_summary_tables()
+
+    directory = tempfile.mkdtemp(prefix="fa_load_test_")
+    monitor_totals: Dict[int, Counter] = {}
+    try:
+        probe = LockMonitor(args.sample_ms / 1000)
+        print(f"{args.pg_host}:{args.pg_port}/{args.dbname}，max_connections={probe.max_connections()}，"
+              f"每个上传者 {args.files} 个文件 × {args.rows:,} 行\n")
+        probe.close()
+        print(f"{'conc':>4} {'files':>6} {'rows':>10} {'sec':>8} {'file/s':>7} {'rows/s':>10}"
+              f" {'p50':>7} {'p90':>7} {'p99':>7} {'max':>7} {'lock-s':>8} {'wait':>5} {'conn':>5}"
+              f" {'dl':>4} {'err':>4}")
+        for concurrency in levels:
+            run_id = f"{int(time.time())}c{concurrency}"
+            jobs = write_files(directory, run_id, concurrency, args.files, args.rows)
+            monitor = LockMonitor(args.sample_ms / 1000)
+            deadlocks_before = monitor.deadlocks()
+            monitor.start()
+            try:
+                result = asyncio.run(run_level(jobs, concurrency))
+            finally:
+                monitor.stop()
+            deadlocks = monitor.deadlocks() - deadlocks_before
+            monitor.close()
+            report(concurrency, result, monitor, max(deadlocks, result["deadlock_errors"]))
+            monitor_totals[concurrency] = monitor.waits
+            if result["failures"]:
+                print(f"     失败: {dict(result['failures'])}")
+            if not args.keep_files:
+                for _, path in jobs:
+                    os.remove(path)
+    finally:
+        if args.keep_files:
+            print(f"\n测试文件保留在 {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print("\n锁等待最多的对象（采样次数）")
+    for concurrency, waits in monitor_totals.items():
+        if waits:
+            top = ", ".join(f"{relation} {mode}×{count}" for (relation, mode), count in waits.most_common(5))
+            print(f"  并发 {concurrency}: {top}")
+    print("\n延迟为从提交到完成的秒数（含排队）；lock-s 为锁等待者数 × 采样间隔之和；"
+          "wait 为同时等待锁的最大会话数；dl 为死锁次数")
+
+
+if __name__ == "__main__":
+    main()
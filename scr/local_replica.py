@@ -0,0 +1,251 @@
+# local_replica.py
+"""
+transactions 的本地只读副本（Parquet 文件，cache/replica）
+
+按 upload_id 增量同步：每次同步把尚未复制的上传整体拷贝为 Parquet 文件；
+首次同步另外整体复制没有 upload_id 的早期数据（记录上传批次之前导入的行）。
+报表可用 ReportEngine(mode="local") 在本地聚合，不再经过慢速链路访问远程数据库
+
+用法：
+    python local_replica.py sync
+    python local_replica.py status     # 查询服务器，显示副本落后多少次上传
+"""
+import os
+import json
+import logging
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional
+from psycopg2 import sql
+from database import Database
+from exporter import EXPORT_COLUMNS, copy_to_parquet
+from archive_store import ArchiveStore, filter_expression
+from ingest import BASE_DIR
+
+logger = logging.getLogger("LocalReplica")
+
+REPLICA_DIR = BASE_DIR / "cache" / "replica"
+STATE_NAME = "state.json"
+STATE_VERSION = 1
+# 每个副本文件最多包含的上传数（中断的同步从下一个文件继续）
+UPLOADS_PER_FILE = 200
+# 上传在单个事务中提交；比已同步的后续上传早这么久仍未出现的 upload_id 视为已回滚，水位越过它
+GAP_SETTLE = timedelta(hours=24)
+REPLICA_COLUMNS = EXPORT_COLUMNS + ("partition",)
+
+
+class LocalReplica:
+    """
+    state.json：
+        watermark      该值及以下的 upload_id 均已同步（或确认不存在）
+        legacy_synced  upload_id 为空的早期数据是否已复制
+        synced         水位之上已同步的 {upload_id: 上传时间}
+        files          [{"file", "synced_at", "rows", "uploads"}]
+        synced_at / checked_at / pending / oldest_pending  最近一次同步与检查的结果
+    """
+
+    def __init__(self, directory: Path = REPLICA_DIR, archive: Optional[ArchiveStore] = None):
+        self.directory = Path(directory)
+        self.state_path = self.directory / STATE_NAME
+        self.archive = archive or ArchiveStore()
+        self.state = self._load_state()
+
+    def _load_state(self) -> dict:
+        if self.state_path.exists():
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("version") == STATE_VERSION:
+                return state
+            logger.warning("Replica state version changed, starting a new replica")
+        return {"version": STATE_VERSION, "watermark": 0, "legacy_synced": False, "synced": {}, "files": [],
+                "synced_at": None, "checked_at": None, "pending": None, "oldest_pending": None}
+
+    def _save_state(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".json.part")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    # ==================== 同步 ====================
+    def _pending_uploads(self, db: Database, user: str) -> List[tuple]:
+        """水位之上、尚未同步的上传 [(upload_id, upload_time)]，按 upload_id 排序"""
+        rows = db.execute(
+            "SELECT upload_id, upload_time FROM upload_history WHERE upload_id > %s ORDER BY upload_id",
+            (self.state["watermark"],), user=user, action="REPLICA_CHECK"
+        )
+        return [(upload_id, uploaded) for upload_id, uploaded in rows
+                if str(upload_id) not in self.state["synced"]]
+
+    def _record_pending(self, pending: List[tuple]) -> None:
+        self.state["checked_at"] = datetime.now().isoformat(timespec="seconds")
+        self.state["pending"] = len(pending)
+        self.state["oldest_pending"] = pending[0][1].isoformat(timespec="seconds") if pending else None
+
+    def check(self, db: Optional[Database] = None, user: str = "SYSTEM") -> dict:
+        """向服务器查询副本落后的上传数（不同步数据）"""
+        self._record_pending(self._pending_uploads(db or Database(), user))
+        self._save_state()
+        return self.freshness()
+
+    def sync(self, db: Optional[Database] = None, user: str = "SYSTEM",
+             on_log: Optional[Callable[[str], None]] = None) -> dict:
+        """
+        复制所有尚未同步的上传；每写完一个文件保存一次状态
+
+        :return: {"uploads", "rows", "files"}
+        """
+        log = on_log or (lambda message: None)
+        db = db or Database()
+        copied_rows, files = 0, 0
+        if not self.state.get("legacy_synced"):
+            # 早期数据不再增加（此后的每次上传都记录 upload_id），只需复制一次
+            rows = self._copy_file(db, user, sql.SQL("upload_id IS NULL"), "legacy", 0)
+            self.state["legacy_synced"] = True
+            self._save_state()
+            copied_rows += rows
+            files += 1
+            log(f"🔄 已同步早期数据（{rows:,} 行）")
+        pending = self._pending_uploads(db, user)
+        self._record_pending(pending)
+        for start in range(0, len(pending), UPLOADS_PER_FILE):
+            chunk = pending[start:start + UPLOADS_PER_FILE]
+            ids = [upload_id for upload_id, _ in chunk]
+            rows = self._copy_file(db, user, sql.SQL("upload_id = ANY({})").format(sql.Literal(ids)),
+                                   f"{ids[0]}_{ids[-1]}", len(ids))
+            for upload_id, uploaded in chunk:
+                self.state["synced"][str(upload_id)] = uploaded.isoformat(timespec="seconds")
+            self._advance_watermark()
+            self._record_pending(pending[start + len(chunk):])
+            self._save_state()
+            copied_rows += rows
+            files += 1
+            log(f"🔄 已同步上传 {ids[0]}–{ids[-1]}（{rows:,} 行）")
+        self.state["synced_at"] = datetime.now().isoformat(timespec="seconds")
+        self._save_state()
+        logger.info(f"Replica sync copied {len(pending)} uploads, {copied_rows} rows in {files} files")
+        return {"uploads": len(pending), "rows": copied_rows, "files": files}
+
+    def _copy_file(self, db: Database, user: str, where: sql.Composable, name: str, uploads: int) -> int:
+        """把 transactions 中满足 where 的行复制为一个副本文件并登记；返回行数"""
+        # 以复制开始的时间为准：之后才归档的行在读取时由归档文件代替（见 iter_tables）
+        synced_at = datetime.now().isoformat(timespec="seconds")
+        relative = f"{datetime.now():%Y%m%d%H%M%S}_{name}.parquet"
+        path = self.directory / relative
+        self.directory.mkdir(parents=True, exist_ok=True)
+        query = sql.SQL(
+            "COPY (SELECT {columns}, tableoid::regclass::text AS partition "
+            "FROM transactions WHERE {where}) "
+            "TO STDOUT WITH (FORMAT csv, HEADER true)"
+        ).format(
+            columns=sql.SQL(", ").join(map(sql.Identifier, EXPORT_COLUMNS)),
+            where=where
+        )
+        tmp_path = f"{path}.part"
+        try:
+            rows, _ = copy_to_parquet(db, query, tmp_path, None, user,
+                                      {"replica_file": relative}, compression="zstd")
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.state["files"].append({"file": relative, "synced_at": synced_at,
+                                    "rows": rows, "uploads": uploads})
+        return rows
+
+    def _advance_watermark(self) -> None:
+        """
+        水位前进到连续已同步的最大 upload_id；
+        回滚的上传会留下永久的空缺，其后的上传已同步足够久时越过该空缺
+        """
+        synced = self.state["synced"]
+        watermark = self.state["watermark"]
+        settled_before = datetime.now() - GAP_SETTLE
+        for upload_id in sorted(int(k) for k in synced):
+            if upload_id != watermark + 1 and datetime.fromisoformat(synced[str(upload_id)]) > settled_before:
+                break
+            watermark = upload_id
+        self.state["watermark"] = watermark
+        self.state["synced"] = {k: v for k, v in synced.items() if int(k) > watermark}
+
+    # ==================== 读取 ====================
+    def require_complete(self) -> None:
+        """副本缺少早期数据时本地报表会少算，拒绝使用"""
+        if not self.state.get("legacy_synced"):
+            raise RuntimeError("本地副本尚未包含早期（无上传批次）数据，请先同步（local_replica.py sync）")
+
+    def iter_tables(self, filters: Optional[Dict[str, List[str]]] = None,
+                    date_from=None, date_to=None, columns=REPLICA_COLUMNS) -> Iterator:
+        """
+        逐个副本文件读取筛选后的 pyarrow.Table
+        复制之后又被归档的行不再返回（它们由 ArchiveStore 提供，避免重复计算）
+        """
+        if not self.state["files"]:
+            return
+        import pyarrow.dataset as ds
+        base = filter_expression(filters, date_from, date_to)
+        for item in self.state["files"]:
+            expression = base
+            for entry in self.archive.entries:
+                if entry["archived_at"] < item["synced_at"]:
+                    continue
+                archived = ((ds.field("partition") == entry["partition"])
+                            & (ds.field("transaction_date") >= datetime.fromisoformat(entry["date_from"]).date())
+                            & (ds.field("transaction_date") < datetime.fromisoformat(entry["date_to"]).date()))
+                expression = ~archived if expression is None else expression & ~archived
+            dataset = ds.dataset(str(self.directory / item["file"]), format="parquet")
+            yield dataset.to_table(columns=list(columns), filter=expression)
+
+    # ==================== 新鲜度 ====================
+    def freshness(self) -> dict:
+        """{"synced_at", "checked_at", "pending", "oldest_pending"}（本地状态，不访问服务器）"""
+        return {key: self.state.get(key) for key in ("synced_at", "checked_at", "pending", "oldest_pending")}
+
+    def describe_freshness(self, now: Optional[datetime] = None) -> str:
+        """界面上显示的副本新鲜度"""
+        state = self.freshness()
+        if not state["synced_at"]:
+            return "本地副本：尚未同步"
+        if not self.state.get("legacy_synced"):
+            return "本地副本：缺少早期数据，需要重新同步后才能使用"
+        age = (now or datetime.now()) - datetime.fromisoformat(state["synced_at"])
+        text = f"本地副本：{_format_age(age)}同步"
+        if state["pending"]:
+            checked = datetime.fromisoformat(state["checked_at"])
+            text += f"，落后 {state['pending']} 次上传（截至 {checked:%H:%M}）"
+        elif state["pending"] == 0:
+            text += "，当时已是最新"
+        return text
+
+
+def _format_age(age: timedelta) -> str:
+    minutes = int(age.total_seconds() // 60)
+    if minutes < 1:
+        return "刚刚"
+    if minutes < 60:
+        return f"{minutes} 分钟前"
+    if minutes < 60 * 48:
+        return f"{minutes // 60} 小时前"
+    return f"{minutes // (60 * 24)} 天前"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="transactions 本地副本")
+    parser.add_argument("command", choices=("sync", "status"))
+    parser.add_argument("--user", default="CLI")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    replica = LocalReplica()
+    if args.command == "sync":
+        result = replica.sync(user=args.user, on_log=print)
+        print(f"✅ 同步 {result['uploads']} 次上传，{result['rows']:,} 行")
+    else:
+        replica.check(user=args.user)
+    print(replica.describe_freshness())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# parallel_parser.py
+import io
+import os
+import csv
+import mmap
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+from batch import RowBatch
+from converters import RowInterner
+from text_rows import (text_format, read_header, iter_rows, iter_txt_lines,
+                       LEGACY_TXT_HEADER, APPENDABLE_EXTENSIONS)
+
+logger = logging.getLogger("ParallelParser")
+
+# 每个进程分到的字节段数，段越多负载越均衡
+RANGES_PER_WORKER = 4
+# 统计引号时每次切片的最大字节数
+COUNT_CHUNK_SIZE = 64 * 1024 * 1024
+# 段尾哨兵记录，正常数据中不会出现
+RANGE_SENTINEL = "\ufdd0FA_RANGE_END\ufdd0"
+# 字节段按换行切分后仍可逐段解码的编码
+SPLITTABLE_ENCODINGS = ("utf-8", "utf-8-sig", "utf8", "ascii", "latin-1", "latin1",
+                        "iso-8859-1", "cp1252", "gbk", "gb18030")
+
+
+def _count(mm: mmap.mmap, start: int, end: int, char: bytes) -> int:
+    total = 0
+    for pos in range(start, end, COUNT_CHUNK_SIZE):
+        total += mm[pos:min(end, pos + COUNT_CHUNK_SIZE)].count(char)
+    return total
+
+
+def _next_record_start(mm: mmap.mmap, pos: int, end: int, inside: bool,
+                       quotechar: Optional[bytes]) -> Tuple[int, bool]:
+    """
+    从 pos 开始找下一条记录的起点（位于引号之外的换行之后）
+    :param inside: pos 处是否在引号字段内
+    :return: (记录起点, 该处是否在引号内——始终为 False)；找不到时返回 end
+    """
+    while True:
+        newline = mm.find(b"\n", pos, end)
+        if newline < 0:
+            return end, False
+        if quotechar:
+            inside ^= bool(_count(mm, pos, newline, quotechar) & 1)
+        pos = newline + 1
+        if not inside:
+            return pos, False
+
+
+def split_ranges(mm: mmap.mmap, start: int, end: int, parts: int,
+                 quotechar: Optional[bytes] = b'"') -> List[Tuple[int, int]]:
+    """
+    把 [start, end) 切成约 parts 段，每段都从记录起点开始
+
+    按引号奇偶性判断换行是否位于引号字段内（RFC 4180：引号只用于包裹字段，
+    字段内的引号写作 ""），因此含换行的引号字段不会被切断；不规范的孤立引号
+    会让判断失效，由 iter_batches_parallel 逐段校验兜底
+    """
+    step = max((end - start) // max(parts, 1), 1)
+    bounds = [start]
+    pos, inside = start, False
+    while bounds[-1] + step < end:
+        target = bounds[-1] + step
+        if quotechar:
+            inside ^= bool(_count(mm, pos, target, quotechar) & 1)
+        pos, inside = _next_record_start(mm, target, end, inside, quotechar)
+        if pos >= end:
+            break
+        bounds.append(pos)
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _range_encoding(fmt: dict, start: int) -> str:
+    """BOM 只出现在文件开头，非开头的字节段按无 BOM 解码"""
+    if start and fmt["encoding"].lower() == "utf-8-sig":
+        return "utf-8"
+    return fmt["encoding"]
+
+
+def _parse_range(file_path: str, start: int, end: int, fmt: Optional[dict],
+                 interner: Optional[RowInterner] = None) -> Tuple[List[tuple], List[int], bool]:
+    """
+    子进程：解析一个字节段，只回传行元组（表头由主进程持有）
+
+    :return: (行元组, 段内行号, 该段是否结束在记录边界上)。段尾追加一条哨兵记录，
+             哨兵被吞进引号字段说明切分点落在了字段内部
+    """
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+    if fmt is None:
+        batches = list(iter_txt_lines(io.StringIO(data.decode("utf-8"), newline=""), interner=interner))
+        return ([row for batch in batches for row in batch.rows],
+                [n for batch in batches for n in batch.line_nos], True)
+    text = data.decode(_range_encoding(fmt, start))
+    if text and not text.endswith(("\n", "\r")):
+        text += "\n"
+    reader = csv.reader(io.StringIO(text + RANGE_SENTINEL + "\n", newline=""),
+                        delimiter=fmt["delimiter"])
+    header = fmt["header"]
+    batches = list(iter_rows(reader, header, line_offset=0, interner=interner))
+    rows = [row for batch in batches for row in batch.rows]
+    line_nos = [n for batch in batches for n in batch.line_nos]
+    sentinel = (RANGE_SENTINEL,) + (None,) * (len(header) - 1)
+    if not rows or rows[-1] != sentinel:
+        return [], [], False
+    return rows[:-1], line_nos[:-1], True
+
+
+def _parse_from(file_path: str, start: int, fmt: dict, line_offset: int,
+                interner: Optional[RowInterner] = None) -> Iterator[RowBatch]:
+    """从记录起点 start（其前有 line_offset 个物理行）顺序解析到文件末尾"""
+    with open(file_path, "rb") as raw:
+        raw.seek(start)
+        text = io.TextIOWrapper(raw, encoding=_range_encoding(fmt, start), newline="")
+        yield from iter_rows(csv.reader(text, delimiter=fmt["delimiter"]), fmt["header"],
+                             line_offset=line_offset, interner=interner)
+
+
+def supports_parallel(file_path: str, spec: Optional[dict] = None) -> bool:
+    """只有未压缩的 TXT/CSV 且编码可按字节段解码时才能并行解析"""
+    if os.path.splitext(file_path)[1].lower() not in APPENDABLE_EXTENSIONS:
+        return False
+    delimited = text_format(file_path, spec)
+    return not delimited or delimited["encoding"].lower() in SPLITTABLE_ENCODINGS
+
+
+def iter_batches_parallel(file_path: str, start_offset: int = 0, spec: Optional[dict] = None,
+                          workers: Optional[int] = None,
+                          interner: Optional[RowInterner] = None) -> Iterator[RowBatch]:
+    """
+    把单个大文本文件按换行对齐的字节段分给多个进程解析，按原顺序产出批次
+    每段都校验是否结束在记录边界上；切分点若落在引号字段内（例如非引号字段里
+    混有零散的 "，奇偶判断失效），从该段起改为顺序解析，结果与顺序解析一致
+
+    :param workers: 进程数，默认 CPU 核数
+    :param interner: 随任务传给子进程，在子进程中构造行元组时驻留低基数列
+    """
+    workers = workers or os.cpu_count() or 1
+    delimited = text_format(file_path, spec)
+    if delimited:
+        header = read_header(file_path, delimited["delimiter"], delimited["encoding"])
+        if delimited["require_amount"] and 'amount' not in header:
+            raise ValueError("CSV文件必须包含amount列")
+        fmt = {"delimiter": delimited["delimiter"], "encoding": delimited["encoding"],
+               "header": header}
+        quotechar = b'"'
+    else:
+        header, fmt, quotechar = LEGACY_TXT_HEADER, None, None
+
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= start_offset:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = start_offset
+            if fmt is not None and not start_offset:
+                # 跳过表头记录
+                start, _ = _next_record_start(mm, 0, size, False, quotechar)
+            ranges = split_ranges(mm, start, size, workers * RANGES_PER_WORKER, quotechar)
+            # 各段起点之前的物理行数，用于把段内行号换算为源文件行号
+            line_offsets, lines = [], _count(mm, 0, start, b"\n")
+            for range_start, range_end in ranges:
+                line_offsets.append(lines)
+                lines += _count(mm, range_start, range_end, b"\n")
+
+    logger.info(f"Parsing {os.path.basename(file_path)} in {len(ranges)} ranges "
+                f"on {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            _parse_range,
+            [file_path] * len(ranges),
+            [r[0] for r in ranges],
+            [r[1] for r in ranges],
+            [fmt] * len(ranges),
+            [interner] * len(ranges)
+        )
+        for (range_start, _), line_offset, (rows, line_nos, clean) in zip(ranges, line_offsets,
+                                                                           results):
+            if not clean:
+                logger.warning(f"{os.path.basename(file_path)}: range at byte {range_start} "
+                               f"did not end on a record boundary, parsing the rest sequentially")
+                executor.shutdown(cancel_futures=True)
+                yield from _parse_from(file_path, range_start, fmt, line_offset, interner)
+                return
+            if rows:
+                yield RowBatch(header, rows, [line_offset + n for n in line_nos])
@@ -0,0 +1,59 @@
+# parallel_parser_test.py
+import random
+import pytest
+from parsers import parse_file
+
+HEADER = "transaction_date,amount,description\n"
+
+
+def _write_csv(path, rows: int, seed: int = 0) -> None:
+    """含换行的引号字段、转义引号与未加引号字段中的孤立引号混合出现"""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(HEADER)
+        for i in range(rows):
+            kind = rng.randrange(5)
+            if kind == 0:
+                description = f'"line one {i}\nline two, with comma"'
+            elif kind == 1:
+                description = f'"say ""hi"" {i}\n\nafter blank line"'
+            elif kind == 2:
+                description = f'5" screen {i}'
+            elif kind == 3:
+                description = f'odd "" quotes {i}'
+            else:
+                description = f"plain {i}"
+            f.write(f"2024-01-{i % 28 + 1:02d},{rng.randrange(-9999, 99999) / 100:.2f},{description}\n")
+
+
+def _assert_source_lines(path, parsed):
+    """每条记录的行号指向其在源文件中的起始物理行"""
+    lines = path.read_text(encoding="utf-8").split("\n")
+    assert len(parsed.line_nos) == len(parsed.rows)
+    for row, line_no in zip(parsed.rows, parsed.line_nos):
+        assert lines[line_no - 1].startswith(f"{row[0]},{row[1]},")
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_parallel_matches_sequential(tmp_path, seed):
+    path = tmp_path / "quoted.csv"
+    _write_csv(path, 3000, seed)
+    sequential = parse_file(str(path), workers=1)
+    parallel = parse_file(str(path), workers=4)
+    assert parallel.header == sequential.header
+    assert parallel.rows == sequential.rows
+    assert parallel.line_nos == sequential.line_nos
+    _assert_source_lines(path, sequential)
+
+
+def test_parallel_matches_sequential_from_offset(tmp_path):
+    path = tmp_path / "quoted.csv"
+    _write_csv(path, 2000)
+    data = path.read_bytes()
+    # 从某条不含引号的完整记录之后开始（增量导入）
+    offset = data.index(b"\n", data.index(b",plain ", len(data) // 2)) + 1
+    sequential = parse_file(str(path), offset, workers=1)
+    parallel = parse_file(str(path), offset, workers=4)
+    assert parallel.rows == sequential.rows
+    assert parallel.line_nos == sequential.line_nos
+    _assert_source_lines(path, sequential)
@@ -0,0 +1,220 @@
+# parse_cache.py
+import os
+import json
+import hashlib
+import logging
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+from batch import RowBatch
+
+logger = logging.getLogger("ParseCache")
+
+BASE_DIR = Path(__file__).parent.parent
+PARSE_CACHE_DIR = BASE_DIR / "cache" / "parsed"
+# 缓存格式或解析结果有不兼容的变化时递增，旧缓存随之失效
+PARSER_VERSION = 3
+# 决定解析结果的模块；源码变化后旧缓存自动失效，不依赖手动递增版本号
+PARSER_MODULES = ("batch", "text_rows", "parsers", "parallel_parser", "excel_reader",
+                  "archives", "converters")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+CACHE_SUFFIX = ".arrow"
+# 早期版本用 pickle 保存的缓存：不再读取，淘汰时直接删除
+LEGACY_SUFFIX = ".parsed"
+
+# Arrow 无法按单一类型存放的列（Excel 中同一列混有文本、数字、日期）按 (类型标记, 文本) 存放
+_NONE, _STR, _INT, _FLOAT, _BOOL, _DATETIME, _DATE, _TIME, _TIMEDELTA = range(9)
+_ENCODERS = (
+    (bool, _BOOL, lambda v: "1" if v else "0"),
+    (int, _INT, str),
+    (float, _FLOAT, repr),
+    (str, _STR, lambda v: v),
+    (datetime, _DATETIME, datetime.isoformat),
+    (date, _DATE, date.isoformat),
+    (time, _TIME, time.isoformat),
+    (timedelta, _TIMEDELTA, lambda v: str(v // timedelta(microseconds=1))),
+)
+_DECODERS = {
+    _STR: lambda t: t,
+    _INT: int,
+    _FLOAT: float,
+    _BOOL: lambda t: t == "1",
+    _DATETIME: datetime.fromisoformat,
+    _DATE: date.fromisoformat,
+    _TIME: time.fromisoformat,
+    _TIMEDELTA: lambda t: timedelta(microseconds=int(t)),
+}
+
+
+@lru_cache(maxsize=1)
+def parser_digest() -> str:
+    """解析相关模块源码的摘要；源码不可读（如打包发布）时为空串，只按 PARSER_VERSION 区分"""
+    hasher = hashlib.sha256()
+    for name in PARSER_MODULES:
+        try:
+            hasher.update(Path(__file__).with_name(f"{name}.py").read_bytes())
+        except OSError:
+            return ""
+    return hasher.hexdigest()
+
+
+def cache_version(spec: Optional[dict] = None) -> str:
+    """由解析器版本、解析代码与平台配置得出的版本键；任一变化后不会命中旧缓存"""
+    payload = json.dumps({"parser": PARSER_VERSION, "code": parser_digest(), "spec": spec or {}},
+                         sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+@lru_cache(maxsize=1)
+def _pyarrow():
+    """缓存依赖 pyarrow；未安装时缓存不可用（只影响速度）"""
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+    except ImportError:
+        logger.info("pyarrow is not installed, parse cache disabled")
+        return None
+    return pyarrow
+
+
+def _encode_mixed(values: list):
+    """混合类型的列 → (类型标记列表, 文本列表)；有无法表示的取值时返回 None"""
+    tags, texts = [], []
+    for value in values:
+        if value is None:
+            tags.append(_NONE)
+            texts.append(None)
+            continue
+        for kind, tag, encode in _ENCODERS:
+            # bool 是 int 的子类、datetime 是 date 的子类，按精确类型匹配
+            if type(value) is kind:
+                tags.append(tag)
+                texts.append(encode(value))
+                break
+        else:
+            return None
+    return tags, texts
+
+
+def _decode_mixed(tags: list, texts: list) -> list:
+    return [None if tag == _NONE else _DECODERS[tag](text) for tag, text in zip(tags, texts)]
+
+
+class ParseCache:
+    """
+    已解析文件的本地缓存，键为文件内容的 SHA-256 + 版本键
+    以 Arrow IPC 文件按列存储（表头存于 schema 元数据），总大小超过上限时按最近使用时间淘汰
+    缓存目录中的文件只按列数据读取，不会执行其中的任何内容
+    """
+
+    def __init__(self, directory: Path = PARSE_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+
+    def path(self, file_hash: str, spec: Optional[dict] = None) -> Path:
+        return self.directory / f"{file_hash}_{cache_version(spec)}{CACHE_SUFFIX}"
+
+    def get(self, file_hash: str, spec: Optional[dict] = None) -> Optional[RowBatch]:
+        pa = _pyarrow()
+        path = self.path(file_hash, spec)
+        if pa is None or not path.exists():
+            return None
+        try:
+            with pa.memory_map(str(path), "r") as source:
+                table = pa.ipc.open_file(source).read_all()
+            meta = json.loads(table.schema.metadata[b"parse_cache"])
+            columns = []
+            for i, mixed in enumerate(meta["mixed"]):
+                values = table.column(f"c{i}").to_pylist()
+                if mixed:
+                    values = _decode_mixed(table.column(f"t{i}").to_pylist(), values)
+                columns.append(values)
+            rows = list(zip(*columns)) if columns else []
+            line_nos = table.column("line_no").to_pylist() if meta["line_nos"] else None
+        except (OSError, KeyError, ValueError, TypeError, pa.ArrowException) as e:
+            logger.warning(f"Discarding unreadable parse cache {path.name}: {e}")
+            path.unlink(missing_ok=True)
+            return None
+        # 更新访问时间，供 LRU 淘汰使用
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        logger.debug(f"Parse cache hit: {path.name} ({len(rows)} rows)")
+        return RowBatch(meta["header"], rows, line_nos)
+
+    def put(self, file_hash: str, rows: RowBatch, spec: Optional[dict] = None) -> None:
+        pa = _pyarrow()
+        if pa is None:
+            return
+        width = len(rows.header)
+        # 行中超出表头的多余字段无法列式存放，这类文件不缓存
+        if any(len(row) != width for row in rows.rows):
+            return
+        arrays, names, mixed = [], [], []
+        for i, column in enumerate(zip(*rows.rows) if rows.rows else [()] * width):
+            values = list(column)
+            try:
+                array = pa.array(values)
+                if pa.types.is_string(array.type) or pa.types.is_null(array.type):
+                    exact = True  # 推断为文本说明全部取值都是 str 或 None
+                else:
+                    # 往返后必须得到同样类型的同样取值（如同列中的 int 与 float 会统一为 double）
+                    restored = array.to_pylist()
+                    exact = restored == values and all(type(a) is type(b) for a, b in zip(restored, values))
+            except (pa.ArrowException, OverflowError):
+                exact = False
+            if exact:
+                arrays.append(array)
+                names.append(f"c{i}")
+                mixed.append(False)
+                continue
+            encoded = _encode_mixed(values)
+            if encoded is None:
+                logger.debug(f"Column {rows.header[i]!r} has values the parse cache cannot store, not caching")
+                return
+            tags, texts = encoded
+            arrays += [pa.array(texts, pa.string()), pa.array(tags, pa.int8())]
+            names += [f"c{i}", f"t{i}"]
+            mixed.append(True)
+        if rows.line_nos is not None:
+            arrays.append(pa.array(rows.line_nos, pa.int64()))
+            names.append("line_no")
+        meta = {"header": list(rows.header), "mixed": mixed, "line_nos": rows.line_nos is not None}
+        table = pa.table(arrays, names=names).replace_schema_metadata(
+            {"parse_cache": json.dumps(meta, ensure_ascii=False)})
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(file_hash, spec)
+        tmp_path = path.with_suffix(".tmp")
+        options = pa.ipc.IpcWriteOptions(compression="zstd" if pa.Codec.is_available("zstd") else None)
+        with pa.OSFile(str(tmp_path), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+        tmp_path.replace(path)
+        self.evict()
+
+    def evict(self) -> None:
+        """总大小超过上限时，从最久未使用的条目开始删除"""
+        for path in self.directory.glob(f"*{LEGACY_SUFFIX}"):
+            path.unlink(missing_ok=True)
+        entries = []
+        for path in self.directory.glob(f"*{CACHE_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            logger.debug(f"Evicted parse cache {path.name}")
+
+    def clear(self) -> None:
+        for suffix in (CACHE_SUFFIX, LEGACY_SUFFIX):
+            for path in self.directory.glob(f"*{suffix}"):
+                path.unlink(missing_ok=True)
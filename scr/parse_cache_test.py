@@ -0,0 +1,53 @@
+# parse_cache_test.py
+import math
+from datetime import date, datetime, time, timedelta, timezone
+from batch import RowBatch
+from parse_cache import ParseCache
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, float) and math.isnan(a):
+        return isinstance(b, float) and math.isnan(b)
+    return type(a) is type(b) and a == b
+
+
+def test_round_trip_keeps_values_and_types(tmp_path):
+    """Excel 同一列可能混有文本、数字、日期；读回的取值与类型必须与解析结果一致"""
+    rows = RowBatch(["id", "id", "mixed", "number", "when", "empty"], [
+        ("a", "1", 1, 1.5, datetime(2024, 1, 5), None),
+        (None, "", "text", 2.0, datetime(2024, 1, 6, 10, 30, tzinfo=timezone.utc), None),
+        ("b", "3", 2.5, float("nan"), date(2024, 1, 7), None),
+        ("c", "4", True, 7, time(1, 2, 3), None),
+        ("d", "5", timedelta(days=1, microseconds=3), -0.0, None, None),
+    ], [2, 3, 5, 6, 9])
+    cache = ParseCache(tmp_path)
+    cache.put("hash", rows)
+    cached = cache.get("hash")
+    assert cached.header == rows.header
+    assert cached.line_nos == rows.line_nos
+    for row, cached_row in zip(rows.rows, cached.rows):
+        assert all(_same(a, b) for a, b in zip(row, cached_row)), (row, cached_row)
+
+
+def test_spec_change_misses(tmp_path):
+    cache = ParseCache(tmp_path)
+    cache.put("hash", RowBatch(["a"], [("1",)]), {"delimiter": ","})
+    assert cache.get("hash", {"delimiter": ","}).rows == [("1",)]
+    assert cache.get("hash", {"delimiter": "\t"}) is None
+
+
+def test_unreadable_entries_are_discarded(tmp_path):
+    cache = ParseCache(tmp_path)
+    cache.put("hash", RowBatch(["a"], [("1",)]))
+    path = cache.path("hash")
+    path.write_bytes(b"not arrow")
+    assert cache.get("hash") is None
+    assert not path.exists()
+
+
+def test_legacy_pickle_entries_are_never_loaded(tmp_path):
+    legacy = tmp_path / "hash_0000.parsed"
+    legacy.write_bytes(b"\x80\x04K\x01.")
+    cache = ParseCache(tmp_path)
+    cache.put("other", RowBatch(["a"], [("1",)]))
+    assert not legacy.exists()
@@ -0,0 +1,168 @@
+# parsers.py
+import io
+import os
+import csv
+from typing import Iterator, Optional
+from batch import RowBatch
+from converters import RowInterner
+from excel_reader import iter_excel_batches
+from archives import is_archive, iter_members
+from text_rows import (APPENDABLE_EXTENSIONS, DEFAULT_BATCH_SIZE,
+                       text_format, read_header, iter_rows, iter_txt_lines, count_lines)
+from parallel_parser import iter_batches_parallel, supports_parallel
+
+EXCEL_EXTENSIONS = ('.xls', '.xlsx')
+
+
+def iter_batches(file_path: str, start_offset: int = 0, spec: Optional[dict] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, workers: int = 1) -> Iterator[RowBatch]:
+    """
+    按扩展名流式解析文件，每次产出最多 batch_size 行的 RowBatch（各批次表头相同）
+
+    :param start_offset: 从该字节偏移（必须位于行首）开始解析，仅文本格式支持
+    :param spec: 平台配置（config/<platform>.yaml），决定 TXT 的分隔符与编码、
+                 Excel 的工作表（sheet）与表头行（header_row）
+    :param workers: 大于 1 时，TXT/CSV 按字节段分给多个进程并行解析
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if start_offset and ext not in APPENDABLE_EXTENSIONS:
+        raise ValueError(f"{ext} 文件不支持增量解析")
+    delimited = text_format(file_path, spec)
+    # 低基数列（类型、日期等）的重复取值共享同一对象，在构造行元组时驻留
+    interner = RowInterner(spec)
+    if workers > 1 and ext in APPENDABLE_EXTENSIONS:
+        if supports_parallel(file_path, spec):
+            yield from iter_batches_parallel(file_path, start_offset, spec, workers, interner)
+            return
+    if is_archive(file_path):
+        yield from _iter_archive(file_path, spec, batch_size, interner)
+    elif delimited:
+        yield from _iter_delimited(file_path, start_offset, batch_size=batch_size,
+                                   interner=interner, **delimited)
+    elif ext == '.txt':
+        yield from _iter_txt(file_path, start_offset, batch_size, interner)
+    elif ext in EXCEL_EXTENSIONS:
+        yield from _iter_excel(file_path, spec, batch_size, interner=interner)
+    else:
+        raise ValueError("不支持的文件格式")
+
+
+def parse_file(file_path: str, start_offset: int = 0, spec: Optional[dict] = None,
+               workers: int = 1) -> RowBatch:
+    """按扩展名解析整个文件，返回共享表头、元组行的 RowBatch"""
+    merged = None
+    for batch in iter_batches(file_path, start_offset, spec, workers=workers):
+        merged = batch if merged is None else merged.extend(batch)
+    return merged if merged is not None else RowBatch(())
+
+
+def iter_prefix_batches(file_path: str, end_offset: int, spec: Optional[dict] = None,
+                        batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[RowBatch]:
+    """
+    解析文件开头 [0, end_offset) 内的记录（含换行的引号字段按一条记录处理）
+    end_offset 须位于记录边界，如上次导入的 byte_offset
+    """
+    delimited = text_format(file_path, spec)
+    if delimited:
+        lines = _iter_lines_until(file_path, end_offset, delimited["encoding"])
+        reader = csv.reader(lines, delimiter=delimited["delimiter"])
+        header = next(reader, [])
+        yield from iter_rows(reader, header, batch_size, line_offset=0)
+    elif os.path.splitext(file_path)[1].lower() == '.txt':
+        yield from iter_txt_lines(_iter_lines_until(file_path, end_offset), batch_size)
+    else:
+        raise ValueError("该文件不支持按行解析")
+
+
+def _iter_lines_until(file_path: str, end_offset: int, encoding: str = 'utf-8') -> Iterator[str]:
+    """逐行读取 [0, end_offset) 的文本（保留行尾换行，供 csv.reader 识别引号内的换行）"""
+    position = 0
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if position >= end_offset:
+                return
+            yield line[:end_offset - position].decode(encoding)
+            position += len(line)
+
+
+def _open_text_from(file_path: str, start_offset: int, encoding: str = 'utf-8') -> io.TextIOWrapper:
+    raw = open(file_path, 'rb')
+    raw.seek(start_offset)
+    return io.TextIOWrapper(raw, encoding=encoding, newline='')
+
+
+def _iter_txt(file_path: str, start_offset: int = 0, batch_size: int = DEFAULT_BATCH_SIZE,
+              interner: Optional[RowInterner] = None) -> Iterator[RowBatch]:
+    line_offset = count_lines(file_path, start_offset) if start_offset else 0
+    with _open_text_from(file_path, start_offset) as f:
+        yield from iter_txt_lines(f, batch_size, line_offset, interner)
+
+
+def _iter_delimited(file_path: str, start_offset: int = 0, delimiter: str = ',',
+                    encoding: str = 'utf-8', require_amount: bool = True,
+                    batch_size: int = DEFAULT_BATCH_SIZE,
+                    interner: Optional[RowInterner] = None) -> Iterator[RowBatch]:
+    """解析带表头的 CSV / 制表符分隔文本"""
+    line_offset = count_lines(file_path, start_offset) if start_offset else 0
+    with _open_text_from(file_path, start_offset, encoding) as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        header = read_header(file_path, delimiter, encoding) if start_offset else next(reader, [])
+        if require_amount and 'amount' not in header:
+            raise ValueError("CSV文件必须包含amount列")
+        yield from iter_rows(reader, header, batch_size, line_offset, interner)
+
+
+def _iter_excel(source, spec: Optional[dict] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                file_name: Optional[str] = None,
+                interner: Optional[RowInterner] = None) -> Iterator[RowBatch]:
+    """
+    流式读取 Excel；表头按平台配置的必填列识别，未配置平台时要求 amount 列
+
+    :param source: 文件路径或可 seek 的二进制流
+    """
+    spec = spec or {}
+    if spec.get("columns"):
+        expected = [c["name"] for c in spec["columns"] if c.get("required") and c.get("name")]
+    else:
+        expected = ["amount"]
+    first = True
+    for batch in iter_excel_batches(source, sheet=spec.get("sheet"),
+                                    header_row=spec.get("header_row"),
+                                    expected_columns=expected, batch_size=batch_size,
+                                    file_name=file_name, interner=interner):
+        if first and not spec.get("columns") and batch.index("amount") is None:
+            raise ValueError("Excel文件必须包含amount列")
+        first = False
+        yield batch
+
+
+def _iter_archive(file_path: str, spec: Optional[dict] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                  interner: Optional[RowInterner] = None) -> Iterator[RowBatch]:
+    """
+    从 .gz / .bz2 / .zip 中直接解析，不解压到临时文件
+    格式由成员文件名判断；zip 中的多个成员依次解析，表头必须一致
+    """
+    parsed = 0
+    for name, stream in iter_members(file_path):
+        with stream:
+            ext = os.path.splitext(name)[1].lower()
+            delimited = text_format(name, spec)
+            if delimited:
+                text = io.TextIOWrapper(stream, encoding=delimited["encoding"], newline='')
+                reader = csv.reader(text, delimiter=delimited["delimiter"])
+                header = next(reader, [])
+                if delimited["require_amount"] and 'amount' not in header:
+                    raise ValueError(f"{name}: CSV文件必须包含amount列")
+                yield from iter_rows(reader, header, batch_size, line_offset=0, interner=interner)
+            elif ext == '.txt':
+                yield from iter_txt_lines(io.TextIOWrapper(stream, encoding='utf-8', newline=''),
+                                           batch_size, interner=interner)
+            elif ext in EXCEL_EXTENSIONS:
+                # 工作簿需要随机访问，成员在内存中缓冲
+                yield from _iter_excel(io.BytesIO(stream.read()), spec, batch_size, file_name=name,
+                                       interner=interner)
+            else:
+                continue
+        parsed += 1
+    if not parsed:
+        raise ValueError("压缩包中没有可解析的文件")
@@ -0,0 +1,245 @@
+# partition_archive.py
+"""
+把截止日期之前的交易从在线分区归档为压缩的 Parquet 文件，并从数据库中删除
+
+transactions 按国家/平台/渠道/数据类型做 LIST 分区，日期不是分区键，
+因此按“叶子分区 × 自然年”的日期区间归档：每个区间导出为一个文件并登记到 manifest.json，
+随后在同一事务中删除这些行。报表（report_engine）与导出（exporter）在日期范围涉及归档时自动读取归档文件
+汇总表不受影响，仍包含已归档的数据
+
+用法：
+    python partition_archive.py --dry-run                 # 按 config/archive.yaml 的 keep_months 计算截止日期
+    python partition_archive.py --before 2023-01-01 --country US
+    python partition_archive.py --list
+"""
+import os
+import hashlib
+import logging
+import argparse
+from datetime import date, datetime
+from typing import Dict, List, Optional
+from psycopg2 import sql
+from database import Database
+from database_manager import DatabaseManager
+from exporter import EXPORT_COLUMNS, copy_to_parquet
+from archive_store import ArchiveStore, load_archive_config
+from ingest import normalize_key
+from report_engine import ReportEngine, PARTITION_LEVELS
+
+logger = logging.getLogger("PartitionArchive")
+
+
+def default_cutoff(keep_months: int, today: Optional[date] = None) -> date:
+    """保留最近 keep_months 个完整月份之外的数据：返回该范围之前的月初"""
+    today = today or date.today()
+    months = today.year * 12 + today.month - 1 - keep_months
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def _range_filter(date_from: date, date_to: date, filters: Dict[str, List[str]]) -> sql.Composed:
+    """归档区间 [date_from, date_to) 与分区键筛选（DEFAULT 分区中可能混有其他取值）"""
+    conditions = [
+        sql.SQL("transaction_date >= {}").format(sql.Literal(date_from)),
+        sql.SQL("transaction_date < {}").format(sql.Literal(date_to)),
+    ]
+    for column, values in filters.items():
+        conditions.append(sql.SQL("{} = ANY({})").format(sql.Identifier(column), sql.Literal(values)))
+    return sql.SQL(" AND ").join(conditions)
+
+
+class PartitionArchiver:
+    def __init__(self, store: Optional[ArchiveStore] = None, config: Optional[dict] = None,
+                 user: str = "SYSTEM"):
+        self.config = config if config is not None else load_archive_config()
+        self.store = store or ArchiveStore(self.config.get("directory"))
+        self.compression = self.config.get("compression", "zstd")
+        self.user = user
+        self.db = Database()
+
+    def plan(self, before: date, filters: Dict[str, List[str]]) -> List[dict]:
+        """
+        列出待归档的区间：每个叶子分区中早于 before 的数据按自然年拆分
+
+        :return: [{"partition", "bounds", "date_from", "date_to", "rows"}]
+        """
+        if before.day != 1:
+            # 月汇总表按月对齐，截止日期必须是月初
+            raise ValueError(f"截止日期必须是某月 1 日: {before}")
+        tasks = []
+        for partition, bounds in ReportEngine(self.db).leaf_partition_bounds(filters).items():
+            where = _range_filter(date(1, 1, 1), before, filters)
+            years = self.db.execute(
+                sql.SQL("""
+                    SELECT date_part('year', transaction_date)::int, count(*)
+                    FROM {partition} WHERE {where}
+                    GROUP BY 1 ORDER BY 1
+                """).format(partition=sql.Identifier(partition), where=where),
+                user=self.user, action="ARCHIVE_PLAN", partition=partition
+            )
+            for year, rows in years:
+                tasks.append({
+                    "partition": partition,
+                    "bounds": bounds,
+                    "date_from": date(year, 1, 1),
+                    "date_to": min(date(year + 1, 1, 1), before),
+                    "rows": rows
+                })
+        return tasks
+
+    def archive(self, task: dict, filters: Dict[str, List[str]]) -> Optional[dict]:
+        """
+        归档一个区间：锁定分区（阻止写入，允许读取）→ 导出 Parquet 并核对行数 →
+        登记 manifest → 保留行指纹 → 删除并核对行数 → 提交；任何一步失败都回滚并撤销文件与登记
+
+        :return: manifest 条目；区间内已没有数据时返回 None
+        """
+        partition = task["partition"]
+        date_from, date_to = task["date_from"], task["date_to"]
+        where = _range_filter(date_from, date_to, filters)
+        stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        relative = f"{partition}/{date_from.isoformat()}_{date_to.isoformat()}_{stamp}.parquet"
+        path = self.store.directory / relative
+        tmp_path = f"{path}.part"
+        registered = False
+
+        with DatabaseManager() as manager:
+            try:
+                # SHARE 锁：上传等写操作等待归档完成，导出连接的读取不受影响
+                manager.cur.execute(sql.SQL("LOCK TABLE {} IN SHARE MODE").format(sql.Identifier(partition)))
+                manager.cur.execute(
+                    sql.SQL("SELECT count(*), COALESCE(sum(amount), 0) FROM {} WHERE {}").format(
+                        sql.Identifier(partition), where)
+                )
+                rows, amount_total = manager.cur.fetchone()
+                if not rows:
+                    manager.conn.rollback()
+                    return None
+
+                path.parent.mkdir(parents=True, exist_ok=True)
+                query = sql.SQL(
+                    "COPY (SELECT {columns} FROM {partition} WHERE {where} ORDER BY transaction_date) "
+                    "TO STDOUT WITH (FORMAT csv, HEADER true)"
+                ).format(
+                    columns=sql.SQL(", ").join(map(sql.Identifier, EXPORT_COLUMNS)),
+                    partition=sql.Identifier(partition),
+                    where=where
+                )
+                exported, _ = copy_to_parquet(
+                    self.db, query, tmp_path, None, self.user,
+                    {"partition": partition, "archive_path": relative},
+                    compression=self.compression
+                )
+                written = self._parquet_rows(tmp_path)
+                if exported != rows or written != rows:
+                    raise RuntimeError(f"{partition} 归档行数不符: 数据库 {rows}，导出 {exported}，文件 {written}")
+                with open(tmp_path, "rb") as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+
+                entry = {
+                    "partition": partition,
+                    "bounds": task["bounds"],
+                    "date_from": date_from.isoformat(),
+                    "date_to": date_to.isoformat(),
+                    "rows": rows,
+                    "amount_total": str(amount_total),
+                    "file": relative,
+                    "sha256": self._sha256(path),
+                    "compression": self.compression,
+                    "archived_at": datetime.now().isoformat(timespec="seconds"),
+                    "archived_by": self.user
+                }
+                # 先登记再删除：提交失败时撤销登记，数据始终只在一处可见
+                self.store.add_entry(entry)
+                registered = True
+                # 保留指纹：之后重新上传覆盖该区间的报表时，这些行不会被再次导入
+                manager.cur.execute(sql.SQL("""
+                    INSERT INTO archived_fingerprints
+                    (country_code, platform, channel, data_type, row_fingerprint)
+                    SELECT country_code, platform, channel, data_type, row_fingerprint
+                    FROM {} WHERE {} AND row_fingerprint IS NOT NULL
+                    ON CONFLICT DO NOTHING
+                """).format(sql.Identifier(partition), where))
+                manager.cur.execute(sql.SQL("DELETE FROM {} WHERE {}").format(sql.Identifier(partition), where))
+                if manager.cur.rowcount != rows:
+                    raise RuntimeError(f"{partition} 删除行数不符: 应为 {rows}，实际 {manager.cur.rowcount}")
+                manager.conn.commit()
+            except BaseException:
+                manager.conn.rollback()
+                if registered:
+                    self.store.remove_entry(relative)
+                for leftover in (tmp_path, str(path)):
+                    if os.path.exists(leftover):
+                        os.remove(leftover)
+                raise
+        logger.info(f"Archived {rows} rows of {partition} [{date_from}, {date_to}) to {relative}")
+        return entry
+
+    def vacuum(self, partitions) -> None:
+        """回收删除后的空间并更新统计信息（VACUUM 不能在事务中执行）"""
+        with DatabaseManager() as manager:
+            manager.conn.autocommit = True
+            for partition in partitions:
+                manager.cur.execute(sql.SQL("VACUUM (ANALYZE) {}").format(sql.Identifier(partition)))
+
+    @staticmethod
+    def _parquet_rows(path: str) -> int:
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+
+    @staticmethod
+    def _sha256(path) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="归档早于截止日期的交易（Parquet）")
+    parser.add_argument("--before", type=date.fromisoformat,
+                        help="截止日期 YYYY-MM-01（不含），默认按 keep_months 计算")
+    parser.add_argument("--country")
+    parser.add_argument("--platform")
+    parser.add_argument("--channel")
+    parser.add_argument("--data-type", dest="data_type")
+    parser.add_argument("--dry-run", action="store_true", help="只列出待归档的区间")
+    parser.add_argument("--no-vacuum", action="store_true", help="归档后不执行 VACUUM")
+    parser.add_argument("--list", action="store_true", help="列出已归档的文件")
+    parser.add_argument("--user", default="CLI")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    archiver = PartitionArchiver(user=args.user)
+    if args.list:
+        for entry in archiver.store.entries:
+            print(f"{entry['partition']:<60} {entry['date_from']} → {entry['date_to']}"
+                  f" {entry['rows']:>10,} 行  {entry['file']}")
+        return
+
+    before = args.before or default_cutoff(int(archiver.config.get("keep_months", 24)))
+    filters = {
+        column: [normalize_key(value)]
+        for column, value in zip(PARTITION_LEVELS, (args.country, args.platform, args.channel, args.data_type))
+        if value
+    }
+    tasks = archiver.plan(before, filters)
+    total = sum(task["rows"] for task in tasks)
+    print(f"截止 {before}：{len(tasks)} 个区间，共 {total:,} 行")
+    for task in tasks:
+        print(f"  {task['partition']:<60} {task['date_from']} → {task['date_to']} {task['rows']:>10,} 行")
+    if args.dry_run or not tasks:
+        return
+
+    archived = set()
+    for task in tasks:
+        if archiver.archive(task, filters):
+            archived.add(task["partition"])
+    if archived and not args.no_vacuum:
+        archiver.vacuum(sorted(archived))
+    print(f"✅ 已归档到 {archiver.store.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# profiling.py
+"""
+上传路径的可选性能剖析（cProfile + tracemalloc）
+
+环境变量：
+    FA_PROFILE=1        剖析每次上传
+    FA_PROFILE=0.05     按 5% 的比例抽样上传（生产环境常开时使用）
+    FA_PROFILE_MEMORY=1 同时记录 tracemalloc 内存分配（开销较大）
+界面上的 Profile 开关只覆盖上传会话的比例；上传之外的单次数据库调用（@profiled）
+只在设置了 FA_PROFILE 时按其比例抽样
+
+每次被抽中的上传在 logs/profiles/<时间>_<文件名>/ 下生成：
+    <阶段>.prof  pstats 原始数据（可用 snakeviz / pstats 打开）
+    <阶段>.txt   累计耗时排名与内存分配排名
+"""
+import io
+import os
+import re
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+import functools
+import tracemalloc
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Optional
+from config import LOG_DIR
+
+logger = logging.getLogger("Profiling")
+
+PROFILE_DIR = LOG_DIR / "profiles"
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+# 只按分配位置（文件:行）统计，每次分配只记录一帧以降低开销
+TRACEMALLOC_FRAMES = 1
+
+
+def _env_rate() -> float:
+    value = os.getenv("FA_PROFILE", "").strip().lower()
+    if value in ("", "0", "false", "off"):
+        return 0.0
+    if value in ("1", "true", "on"):
+        return 1.0
+    try:
+        return min(max(float(value), 0.0), 1.0)
+    except ValueError:
+        logger.warning(f"Ignoring invalid FA_PROFILE={value!r}")
+        return 0.0
+
+
+class ProfileSettings:
+    """
+    进程内的剖析设置
+    rate/memory 作用于上传会话（界面开关可覆盖）；env_rate/env_memory 始终取自环境变量
+    """
+
+    def __init__(self):
+        self.env_rate = _env_rate()
+        self.env_memory = os.getenv("FA_PROFILE_MEMORY", "").strip().lower() in ("1", "true", "on")
+        self.rate = self.env_rate
+        self.memory = self.env_memory
+
+    def force(self, enabled: bool) -> None:
+        """界面开关：开启时剖析每次上传（含内存），关闭时恢复环境变量的设置"""
+        self.rate = 1.0 if enabled else self.env_rate
+        self.memory = True if enabled else self.env_memory
+
+
+SETTINGS = ProfileSettings()
+# cProfile（3.12 起基于 sys.monitoring）与 tracemalloc 都是进程级的，同一时刻只运行一个会话
+_session_lock = threading.Lock()
+
+
+def sample(name: str, rate: Optional[float] = None) -> Optional[str]:
+    """
+    按抽样比例决定是否剖析本次上传（或单次数据库调用）
+    :param rate: 抽样比例，默认为上传会话的比例 SETTINGS.rate
+    :return: 报告目录；未抽中时返回 None
+    """
+    rate = SETTINGS.rate if rate is None else rate
+    if rate <= 0 or random.random() >= rate:
+        return None
+    safe_name = re.sub(r"[^\w.-]+", "_", os.path.basename(name))[:80]
+    # 随机后缀区分同一秒内的同名上传
+    return str(PROFILE_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}_{random.getrandbits(16):04x}_{safe_name}")
+
+
+@contextmanager
+def profile(label: str, directory: Optional[str], memory: Optional[bool] = None):
+    """
+    在 directory 下记录此范围内的 cProfile 与（可选）tracemalloc 报告
+    directory 为 None、或已有其他会话在运行时不做任何事
+    """
+    if directory is None or not _session_lock.acquire(blocking=False):
+        yield
+        return
+    memory = SETTINGS.memory if memory is None else memory
+    started_tracing = False
+    before = None
+    profiler = cProfile.Profile()
+    try:
+        if memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                started_tracing = True
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            after = tracemalloc.take_snapshot() if memory else None
+            peak = tracemalloc.get_traced_memory()[1] if memory else None
+            try:
+                _write_report(Path(directory), label, profiler, elapsed, before, after, peak)
+            except Exception:
+                # 剖析失败不能影响上传本身
+                logger.exception(f"Failed to write profile report for {label}")
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _session_lock.release()
+
+
+def _write_report(directory: Path, label: str, profiler: cProfile.Profile, elapsed: float,
+                  before, after, peak: Optional[int]) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(str(directory / f"{label}.prof"))
+
+    out = io.StringIO()
+    out.write(f"{label}: {elapsed:.3f}s wall, pid {os.getpid()}\n\n")
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+    if after is not None:
+        out.write(f"\nPeak traced memory: {peak / 1024 / 1024:.1f} MiB\n")
+        out.write(f"Top {TOP_ALLOCATIONS} allocation sites (growth during {label}):\n")
+        for stat in after.compare_to(before, "lineno")[:TOP_ALLOCATIONS]:
+            out.write(f"  {stat}\n")
+    (directory / f"{label}.txt").write_text(out.getvalue(), encoding="utf-8")
+    logger.info(f"Profile for {label} written to {directory}")
+
+
+def profiled(label: str):
+    """
+    装饰数据库调用：不在上传会话内时按 FA_PROFILE 的比例单独剖析
+    （上传会话内的调用已包含在该会话的报告中；界面开关不影响这里）
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if SETTINGS.env_rate <= 0 or _session_lock.locked():
+                return func(*args, **kwargs)
+            with profile(label, sample(label, SETTINGS.env_rate), memory=SETTINGS.env_memory):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
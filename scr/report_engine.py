@@ -0,0 +1,298 @@
+# report_engine.py
+import json
+import logging
+import argparse
+from decimal import Decimal
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from psycopg2 import sql
+from config import DatabaseConfig
+from database import Database
+from database_manager import AMOUNT_TYPE_EXPRESSION, LEAF_PARTITIONS_SQL
+from archive_store import ArchiveStore
+from local_replica import LocalReplica
+
+logger = logging.getLogger("ReportEngine")
+
+# 分区层级（自上而下）与 transactions 中对应的列
+PARTITION_LEVELS = ("country_code", "platform", "channel", "data_type")
+# 可用的分组维度
+GROUP_EXPRESSIONS = {
+    "country_code": "s.country_code",
+    "platform": "s.platform",
+    "channel": "s.channel",
+    "data_type": "s.data_type",
+    "month": "date_trunc('month', s.transaction_date)::date",
+    "day": "s.transaction_date",
+    "amount_type": AMOUNT_TYPE_EXPRESSION,
+}
+
+
+
+def _amount_type(raw_data: Optional[str]) -> str:
+    """与 AMOUNT_TYPE_EXPRESSION 相同：按顺序取第一个非空的键"""
+    data = json.loads(raw_data) if raw_data else {}
+    for key in ("amount-type", "amount_type"):
+        if data.get(key) is not None:
+            return str(data[key])
+    return ""
+
+
+# 归档数据（pandas.DataFrame）上与 GROUP_EXPRESSIONS 对应的维度
+ARCHIVE_DIMENSIONS = {
+    "country_code": lambda frame: frame["country_code"],
+    "platform": lambda frame: frame["platform"],
+    "channel": lambda frame: frame["channel"],
+    "data_type": lambda frame: frame["data_type"],
+    "month": lambda frame: frame["transaction_date"].map(lambda d: d.replace(day=1)),
+    "day": lambda frame: frame["transaction_date"],
+    "amount_type": lambda frame: frame["raw_data"].map(_amount_type),
+}
+
+
+def _normalize(value: str) -> str:
+    """与分区取值一致：空格转下划线并转小写"""
+    return (value or "").strip().replace(" ", "_").lower()
+
+
+def _normalize_filters(filters: Dict[str, Iterable[str]]) -> Dict[str, List[str]]:
+    """{"country_code": ["US", "CA"], ...} → 小写取值列表；空条件被去掉"""
+    normalized = {}
+    for column in PARTITION_LEVELS:
+        values = filters.get(column)
+        if isinstance(values, str):
+            values = [values]
+        values = [_normalize(v) for v in values or () if v]
+        if values:
+            normalized[column] = values
+    return normalized
+
+
+def _where(filters: Dict[str, List[str]], date_from: Optional[date], date_to: Optional[date]):
+    conditions, params = [], []
+    for column, values in filters.items():
+        conditions.append(sql.SQL("{} = ANY(%s)").format(sql.Identifier("s", column)))
+        params.append(values)
+    if date_from:
+        conditions.append(sql.SQL("s.transaction_date >= %s"))
+        params.append(date_from)
+    if date_to:
+        conditions.append(sql.SQL("s.transaction_date <= %s"))
+        params.append(date_to)
+    if not conditions:
+        return sql.SQL(""), params
+    return sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conditions), params
+
+
+class ReportEngine:
+    """
+    交易汇总查询
+    mode="partitions"：从系统目录枚举相关叶子分区，各分区在连接池上并发聚合，客户端合并
+    mode="pushdown"：单条查询交给 PostgreSQL 并行执行（parallel query）
+    mode="local"：在本地副本上聚合，不访问数据库（见 local_replica，结果截至最近一次同步）
+    日期范围涉及已归档的数据时，归档文件的聚合结果并入同一结果（见 archive_store）
+    """
+
+    # 按分区并发聚合时给其他调用（如界面上的查询）保留的连接数
+    POOL_HEADROOM = 1
+
+    def __init__(self, db: Optional[Database] = None, workers: Optional[int] = None,
+                 archive: Optional[ArchiveStore] = None, replica: Optional[LocalReplica] = None):
+        """
+        :param workers: 并发度；按分区聚合时不超过连接池大小减去 POOL_HEADROOM，
+                        pushdown 模式下为 PostgreSQL 的并行 worker 数
+        """
+        self.db = db or Database()
+        self.workers = workers or self.connection_limit()
+        self.archive = archive or ArchiveStore()
+        self._replica = replica
+
+    @property
+    def replica(self) -> LocalReplica:
+        if self._replica is None:
+            self._replica = LocalReplica(archive=self.archive)
+        return self._replica
+
+    def leaf_partitions(self, filters: Optional[Dict[str, Iterable[str]]] = None) -> List[str]:
+        """
+        与筛选条件相关的叶子分区
+        DEFAULT 分区可能包含任意未列出的取值，始终保留，由 WHERE 条件过滤
+        """
+        return list(self.leaf_partition_bounds(filters))
+
+    def leaf_partition_bounds(self, filters: Optional[Dict[str, Iterable[str]]] = None
+                              ) -> Dict[str, Dict[str, Optional[str]]]:
+        """与 leaf_partitions 相同，并给出每个分区在各层的取值（DEFAULT 或未细分的层为 None）"""
+        filters = _normalize_filters(filters or {})
+        partitions = {}
+        for name, bounds, _ in self.db.execute(LEAF_PARTITIONS_SQL, action="LIST_PARTITIONS"):
+            if all(
+                bound is None or column not in filters or bound in filters[column]
+                for column, bound in zip(PARTITION_LEVELS, bounds)
+            ):
+                partitions[name] = {column: bounds[i] if i < len(bounds) else None
+                                    for i, column in enumerate(PARTITION_LEVELS)}
+        return partitions
+
+    def totals(
+        self,
+        group_by: Sequence[str] = ("country_code", "platform", "channel", "month"),
+        filters: Optional[Dict[str, Iterable[str]]] = None,
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        mode: str = "partitions",
+        user: str = "SYSTEM"
+    ) -> List[dict]:
+        """
+        按 group_by 汇总行数与金额
+
+        :param group_by: GROUP_EXPRESSIONS 中的维度
+        :param filters: {"country_code": ["US", "CA"], "platform": "Amazon", ...}
+        :return: [{维度..., "row_count", "amount_total"}]，按维度排序
+        """
+        unknown = [g for g in group_by if g not in GROUP_EXPRESSIONS]
+        if unknown:
+            raise ValueError(f"不支持的分组维度: {', '.join(unknown)}")
+        normalized = _normalize_filters(filters or {})
+        if mode == "pushdown":
+            rows = self._pushdown(group_by, normalized, date_from, date_to, user)
+        elif mode == "partitions":
+            rows = self._per_partition(group_by, normalized, date_from, date_to, user)
+        elif mode == "local":
+            self.replica.require_complete()
+            rows = {}
+            self._merge(self._aggregate_tables(
+                self.replica.iter_tables(normalized, date_from, date_to, columns=self._table_columns(group_by)),
+                group_by
+            ), rows)
+        else:
+            raise ValueError(f"未知的执行模式: {mode}")
+        self._merge(self._aggregate_tables(
+            self.archive.iter_tables(normalized, date_from, date_to, columns=self._table_columns(group_by)),
+            group_by
+        ), rows)
+        # 没有任何分组维度时保证返回一行总计
+        if not group_by and not rows:
+            rows[()] = (0, Decimal(0))
+        return [
+            {**dict(zip(group_by, key)), "row_count": count, "amount_total": total}
+            for key, (count, total) in sorted(rows.items(), key=lambda item: tuple(
+                (v is None, v) for v in item[0]))
+        ]
+
+    def _aggregate_query(self, table: str, group_by: Sequence[str], where: sql.Composable):
+        dimensions = [sql.SQL(GROUP_EXPRESSIONS[g]) for g in group_by]
+        return sql.SQL("""
+            SELECT {dimensions}count(*), COALESCE(sum(s.amount), 0)
+            FROM {table} s{where}
+            {group}
+        """).format(
+            dimensions=sql.SQL("").join(d + sql.SQL(", ") for d in dimensions),
+            table=sql.Identifier(table),
+            where=where,
+            group=sql.SQL("GROUP BY {}").format(
+                sql.SQL(", ").join(sql.SQL(str(i + 1)) for i in range(len(dimensions)))
+            ) if dimensions else sql.SQL("")
+        )
+
+    @staticmethod
+    def _merge(results: Iterable[List[tuple]], merged: Dict[tuple, Tuple[int, Decimal]]) -> None:
+        for rows in results:
+            for row in rows:
+                key, count, total = tuple(row[:-2]), row[-2], row[-1]
+                previous_count, previous_total = merged.get(key, (0, Decimal(0)))
+                merged[key] = (previous_count + count, previous_total + total)
+
+    @staticmethod
+    def _table_columns(group_by: Sequence[str]) -> List[str]:
+        """在 Parquet（归档、本地副本）上聚合 group_by 所需的列"""
+        columns = {"amount", "transaction_date"}
+        columns.update("raw_data" if g == "amount_type" else g for g in group_by if g in PARTITION_LEVELS
+                       or g == "amount_type")
+        return sorted(columns)
+
+    @staticmethod
+    def _aggregate_tables(tables, group_by: Sequence[str]) -> Iterable[List[tuple]]:
+        """逐个 pyarrow.Table 聚合，输出与 _aggregate_query 相同形状的行"""
+        for table in tables:
+            if not table.num_rows:
+                continue
+            frame = table.to_pandas()
+            frame["amount"] = frame["amount"].fillna(Decimal(0))
+            if not group_by:
+                yield [(len(frame), sum(frame["amount"], Decimal(0)))]
+                continue
+            keys = [ARCHIVE_DIMENSIONS[g](frame) for g in group_by]
+            stats = frame["amount"].groupby(keys, dropna=False, sort=False).agg(["size", "sum"])
+            yield [
+                (key if isinstance(key, tuple) else (key,)) + (int(count), Decimal(total))
+                for key, count, total in zip(stats.index, stats["size"], stats["sum"])
+            ]
+
+    @classmethod
+    def connection_limit(cls) -> int:
+        """按分区聚合时最多占用的连接数"""
+        return max(DatabaseConfig.POOL_MAX - cls.POOL_HEADROOM, 1)
+
+    def _per_partition(self, group_by, filters, date_from, date_to, user):
+        partitions = self.leaf_partitions(filters)
+        where, params = _where(filters, date_from, date_to)
+        connections = min(self.workers, self.connection_limit())
+        if connections < self.workers:
+            logger.info(f"Limiting {self.workers} workers to {connections} connections "
+                        f"(pool size {DatabaseConfig.POOL_MAX})")
+        logger.info(f"Aggregating {len(partitions)} partitions on {connections} connections")
+
+        def run(partition: str) -> List[tuple]:
+            return self.db.execute(
+                self._aggregate_query(partition, group_by, where), params,
+                user=user, action="REPORT_PARTITION", partition=partition
+            )
+
+        merged: Dict[tuple, Tuple[int, Decimal]] = {}
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            self._merge(executor.map(run, partitions), merged)
+        return merged
+
+    def _pushdown(self, group_by, filters, date_from, date_to, user):
+        where, params = _where(filters, date_from, date_to)
+        query = sql.SQL("SET LOCAL max_parallel_workers_per_gather = {}; ").format(
+            sql.Literal(self.workers)
+        ) + self._aggregate_query("transactions", group_by, where)
+        merged: Dict[tuple, Tuple[int, Decimal]] = {}
+        self._merge([self.db.execute(query, params, user=user, action="REPORT_PUSHDOWN")], merged)
+        return merged
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="交易汇总（分区并行）")
+    parser.add_argument("--country", action="append", default=[], help="可重复，如 --country US --country CA")
+    parser.add_argument("--platform", action="append", default=[])
+    parser.add_argument("--channel", action="append", default=[])
+    parser.add_argument("--data-type", dest="data_type", action="append", default=[])
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat)
+    parser.add_argument("--group-by", default="country_code,platform,channel,month",
+                        help=f"逗号分隔：{', '.join(GROUP_EXPRESSIONS)}")
+    parser.add_argument("--mode", choices=("partitions", "pushdown", "local"), default="partitions",
+                        help="local：使用本地副本（先运行 local_replica.py sync）")
+    parser.add_argument("--workers", type=int,
+                        help="并发度；按分区聚合时不超过连接池大小减一")
+    args = parser.parse_args()
+
+    engine = ReportEngine(workers=args.workers)
+    group_by = [g.strip() for g in args.group_by.split(",") if g.strip()]
+    rows = engine.totals(
+        group_by,
+        filters={"country_code": args.country, "platform": args.platform,
+                 "channel": args.channel, "data_type": args.data_type},
+        date_from=args.date_from, date_to=args.date_to, mode=args.mode, user="CLI"
+    )
+    for row in rows:
+        print("\t".join(str(row[g]) for g in group_by),
+              row["row_count"], row["amount_total"], sep="\t")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# text_rows.py
+"""
+TXT/CSV 的逐行解析，顺序解析（parsers）与按字节段并行解析（parallel_parser）共用
+"""
+import csv
+import os
+from typing import Iterable, Iterator, List, Optional
+from batch import RowBatch
+from converters import RowInterner
+
+# 可按字节偏移追加导入的纯文本格式
+APPENDABLE_EXTENSIONS = ('.txt', '.csv')
+# 旧版 '|' 分隔无表头 TXT 的固定列
+LEGACY_TXT_HEADER = ("transaction_date", "amount", "description")
+# 每个批次的行数
+DEFAULT_BATCH_SIZE = 10000
+
+
+def text_format(file_path: str, spec: Optional[dict] = None) -> Optional[dict]:
+    """
+    带表头的分隔文本格式参数；旧版 '|' 分隔的无表头 TXT 返回 None
+
+    :return: {"delimiter", "encoding", "require_amount"}
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if spec and spec.get("delimiter") and ext == f".{spec.get('file_type', '')}":
+        return {
+            "delimiter": spec["delimiter"],
+            "encoding": spec.get("encoding", "utf-8"),
+            "require_amount": False  # 必填列由校验引擎按平台配置检查
+        }
+    if ext == '.csv':
+        return {"delimiter": ",", "encoding": "utf-8", "require_amount": True}
+    return None
+
+
+def read_header(file_path: str, delimiter: str = ',', encoding: str = 'utf-8') -> List[str]:
+    with open(file_path, 'r', encoding=encoding, newline='') as f:
+        return next(csv.reader(f, delimiter=delimiter), [])
+
+
+def count_lines(file_path: str, end: int, chunk_size: int = 64 * 1024 * 1024) -> int:
+    """文件前 end 个字节中的换行数（即偏移 end 之前的物理行数）"""
+    total, position = 0, 0
+    with open(file_path, 'rb') as f:
+        while position < end:
+            chunk = f.read(min(chunk_size, end - position))
+            if not chunk:
+                break
+            total += chunk.count(b"\n")
+            position += len(chunk)
+    return total
+
+
+def iter_rows(reader: Iterable[list], header: List[str],
+              batch_size: int = DEFAULT_BATCH_SIZE,
+              line_offset: Optional[int] = None,
+              interner: Optional[RowInterner] = None) -> Iterator[RowBatch]:
+    """
+    csv.reader 的行 → 若干 RowBatch
+    与 csv.DictReader 一致：跳过空行，缺少的字段补 None
+
+    :param line_offset: reader 起点之前的物理行数；给定时（reader 须为 csv.reader）
+                        记录每条记录在源文件中的起始行号，含换行的引号字段按首行计
+    :param interner: 在构造行元组之前驻留低基数列
+    """
+    width = len(header)
+    padding = (None,) * width
+    numbered = line_offset is not None
+    previous = reader.line_num if numbered else 0
+    intern = interner.bind(header) if interner is not None else None
+    rows, line_nos = [], []
+    for fields in reader:
+        start, previous = previous, reader.line_num if numbered else 0
+        if not fields:
+            continue
+        if intern is not None:
+            intern(fields)
+        row = tuple(fields)
+        if len(row) < width:
+            row += padding[len(row):]
+        rows.append(row)
+        if numbered:
+            line_nos.append(line_offset + start + 1)
+        if len(rows) >= batch_size:
+            batch = RowBatch(header, rows, line_nos if numbered else None)
+            if interner is not None:
+                intern = interner.resolve(batch)
+            yield batch
+            rows, line_nos = [], []
+    if rows:
+        batch = RowBatch(header, rows, line_nos if numbered else None)
+        if interner is not None:
+            interner.resolve(batch)
+        yield batch
+
+
+def iter_txt_lines(lines: Iterable[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                   line_offset: int = 0,
+                   interner: Optional[RowInterner] = None) -> Iterator[RowBatch]:
+    """
+    旧版 '|' 分隔 TXT 的行 → 若干 RowBatch，字段数不为 3 的行被忽略
+
+    :param line_offset: lines 起点之前的物理行数，用于计算源文件行号
+    :param interner: 在构造行元组之前驻留低基数列
+    """
+    intern = interner.bind(LEGACY_TXT_HEADER) if interner is not None else None
+    data, line_nos = [], []
+    for line_no, line in enumerate(lines, line_offset + 1):
+        parts = line.strip().split('|')
+        if len(parts) == 3:
+            if intern is not None:
+                intern(parts)
+            data.append(tuple(parts))
+            line_nos.append(line_no)
+            if len(data) >= batch_size:
+                batch = RowBatch(LEGACY_TXT_HEADER, data, line_nos)
+                if interner is not None:
+                    intern = interner.resolve(batch)
+                yield batch
+                data, line_nos = [], []
+    if data:
+        batch = RowBatch(LEGACY_TXT_HEADER, data, line_nos)
+        if interner is not None:
+            interner.resolve(batch)
+        yield batch
@@ -0,0 +1,152 @@
+# validation.py
+import re
+import json
+import logging
+import numpy as np
+import pandas as pd
+from typing import Optional
+from amounts import parse_cents_array
+from converters import date_converter, DEFAULT_DATE_FORMAT
+
+logger = logging.getLogger("Validation")
+
+TYPE_PATTERN = re.compile(r"^\s*(\w+)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?\s*$")
+
+
+class ValidationError(ValueError):
+    """文件未通过加载前校验"""
+
+    def __init__(self, message: str, result: Optional[dict] = None):
+        super().__init__(message)
+        self.result = result or {}
+
+
+def _parse_type(type_spec: str):
+    """解析 "NUMERIC(12,2)" → ("NUMERIC", 12, 2)"""
+    match = TYPE_PATTERN.match(type_spec or "")
+    if not match:
+        return (type_spec or "").upper(), None, None
+    name, first, second = match.groups()
+    return (
+        name.upper(),
+        int(first) if first else None,
+        int(second) if second else None
+    )
+
+
+def _mark(reasons: pd.Series, mask: pd.Series, column: str, message: str, summary: dict) -> None:
+    """为不合格的行追加原因，并累计到汇总中"""
+    count = int(mask.sum())
+    if not count:
+        return
+    reasons[mask] = reasons[mask] + f"{column}: {message}; "
+    summary.setdefault(column, {})[message] = count
+
+
+def _parses_as_date(to_date, value) -> bool:
+    try:
+        to_date(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _check_column(values: pd.Series, text: pd.Series, blank: pd.Series, column: dict):
+    """
+    按列配置检查一整列，返回 [(mask, message)]
+    空值只由 required 判断，类型检查只针对非空值
+    values 为原始取值（Excel 中可能是 datetime 等），text 为去空白后的文本
+    """
+    checks = []
+    if column.get("required"):
+        checks.append((blank, "required"))
+
+    type_name, precision, scale = _parse_type(column.get("type", ""))
+    present = ~blank
+    if type_name in ("VARCHAR", "CHAR") and precision:
+        checks.append((present & (text.str.len() > precision), f"longer than {precision}"))
+    elif type_name in ("NUMERIC", "DECIMAL"):
+        # 与转换阶段使用同一个定点解析器，千分位、括号负数、货币符号均视为合法
+        units, invalid = parse_cents_array(text, scale or 0)
+        invalid = pd.Series(invalid, index=text.index)
+        checks.append((present & invalid, "not a number"))
+        if precision:
+            out_of_range = pd.Series(np.abs(units) >= 10 ** precision, index=text.index)
+            checks.append((present & ~invalid & out_of_range, f"out of range for {column['type']}"))
+    elif type_name in ("INTEGER", "INT", "BIGINT", "SMALLINT"):
+        numbers = pd.to_numeric(text, errors="coerce")
+        checks.append((present & (numbers.isna() | (numbers % 1 != 0)), "not an integer"))
+    elif type_name in ("DATE", "TIMESTAMP"):
+        # 与转换阶段使用同一个（带缓存的）日期转换器，校验通过的行转换时不会再报日期错误；
+        # 校验原始取值，Excel 的日期单元格由转换器直接接受
+        date_format = column.get("format", DEFAULT_DATE_FORMAT)
+        to_date = date_converter(date_format)
+        invalid = pd.Series(False, index=values.index)
+        invalid[present] = ~values[present].map(lambda value: _parses_as_date(to_date, value)).astype(bool)
+        checks.append((present & invalid, f"not a date ({date_format})"))
+    return checks
+
+
+def validate_rows(rows, spec: dict, max_reject_ratio: float = 0.0) -> dict:
+    """
+    按平台配置的列定义对整批数据做列式校验（加载前，纯本地）
+
+    :param rows: 解析得到的 RowBatch
+    :param spec: 平台配置（config/<platform>.yaml）
+    :param max_reject_ratio: 允许剔除的最大比例，超过则整个文件失败
+    :return: {"rows": 合格行（RowBatch）, "rejects": [{"row_no"（源文件行号）, "reason", "raw_data"}],
+              "summary": {列名: {原因: 行数}}, "checked": 总行数}
+    :raises ValidationError: 缺少必填列或坏行比例超限
+    """
+    columns = [c for c in spec.get("columns", []) if c.get("name")]
+    result = {"rows": rows, "rejects": [], "summary": {}, "checked": len(rows)}
+    if not rows or not columns:
+        return result
+
+    missing = [c["name"] for c in columns if c.get("required") and rows.index(c["name"]) is None]
+    if missing:
+        raise ValidationError(f"缺少必填列: {', '.join(missing)}", result)
+    # 只把需要校验的列取成 DataFrame
+    df = pd.DataFrame({
+        c["name"]: pd.Series(rows.column(c["name"]), dtype="object")
+        for c in columns if rows.index(c["name"]) is not None
+    }, index=pd.RangeIndex(len(rows)))
+
+    reasons = pd.Series("", index=df.index, dtype="object")
+    for column in columns:
+        if column["name"] not in df.columns:
+            continue
+        values = df[column["name"]]
+        text = values.astype("string").str.strip()
+        blank = (text.isna() | (text == "")).fillna(True)
+        for mask, message in _check_column(values, text, blank, column):
+            _mark(reasons, mask.fillna(False).astype(bool), column["name"], message, result["summary"])
+
+    bad = reasons != ""
+    if bad.any():
+        bad_index = bad[bad].index
+        result["rejects"] = [{
+            "row_no": rows.line_no(int(i)),
+            "reason": reasons[i].rstrip("; "),
+            "raw_data": json.dumps(rows.row_dict(int(i)), ensure_ascii=False, default=str)
+        } for i in bad_index]
+        result["rows"] = rows.take(np.flatnonzero(~bad.to_numpy()).tolist())
+
+    rejected = len(result["rejects"])
+    logger.info(f"Validated {len(rows)} rows against {spec.get('name', 'spec')}: "
+                f"{rejected} rejected {result['summary']}")
+    if rejected and rejected > len(rows) * max_reject_ratio:
+        raise ValidationError(
+            f"校验失败: {rejected}/{len(rows)} 行不合格 {format_summary(result['summary'])}",
+            result
+        )
+    return result
+
+
+def format_summary(summary: dict) -> str:
+    """把汇总转为一行可读文本"""
+    return "; ".join(
+        f"{column} {message} ×{count}"
+        for column, messages in summary.items()
+        for message, count in messages.items()
+    )
@@ -0,0 +1,59 @@
+# validation_test.py
+from datetime import date, datetime
+import pytest
+from openpyxl import Workbook
+from batch import RowBatch
+from ingest import load_platform_spec
+from parsers import parse_file
+from validation import validate_rows, ValidationError
+
+SPEC = {"name": "test", "columns": [
+    {"name": "id", "type": "VARCHAR(5)", "required": True},
+    {"name": "amount", "type": "NUMERIC(8,2)"},
+    {"name": "posted-date", "type": "DATE", "format": "%Y-%m-%d"},
+]}
+
+
+def test_rejects_carry_reasons_and_source_lines():
+    rows = RowBatch(["id", "amount", "posted-date"], [
+        ("a", "1,234.50", "2024-01-05"),
+        ("", "(12.00)", "2024-01-06"),
+        ("toolong", "abc", "2024/01/07"),
+        ("b", "99999.99", None),
+    ], [2, 3, 5, 6])
+    result = validate_rows(rows, SPEC, max_reject_ratio=1.0)
+    assert [r["row_no"] for r in result["rejects"]] == [3, 5]
+    assert result["summary"] == {
+        "id": {"required": 1, "longer than 5": 1},
+        "amount": {"not a number": 1},
+        "posted-date": {"not a date (%Y-%m-%d)": 1},
+    }
+    assert result["rows"].rows == [rows.rows[0], rows.rows[3]]
+    assert result["rows"].line_nos == [2, 6]
+
+
+def test_reject_ratio_exceeded():
+    rows = RowBatch(["id", "amount", "posted-date"], [("a", "x", "2024-01-05")])
+    with pytest.raises(ValidationError) as info:
+        validate_rows(rows, SPEC)
+    assert info.value.result["summary"] == {"amount": {"not a number": 1}}
+
+
+def test_excel_date_cells_pass_date_check(tmp_path):
+    """Excel 中的日期单元格读出为 datetime，不能按文本校验格式"""
+    spec = load_platform_spec("Amazon")
+    header = [c["name"] for c in spec["columns"] if c.get("name")]
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(header)
+    for day in (5, 6, 7):
+        values = {"settlement-id": "123", "amount": 10.5, "posted-date": datetime(2024, 1, day)}
+        sheet.append([values.get(name) for name in header])
+    path = tmp_path / "settlement.xlsx"
+    workbook.save(path)
+
+    rows = parse_file(str(path), spec=spec)
+    assert isinstance(rows.column("posted-date")[0], (date, datetime))
+    result = validate_rows(rows, spec)
+    assert result["rejects"] == []
+    assert len(result["rows"]) == 3
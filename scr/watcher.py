@@ -0,0 +1,221 @@
+# watcher.py
+import os
+import re
+import time
+import yaml
+import logging
+import argparse
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+from psycopg2 import InterfaceError, OperationalError
+from psycopg2.pool import PoolError
+from config import USER_ACTION_LOGGER
+from ingest import (ingest_file, calculate_file_hash, DuplicateUploadError, EmptyFileError,
+                    UploadInProgressError, CONFIG_DIR)
+from archives import ARCHIVE_EXTENSIONS
+from parsers import APPENDABLE_EXTENSIONS, EXCEL_EXTENSIONS
+
+logger = logging.getLogger("Watcher")
+
+WATCH_CONFIG_PATH = CONFIG_DIR / "watch.yaml"
+SUPPORTED_EXTENSIONS = APPENDABLE_EXTENSIONS + EXCEL_EXTENSIONS + ARCHIVE_EXTENSIONS
+METADATA_FIELDS = ("country", "platform", "channel", "data_type")
+# 连接断开、数据库切换、连接池等待超时、共享目录暂时不可读：退避后重试，而不是标记为已处理
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolError, OSError)
+
+
+def load_watch_config(path: Path = WATCH_CONFIG_PATH) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return yaml.safe_load(f) or {}
+
+
+class PathRules:
+    """按相对路径推断上传信息（country/platform/channel/data_type）"""
+
+    def __init__(self, rules: List[dict]):
+        self.rules = [(re.compile(r["pattern"]), r) for r in rules]
+
+    def match(self, relative_path: str) -> Optional[dict]:
+        for pattern, rule in self.rules:
+            found = pattern.search(relative_path)
+            if not found:
+                continue
+            groups = found.groupdict()
+            metadata = {
+                field: groups.get(field) or rule.get(field) or ""
+                for field in METADATA_FIELDS
+            }
+            if not all(metadata[f] for f in ("country", "platform", "channel")):
+                continue
+            metadata["country"] = metadata["country"].upper()
+            return metadata
+        return None
+
+
+class FolderWatcher:
+    """
+    轮询目录树，把下载完成的报表交给上传流水线
+    每个文件只导入一次：进程内按路径状态与哈希去重，跨进程/重启依赖上传占用与 upload_history 的哈希查重
+    """
+
+    def __init__(self, config: dict):
+        self.directory = Path(config["directory"])
+        self.poll_seconds = float(config.get("poll_seconds", 30))
+        self.settle_seconds = float(config.get("settle_seconds", 60))
+        self.retry_max_seconds = float(config.get("retry_max_seconds", 1800))
+        self.user = config.get("user", "WATCHER")
+        self.rules = PathRules(config.get("rules", []))
+        self.executor = ThreadPoolExecutor(max_workers=int(config.get("max_workers", 2)))
+        # 路径 → (大小, 修改时间, 首次观察到该状态的时间)
+        self._pending: Dict[Path, Tuple[int, float, float]] = {}
+        # 已处理（成功、重复或失败）的文件状态，状态改变后才会重新处理
+        self._done: Dict[Path, Tuple[int, float]] = {}
+        # 排队或导入中的路径，以及正在导入的文件哈希
+        self._in_flight: Set[Path] = set()
+        self._hashes_in_flight: Set[str] = set()
+        # 暂时性失败的文件：路径 → (连续失败次数, 下次重试的时间)
+        self._retry_at: Dict[Path, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _audit(self, level: int, message: str, action: str, **extra) -> None:
+        USER_ACTION_LOGGER.log(level, message, extra={"user": self.user, "user_action": action, **extra})
+
+    def scan(self) -> List[Path]:
+        """扫描一次目录，返回已稳定、可以导入的文件"""
+        now = time.monotonic()
+        ready = []
+        seen = set()
+        for path in self.directory.rglob("*"):
+            if not path.is_file() or path.suffix.lower() not in SUPPORTED_EXTENSIONS:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # 扫描期间被移走
+            seen.add(path)
+            state = (stat.st_size, stat.st_mtime)
+            with self._lock:
+                # 工作线程会同时更新这些状态
+                if self._done.get(path) == state or path in self._in_flight:
+                    continue
+                retry = self._retry_at.get(path)
+                if retry and now < retry[1]:
+                    continue
+            pending = self._pending.get(path)
+            if pending is None or pending[:2] != state:
+                self._pending[path] = (*state, now)
+            elif now - pending[2] >= self.settle_seconds:
+                ready.append(path)
+        # 已删除的文件不再跟踪
+        for path in list(self._pending):
+            if path not in seen:
+                del self._pending[path]
+        with self._lock:
+            for path in [p for p in self._retry_at if p not in seen]:
+                del self._retry_at[path]
+        return ready
+
+    def submit(self, path: Path) -> None:
+        relative = path.relative_to(self.directory).as_posix()
+        metadata = self.rules.match(relative)
+        state = self._pending.pop(path)[:2]
+        with self._lock:
+            if metadata is None:
+                logger.info(f"No rule matches {relative}, ignoring")
+                self._done[path] = state
+                return
+            self._in_flight.add(path)
+        self.executor.submit(self._ingest, path, state, metadata)
+
+    def _ingest(self, path: Path, state: Tuple[int, float], metadata: dict) -> None:
+        audit = {**metadata, "file_name": path.name}
+        retry = False
+        try:
+            file_hash = calculate_file_hash(str(path))
+            with self._lock:
+                # 同一内容的副本正在导入：它可能失败，下个周期再检查而不是标记为已处理
+                if file_hash in self._hashes_in_flight:
+                    retry = True
+                    logger.info(f"{path.name} has the same content as a file being uploaded, will recheck")
+                    return
+                self._hashes_in_flight.add(file_hash)
+            try:
+                self._audit(logging.INFO, "自动导入启动", "WATCH_UPLOAD_STARTED", **audit)
+                result = ingest_file(str(path), metadata, user=self.user,
+                                     on_log=lambda m: logger.info(f"{path.name}: {m}"))
+            finally:
+                with self._lock:
+                    self._hashes_in_flight.discard(file_hash)
+            self._audit(logging.INFO, "自动导入完成", "WATCH_UPLOAD_DONE", **audit,
+                        inserted=result["inserted"], skipped=result["skipped"],
+                        rejected=result["rejected"], table_name=result["table_name"])
+        except UploadInProgressError as e:
+            # 另一上传者可能失败，下个周期重新检查
+            retry = True
+            logger.info(f"{path.name} is being uploaded by {e.claimed_by or 'another uploader'}, will recheck")
+        except DuplicateUploadError:
+            logger.info(f"{path.name} was already uploaded, skipping")
+        except EmptyFileError:
+            logger.warning(f"{path.name} has no data rows, skipping")
+        except TRANSIENT_ERRORS as e:
+            retry = True
+            with self._lock:
+                failures = self._retry_at.get(path, (0, 0.0))[0] + 1
+                delay = min(self.poll_seconds * 2 ** (failures - 1), self.retry_max_seconds)
+                self._retry_at[path] = (failures, time.monotonic() + delay)
+            logger.warning(f"Transient failure ingesting {path.name} ({type(e).__name__}: {e}), "
+                           f"retry {failures} in {delay:.0f}s")
+            self._audit(logging.WARNING, "自动导入暂时失败，稍后重试", "WATCH_UPLOAD_RETRY", **audit,
+                        error_type=type(e).__name__, error_msg=str(e), attempt=failures)
+        except Exception as e:
+            # 内容错误（校验失败、无法解析等）保持当前状态不再重试，文件被替换或修改后会重新导入
+            logger.exception(f"Failed to ingest {path}")
+            self._audit(logging.ERROR, "自动导入失败", "WATCH_UPLOAD_FAILED", **audit,
+                        error_type=type(e).__name__, error_msg=str(e))
+        finally:
+            with self._lock:
+                if not retry:
+                    self._done[path] = state
+                    self._retry_at.pop(path, None)
+                self._in_flight.discard(path)
+
+    def run(self) -> None:
+        logger.info(f"Watching {self.directory} every {self.poll_seconds}s")
+        try:
+            while not self._stop.is_set():
+                try:
+                    for path in self.scan():
+                        self.submit(path)
+                except OSError as e:
+                    # 共享目录暂时不可用时下个周期重试
+                    logger.warning(f"Scan of {self.directory} failed: {e}")
+                self._stop.wait(self.poll_seconds)
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="监控目录并自动导入报表")
+    parser.add_argument("--config", default=str(WATCH_CONFIG_PATH), help="监控配置文件")
+    parser.add_argument("--directory", help="覆盖配置中的监控目录")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    config = load_watch_config(Path(args.config))
+    if args.directory:
+        config["directory"] = args.directory
+    watcher = FolderWatcher(config)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+if __name__ == "__main__":
+    main()